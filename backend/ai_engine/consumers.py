@@ -3,12 +3,17 @@ WebSocket消费者
 处理实时聊天连接和消息
 """
 
+import asyncio
 import json
 import logging
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from .core import ai_engine
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -20,6 +25,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """建立WebSocket连接"""
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         self.room_group_name = f'chat_{self.conversation_id}'
+        self._conversation_pk = None  # 首次落库后缓存会话主键，后续消息不再查询
+        self._pending_writes = set()  # 尚未完成的后台落库任务
         
         # 获取用户信息
         self.user = self.scope['user']
@@ -49,6 +56,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     async def disconnect(self, close_code):
         """断开WebSocket连接"""
+        # 等待未完成的落库任务，避免连接断开时丢失消息
+        if getattr(self, '_pending_writes', None):
+            await asyncio.gather(*self._pending_writes, return_exceptions=True)
         # 离开房间组
         await self.channel_layer.group_discard(
             self.room_group_name,
@@ -78,7 +88,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.error(f"处理WebSocket消息时出错: {str(e)}")
     
     async def handle_chat_message(self, data):
-        """处理聊天消息"""
+        """处理聊天消息：分析与回复在事件循环内完成，先广播，落库放到后台任务"""
         content = data.get('content', '')
         message_type = data.get('message_type', 'text')
         metadata = data.get('metadata', {})
@@ -86,36 +96,77 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not content:
             return
         
-        # 保存消息到数据库
-        message = await self.save_message(content, message_type, metadata)
-        
-        # 广播消息到房间组
+        # 消息尚未落库，先以本地ID广播，落库完成后再下发 local_id -> id 的映射
+        user_local_id = uuid.uuid4().hex
+        user_message = {
+            'id': None,
+            'local_id': user_local_id,
+            'content': content,
+            'message_type': message_type,
+            'sender': 'user',
+            'user': self.user.username,
+            'timestamp': timezone.now().isoformat(),
+            'metadata': metadata
+        }
         await self.channel_layer.group_send(
             self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': {
-                    'id': message.id,
-                    'content': content,
-                    'message_type': message_type,
-                    'sender': 'user',
-                    'user': self.user.username,
-                    'timestamp': message.timestamp.isoformat(),
-                    'metadata': metadata
-                }
-            }
+            {'type': 'chat_message', 'message': user_message}
         )
         
-        # 生成AI回复
-        ai_response = await self.generate_ai_response(content, message_type, metadata)
+        # 意图/情绪分析与模板选择均为轻量计算，直接在事件循环中使用共享引擎
+        response = ai_engine.process_user_input(
+            user_id=self.user.id,
+            input_data={
+                'content': content,
+                'message_type': message_type,
+                'metadata': metadata
+            }
+        )
+        ai_message = self.build_ai_message(response)
         
-        # 广播AI回复到房间组
+        # 广播AI回复到房间组（不等待落库）
         await self.channel_layer.group_send(
             self.room_group_name,
-            {
-                'type': 'ai_response',
-                'message': ai_response
+            {'type': 'ai_response', 'message': ai_message}
+        )
+        
+        task = asyncio.create_task(self.persist_exchange(user_message, response, ai_message))
+        self._pending_writes.add(task)
+        task.add_done_callback(self._pending_writes.discard)
+    
+    def build_ai_message(self, response):
+        """把引擎结果转换为广播给前端的AI消息"""
+        if not response.get('success', False):
+            return {
+                'id': None,
+                'content': '抱歉，我现在有点忙，稍后再和你聊天吧～',
+                'message_type': 'text',
+                'sender': 'ai',
+                'user': 'Mira',
+                'timestamp': None,
+                'metadata': {}
             }
+        return {
+            'id': None,
+            'local_id': uuid.uuid4().hex,
+            'content': response.get('content', ''),
+            'message_type': response.get('type', 'text'),
+            'sender': 'ai',
+            'user': 'Mira',
+            'timestamp': timezone.now().isoformat(),
+            'metadata': response.get('metadata', {})
+        }
+    
+    async def persist_exchange(self, user_message, response, ai_message):
+        """后台落库一轮对话，完成后广播本地ID与数据库ID的映射"""
+        try:
+            ids = await self.save_exchange(user_message, response, ai_message)
+        except Exception as e:
+            logger.error(f"保存对话消息失败: {str(e)}")
+            return
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {'type': 'message_saved', 'ids': ids}
         )
     
     async def handle_typing(self, data):
@@ -164,6 +215,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message': event['message']
         }))
     
+    async def message_saved(self, event):
+        """发送消息落库结果（local_id -> id）到WebSocket"""
+        await self.send(text_data=json.dumps({
+            'type': 'message_saved',
+            'ids': event['ids']
+        }))
+    
     async def user_typing(self, event):
         """发送用户输入状态到WebSocket"""
         await self.send(text_data=json.dumps({
@@ -181,101 +239,58 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }))
     
     @database_sync_to_async
-    def save_message(self, content, message_type, metadata):
-        """保存消息到数据库"""
-        from .models import AIConversation, AIMessage
+    def save_exchange(self, user_message, response, ai_message):
+        """在一个事务中保存用户消息、AI消息与AI回复记录，返回 {local_id: id}"""
+        from .models import AIConversation, AIMessage, AIResponse
         
-        # 获取或创建对话会话
-        conversation, created = AIConversation.objects.get_or_create(
-            user=self.user,
-            session_id=self.conversation_id,
-            defaults={
-                'ai_name': 'Mira',
-                'ai_avatar': '/images/ai-avatar.png'
-            }
-        )
-        
-        # 创建消息
-        message = AIMessage.objects.create(
-            conversation=conversation,
-            message_type=message_type,
-            sender='user',
-            content=content,
-            metadata=metadata
-        )
-        
-        return message
-    
-    @database_sync_to_async
-    def generate_ai_response(self, content, message_type, metadata):
-        """生成AI回复"""
-        from .core import AIEngine
-        
-        # 初始化AI引擎
-        ai_engine = AIEngine()
-        
-        # 生成回复
-        response = ai_engine.process_user_input(
-            user_id=self.user.id,
-            input_data={
-                'content': content,
-                'message_type': message_type,
-                'metadata': metadata
-            }
-        )
-        
-        if response.get('success', False):
-            # 保存AI回复到数据库
-            from .models import AIMessage, AIResponse
+        with transaction.atomic():
+            if self._conversation_pk is None:
+                # 获取或创建对话会话
+                conversation, created = AIConversation.objects.get_or_create(
+                    user=self.user,
+                    session_id=self.conversation_id,
+                    defaults={
+                        'ai_name': 'Mira',
+                        'ai_avatar': '/images/ai-avatar.png'
+                    }
+                )
+                self._conversation_pk = conversation.pk
             
-            conversation = AIConversation.objects.get(
-                user=self.user,
-                session_id=self.conversation_id
+            saved = AIMessage.objects.create(
+                conversation_id=self._conversation_pk,
+                message_type=user_message['message_type'],
+                sender='user',
+                content=user_message['content'],
+                metadata=user_message['metadata']
             )
+            ids = {user_message['local_id']: saved.id}
             
-            ai_message = AIMessage.objects.create(
-                conversation=conversation,
-                message_type=response.get('type', 'text'),
-                sender='ai',
-                content=response.get('content', ''),
-                content_url=response.get('content_url', ''),
-                metadata={
-                    'intent': response.get('intent', ''),
-                    'emotion': response.get('emotion', ''),
-                    'confidence': response.get('confidence', 0.8),
-                    'response_time': response.get('response_time', 0)
-                }
-            )
-            
-            AIResponse.objects.create(
-                message=ai_message,
-                response_content=response.get('content', ''),
-                response_type=response.get('type', 'text'),
-                response_url=response.get('content_url', ''),
-                confidence_score=response.get('confidence', 0.8),
-                response_time=response.get('response_time', 0),
-                model_used='virtual'
-            )
-            
-            return {
-                'id': ai_message.id,
-                'content': response.get('content', ''),
-                'message_type': response.get('type', 'text'),
-                'sender': 'ai',
-                'user': 'Mira',
-                'timestamp': ai_message.timestamp.isoformat(),
-                'metadata': response.get('metadata', {})
-            }
-        else:
-            return {
-                'id': None,
-                'content': '抱歉，我现在有点忙，稍后再和你聊天吧～',
-                'message_type': 'text',
-                'sender': 'ai',
-                'user': 'Mira',
-                'timestamp': None,
-                'metadata': {}
-            }
+            if response.get('success', False):
+                saved_ai = AIMessage.objects.create(
+                    conversation_id=self._conversation_pk,
+                    message_type=response.get('type', 'text'),
+                    sender='ai',
+                    content=response.get('content', ''),
+                    content_url=response.get('content_url', ''),
+                    metadata={
+                        'intent': response.get('intent', ''),
+                        'emotion': response.get('emotion', ''),
+                        'confidence': response.get('confidence', 0.8),
+                        'response_time': response.get('response_time', 0)
+                    }
+                )
+                AIResponse.objects.create(
+                    message=saved_ai,
+                    response_content=response.get('content', ''),
+                    response_type=response.get('type', 'text'),
+                    response_url=response.get('content_url', ''),
+                    confidence_score=response.get('confidence', 0.8),
+                    response_time=response.get('response_time', 0),
+                    model_used='virtual'
+                )
+                ids[ai_message['local_id']] = saved_ai.id
+        
+        return ids
     
     @database_sync_to_async
     def mark_message_as_read(self, message_id):
@@ -9,6 +9,7 @@ import random
 from typing import Dict, List, Any, Optional
 from django.conf import settings
 from django.contrib.auth.models import User
+from ai_engine.emotion_lexicon import SENTIMENT_WORDS, emotion_automaton
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +33,12 @@ class AIEngine:
         
         # 虚拟回复模板
         self.response_templates = self._init_response_templates()
+        # 意图规则与情感词表只构建一次，共享实例在进程内复用
+        self.intent_patterns = self._init_intent_patterns()
+        self.positive_words = SENTIMENT_WORDS['sentiment_positive']
+        self.negative_words = SENTIMENT_WORDS['sentiment_negative']
+        # 与 EmotionAnalyzer 共享导入时编译好的自动机，一次扫描判断所有词是否出现
+        self.emotion_automaton = emotion_automaton
     
     def process_user_input(self, user_id: int, input_data: dict) -> dict:
         """
@@ -83,23 +90,9 @@ class AIEngine:
         """
         content = input_data.get('content', '').lower()
         
-        # 意图识别规则
-        intent_patterns = {
-            'greeting': ['你好', 'hello', 'hi', '嗨', '在吗', '在不在'],
-            'weather_query': ['天气', 'weather', '下雨', '晴天', '温度'],
-            'emotion_comfort': ['心情', '心情不好', '难过', '伤心', '不开心', '郁闷'],
-            'music_request': ['音乐', '歌', '听歌', '推荐', '播放'],
-            'food_discussion': ['美食', '吃', '餐厅', '菜', '做饭'],
-            'movie_discussion': ['电影', '电视剧', '看剧', '推荐电影'],
-            'personal_question': ['你', '你的', '自己', '个人'],
-            'joke_request': ['笑话', '搞笑', '幽默', '段子'],
-            'time_query': ['时间', '几点', '日期', '今天', '明天'],
-            'general_chat': []  # 默认意图
-        }
-        
         # 计算意图匹配度
         intent_scores = {}
-        for intent, patterns in intent_patterns.items():
+        for intent, patterns in self.intent_patterns.items():
             score = 0
             for pattern in patterns:
                 if pattern in content:
@@ -129,19 +122,10 @@ class AIEngine:
         """
         content = input_data.get('content', '')
         
-        # 情感词汇库
-        positive_words = [
-            '开心', '高兴', '棒', '好', '喜欢', '爱', '棒棒', '优秀', '棒极了',
-            '太棒了', '真好', '不错', '满意', '快乐', '兴奋', '激动', '期待'
-        ]
-        negative_words = [
-            '难过', '伤心', '不好', '讨厌', '烦', '累', '糟糕', '失望', '痛苦',
-            '焦虑', '担心', '害怕', '生气', '愤怒', '沮丧', '绝望', '孤独'
-        ]
-        
         # 计算情感分数
-        positive_score = sum(1 for word in positive_words if word in content)
-        negative_score = sum(1 for word in negative_words if word in content)
+        counts = self.emotion_automaton.count(content)
+        positive_score = sum(1 for word in self.positive_words if word in counts)
+        negative_score = sum(1 for word in self.negative_words if word in counts)
         
         # 判断情感倾向
         if positive_score > negative_score:
@@ -269,6 +253,21 @@ class AIEngine:
         ]
         return random.choice(image_files)
     
+    def _init_intent_patterns(self) -> dict:
+        """初始化意图识别规则"""
+        return {
+            'greeting': ['你好', 'hello', 'hi', '嗨', '在吗', '在不在'],
+            'weather_query': ['天气', 'weather', '下雨', '晴天', '温度'],
+            'emotion_comfort': ['心情', '心情不好', '难过', '伤心', '不开心', '郁闷'],
+            'music_request': ['音乐', '歌', '听歌', '推荐', '播放'],
+            'food_discussion': ['美食', '吃', '餐厅', '菜', '做饭'],
+            'movie_discussion': ['电影', '电视剧', '看剧', '推荐电影'],
+            'personal_question': ['你', '你的', '自己', '个人'],
+            'joke_request': ['笑话', '搞笑', '幽默', '段子'],
+            'time_query': ['时间', '几点', '日期', '今天', '明天'],
+            'general_chat': []  # 默认意图
+        }
+
     def _init_response_templates(self) -> dict:
         """初始化回复模板"""
         return {
@@ -382,3 +381,7 @@ class AIEngine:
         # 
         # return hunyuan_client.HunyuanClient(cred, settings.TENCENT_CLOUD['REGION'])
         pass
+
+
+# 全局实例（预加载规则与模板，供视图与WebSocket消费者共享）
+ai_engine = AIEngine()
@@ -3,36 +3,21 @@ import re
 from typing import Dict, List, Tuple
 from django.utils import timezone
 from ai_engine.tencent_client import TencentDeepSeekClient
+from ai_engine.emotion_lexicon import EMOTION_KEYWORDS, INTENSITY_WORDS, emotion_automaton
 
 logger = logging.getLogger(__name__)
 
 class EmotionAnalyzer:
     """情绪分析器 - 分析用户消息的情绪状态"""
     
+    KEYWORD_MAX_CONFIDENCE = 0.8  # 批量关键词分析的置信度上限
+    
     def __init__(self):
-        # 情绪关键词库
-        self.emotion_keywords = {
-            'positive': [
-                '开心', '高兴', '快乐', '兴奋', '满足', '满意', '喜欢', '爱', '棒', '好',
-                '哈哈', '嘿嘿', '嘻嘻', '😊', '😄', '😁', '🥰', '😍', '👍', '💪'
-            ],
-            'negative': [
-                '难过', '伤心', '痛苦', '沮丧', '失望', '愤怒', '生气', '烦躁', '焦虑',
-                '压力', '累', '疲惫', '孤独', '寂寞', '想哭', '哭', '😢', '😭', '😔',
-                '😤', '😠', '😡', '😰', '😨', '😱', '💔'
-            ],
-            'neutral': [
-                '嗯', '哦', '好的', '知道', '明白', '了解', '是的', '不是', '可能',
-                '也许', '大概', '应该', '😐', '🤔', '😑'
-            ]
-        }
-        
-        # 情绪强度词汇
-        self.intensity_words = {
-            'high': ['非常', '特别', '超级', '极其', '十分', '很', '太', '真的'],
-            'medium': ['比较', '有点', '稍微', '还算'],
-            'low': ['一点', '稍微', '有点']
-        }
+        # 情绪关键词库与强度词汇
+        self.emotion_keywords = EMOTION_KEYWORDS
+        self.intensity_words = INTENSITY_WORDS
+        # 与 AIEngine 共享导入时编译好的自动机，一次扫描得到全部计数
+        self.keyword_automaton = emotion_automaton
     
     def analyze_text_emotion(self, text: str) -> Dict:
         """分析文本情绪"""
@@ -55,12 +40,11 @@ class EmotionAnalyzer:
     
     def _calculate_keyword_scores(self, text: str) -> Dict:
         """基于关键词计算情绪得分"""
-        scores = {'positive': 0, 'negative': 0, 'neutral': 0}
-        
-        for emotion, keywords in self.emotion_keywords.items():
-            for keyword in keywords:
-                count = text.count(keyword)
-                scores[emotion] += count
+        return self._normalize_keyword_scores(self.keyword_automaton.group_counts(text))
+    
+    def _normalize_keyword_scores(self, group_counts: Dict) -> Dict:
+        """各情绪关键词次数归一化为得分"""
+        scores = {emotion: group_counts.get(emotion, 0) for emotion in self.emotion_keywords}
         
         # 归一化得分
         total = sum(scores.values())
@@ -70,6 +54,40 @@ class EmotionAnalyzer:
         
         return scores
     
+    def _keyword_intensity(self, group_counts: Dict) -> str:
+        """按强度词判断情绪强度（高强度词优先），没有强度词时为 medium"""
+        for level in ('high', 'medium', 'low'):
+            if group_counts.get(level):
+                return level
+        return 'medium'
+    
+    def analyze_batch(self, texts: List[str]) -> List[Dict]:
+        """批量情绪分析（仅关键词，不调用AI）：所有文本一次扫描，用于历史回填"""
+        results = []
+        now = timezone.now().isoformat()
+        for counts, group_counts in self.keyword_automaton.count_and_group_batch(texts):
+            scores = self._normalize_keyword_scores(group_counts)
+            hits = sum(group_counts.get(emotion, 0) for emotion in self.emotion_keywords)
+            primary_emotion = max(scores, key=scores.get) if hits else 'neutral'
+            # 出现次数最多的主情绪关键词作为具体情绪（中性时为平静）
+            specific_emotion = '平静'
+            if hits and primary_emotion != 'neutral':
+                specific_emotion = max(self.emotion_keywords[primary_emotion], key=lambda word: counts.get(word, 0))
+            # 仅凭关键词的置信度：命中越多、主情绪占比越高越可信，上限低于AI分析
+            confidence = min(self.KEYWORD_MAX_CONFIDENCE, 0.3 + 0.1 * hits)
+            if hits:
+                confidence *= scores[primary_emotion]
+            results.append({
+                'primary_emotion': primary_emotion,
+                'emotion_scores': scores,
+                'intensity': self._keyword_intensity(group_counts),
+                'specific_emotion': specific_emotion,
+                'confidence': confidence,
+                'reasoning': '关键词分析',
+                'timestamp': now
+            })
+        return results
+    
     def _ai_emotion_analysis(self, text: str) -> Dict:
         """使用AI进行情绪分析"""
         try:
@@ -0,0 +1,47 @@
+"""
+情绪词表
+EmotionAnalyzer 的情绪词与强度词、AIEngine 的褒贬词集中在这里，
+导入时编译成一个共享的关键词自动机，各处从同一个自动机按组读取计数
+"""
+
+from ai_engine.keyword_automaton import KeywordAutomaton
+
+# 情绪关键词库（EmotionAnalyzer）
+EMOTION_KEYWORDS = {
+    'positive': [
+        '开心', '高兴', '快乐', '兴奋', '满足', '满意', '喜欢', '爱', '棒', '好',
+        '哈哈', '嘿嘿', '嘻嘻', '😊', '😄', '😁', '🥰', '😍', '👍', '💪'
+    ],
+    'negative': [
+        '难过', '伤心', '痛苦', '沮丧', '失望', '愤怒', '生气', '烦躁', '焦虑',
+        '压力', '累', '疲惫', '孤独', '寂寞', '想哭', '哭', '😢', '😭', '😔',
+        '😤', '😠', '😡', '😰', '😨', '😱', '💔'
+    ],
+    'neutral': [
+        '嗯', '哦', '好的', '知道', '明白', '了解', '是的', '不是', '可能',
+        '也许', '大概', '应该', '😐', '🤔', '😑'
+    ]
+}
+
+# 情绪强度词汇（EmotionAnalyzer）
+INTENSITY_WORDS = {
+    'high': ['非常', '特别', '超级', '极其', '十分', '很', '太', '真的'],
+    'medium': ['比较', '有点', '稍微', '还算'],
+    'low': ['一点', '稍微', '有点']
+}
+
+# 褒贬词汇（AIEngine 的虚拟情绪分析）
+SENTIMENT_WORDS = {
+    'sentiment_positive': [
+        '开心', '高兴', '棒', '好', '喜欢', '爱', '棒棒', '优秀', '棒极了',
+        '太棒了', '真好', '不错', '满意', '快乐', '兴奋', '激动', '期待'
+    ],
+    'sentiment_negative': [
+        '难过', '伤心', '不好', '讨厌', '烦', '累', '糟糕', '失望', '痛苦',
+        '焦虑', '担心', '害怕', '生气', '愤怒', '沮丧', '绝望', '孤独'
+    ],
+}
+
+
+# 全局实例
+emotion_automaton = KeywordAutomaton({**EMOTION_KEYWORDS, **INTENSITY_WORDS, **SENTIMENT_WORDS})
@@ -0,0 +1,113 @@
+"""
+关键词自动机（Aho–Corasick）
+把多组关键词编译成一个确定自动机，一次扫描文本即可得到每个关键词的出现次数，
+替代“每个关键词各调用一次 str.count”的多次全文扫描（各长度文本的耗时对比见 benchmark_keyword_scoring）。
+计数口径与 str.count 一致：同一关键词不重叠计数，不同关键词之间互不影响（“好的”同时计入“好”）
+"""
+
+import re
+from collections import deque
+
+
+class KeywordAutomaton:
+    """多组关键词的一次扫描计数"""
+
+    def __init__(self, groups):
+        """groups: {组名: [关键词, ...]}；同一关键词可属于多个组"""
+        self.groups = {label: list(dict.fromkeys(words)) for label, words in groups.items()}
+        self.keywords = list(dict.fromkeys(word for words in self.groups.values() for word in words if word))
+        self._lengths = [len(word) for word in self.keywords]
+        # 关键词序号 -> 所属组名
+        self._labels = [
+            tuple(label for label, words in self.groups.items() if word in words) for word in self.keywords
+        ]
+        self._delta, self._outputs = self._compile()
+        # 关键词字符组成的连续片段（空关键词表时不匹配任何字符）
+        alphabet = ''.join(sorted(set(''.join(self.keywords))))
+        self._runs = re.compile(f"[{re.escape(alphabet)}]+" if alphabet else r'(?!)')
+
+    def _compile(self):
+        # 字典树
+        goto = [{}]
+        outputs = [()]
+        for keyword_id, word in enumerate(self.keywords):
+            state = 0
+            for char in word:
+                nxt = goto[state].get(char)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][char] = nxt
+                    goto.append({})
+                    outputs.append(())
+                state = nxt
+            outputs[state] = outputs[state] + (keyword_id,)
+
+        # 按层（BFS）计算失败指针，并把失败链上的转移与输出并入本状态，得到完整的确定自动机
+        fail = [0] * len(goto)
+        delta = [None] * len(goto)
+        delta[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            inherited = delta[fail[state]]
+            for char, nxt in goto[state].items():
+                fail[nxt] = inherited.get(char, 0) if state else 0
+                queue.append(nxt)
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            delta[state] = {**inherited, **goto[state]}
+        # 没有任何输出的状态用 None 标记，扫描时跳过
+        return delta, [out or None for out in outputs]
+
+    def _scan(self, text):
+        """一次扫描，返回 {关键词序号: 不重叠出现次数}（只含出现过的关键词）"""
+        counts = {}
+        last_end = {}  # 各关键词上一次计数的结束位置
+        delta, outputs, lengths = self._delta, self._outputs, self._lengths
+        # 不属于任何关键词的字符必然让自动机回到根状态，只需逐字扫描由关键词字符组成的片段
+        for run in self._runs.finditer(text):
+            state = 0
+            for position, char in enumerate(run.group(), run.start()):
+                state = delta[state].get(char, 0)
+                matched = outputs[state]
+                if matched is None:
+                    continue
+                for keyword_id in matched:
+                    # 与 str.count 一致：同一关键词从左到右不重叠
+                    if position - lengths[keyword_id] >= last_end.get(keyword_id, -1):
+                        counts[keyword_id] = counts.get(keyword_id, 0) + 1
+                        last_end[keyword_id] = position
+        return counts
+
+    def _words(self, counts):
+        keywords = self.keywords
+        return {keywords[keyword_id]: n for keyword_id, n in counts.items()}
+
+    def _groups(self, counts):
+        result = dict.fromkeys(self.groups, 0)
+        for keyword_id, n in counts.items():
+            for label in self._labels[keyword_id]:
+                result[label] += n
+        return result
+
+    def count(self, text):
+        """返回 {关键词: 次数}（只含出现过的关键词）"""
+        return self._words(self._scan(text or ''))
+
+    def group_counts(self, text):
+        """返回 {组名: 组内关键词出现次数之和}"""
+        return self._groups(self._scan(text or ''))
+
+    def count_batch(self, texts):
+        """批量计数，返回与 texts 等长的 [{关键词: 次数}]"""
+        return [self._words(counts) for counts in map(self._scan, [text or '' for text in texts])]
+
+    def group_counts_batch(self, texts):
+        """批量分组计数，返回与 texts 等长的 [{组名: 次数}]"""
+        return [self._groups(counts) for counts in map(self._scan, [text or '' for text in texts])]
+
+    def count_and_group_batch(self, texts):
+        """批量计数，返回 [({关键词: 次数}, {组名: 次数})]"""
+        return [
+            (self._words(counts), self._groups(counts))
+            for counts in map(self._scan, [text or '' for text in texts])
+        ]
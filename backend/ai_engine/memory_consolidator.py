@@ -0,0 +1,190 @@
+"""
+记忆整理
+UserMemory 的重要性只会经 max() 上调、相近的键（pet_name / dog_name）不断累积。
+整理任务按用户分批执行：按闲置时间衰减重要性，合并同类型下键或值相近的记忆，
+把长期冷门与超出每用户上限的记忆移入 ArchivedMemory，热表保持有界；
+已删除（is_active=False）的记忆留在热表作为墓碑，避免下次提取按同一个键把它重新写回。
+处理进度以检查点记在缓存中，中断后从下一个用户继续；
+主动触发引擎每天开启一轮、每个周期任务整理一批，也可用 consolidate_memories 命令手动执行
+"""
+
+import difflib
+import logging
+import re
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from ai_engine.memory_index import memory_index
+
+logger = logging.getLogger(__name__)
+
+DIGITS = re.compile(r'\d+')
+
+
+class MemoryConsolidator:
+    """记忆衰减、去重、归档与限额"""
+
+    MAX_PER_USER = getattr(settings, 'MEMORY_MAX_PER_USER', 200)  # 每个用户热表中最多保留的记忆数
+    DECAY_HALF_LIFE_DAYS = getattr(settings, 'MEMORY_DECAY_HALF_LIFE_DAYS', 60)  # 闲置多久重要性减半
+    COLD_IMPORTANCE = getattr(settings, 'MEMORY_COLD_IMPORTANCE', 0.1)  # 衰减到该值以下且长期闲置视为冷门
+    COLD_IDLE_DAYS = getattr(settings, 'MEMORY_COLD_IDLE_DAYS', 90)
+    # 两种情形视为重复：键几乎相同且值大致相近（favorite_food / favourite_food），
+    # 或值几乎相同且键大致相近（pet_name / dog_name）
+    KEY_SIMILARITY = 0.85
+    LOOSE_VALUE_SIMILARITY = 0.5
+    VALUE_SIMILARITY = 0.9
+    LOOSE_KEY_SIMILARITY = 0.5
+    BATCH_USERS = 100
+    CHECKPOINT_KEY = 'memory_consolidation_checkpoint'  # 本轮已处理到的最大用户ID
+
+    # -------------------- 单个用户 --------------------
+    def _decay(self, memory, now):
+        """按上次衰减或访问（取较晚者）以来的闲置时间衰减，重复执行不会叠加"""
+        since = max(filter(None, (memory.decayed_at, memory.last_accessed)), default=now)
+        idle_days = max((now - since).total_seconds(), 0) / 86400
+        memory.importance_score *= 0.5 ** (idle_days / self.DECAY_HALF_LIFE_DAYS)
+        memory.decayed_at = now
+
+    @staticmethod
+    def _ratio(a, b):
+        matcher = difflib.SequenceMatcher(None, a, b)
+        # quick_ratio 是 ratio 的上界，先用它排除明显不相似的组合
+        return matcher.ratio() if matcher.quick_ratio() >= 0.5 else 0.0
+
+    def is_duplicate(self, a, b):
+        if a.memory_type != b.memory_type:
+            return False
+        # 只有编号不同的键（child1_name / child2_name）是不同的记忆
+        if DIGITS.findall(a.key) != DIGITS.findall(b.key):
+            return False
+        key_ratio = self._ratio(a.key.lower(), b.key.lower())
+        if key_ratio < self.LOOSE_KEY_SIMILARITY:
+            return False
+        value_ratio = self._ratio(a.value, b.value)
+        return (value_ratio >= self.VALUE_SIMILARITY
+                or (key_ratio >= self.KEY_SIMILARITY and value_ratio >= self.LOOSE_VALUE_SIMILARITY))
+
+    def _archive_row(self, memory, reason, merged_into=''):
+        from chat_system.models import ArchivedMemory
+
+        return ArchivedMemory(
+            user_id=memory.user_id,
+            memory_type=memory.memory_type,
+            key=memory.key,
+            value=memory.value,
+            context=memory.context,
+            importance_score=memory.importance_score,
+            last_accessed=memory.last_accessed,
+            created_at=memory.created_at,
+            reason=reason,
+            merged_into=merged_into,
+        )
+
+    def consolidate_user(self, user_id, now=None, dry_run=False):
+        """整理一个用户的记忆，返回各类处理数量"""
+        from chat_system.models import ArchivedMemory, MemoryEvent, UserMemory
+
+        now = now or timezone.now()
+        stats = {'decayed': 0, 'duplicate': 0, 'cold': 0, 'cap': 0}
+        with transaction.atomic():
+            # 已删除的记忆是墓碑：保留在热表中，upsert 只更新内容不会重新启用，不参与整理
+            memories = list(UserMemory.objects.select_for_update().filter(
+                user_id=user_id, is_active=True
+            ).defer('embedding'))
+            # 还有待提醒日期的事件记忆不归档
+            protected = set(MemoryEvent.objects.filter(user_id=user_id, is_active=True).values_list(
+                'memory_id', flat=True
+            ))
+            archived = []
+
+            for memory in memories:
+                self._decay(memory, now)
+            stats['decayed'] = len(memories)
+
+            # 新的记忆优先保留：按最近访问时间从新到旧，与已保留的同类记忆比较
+            memories.sort(key=lambda memory: memory.last_accessed, reverse=True)
+            kept = []
+            for memory in memories:
+                survivor = None
+                if memory.id not in protected:
+                    survivor = next((other for other in kept if self.is_duplicate(memory, other)), None)
+                if survivor is None:
+                    kept.append(memory)
+                    continue
+                survivor.importance_score = max(survivor.importance_score, memory.importance_score)
+                archived.append(self._archive_row(memory, 'duplicate', survivor.key))
+                stats['duplicate'] += 1
+
+            remaining = []
+            for memory in kept:
+                idle_days = (now - memory.last_accessed).total_seconds() / 86400
+                if (memory.id not in protected and memory.importance_score < self.COLD_IMPORTANCE
+                        and idle_days >= self.COLD_IDLE_DAYS):
+                    archived.append(self._archive_row(memory, 'cold'))
+                    stats['cold'] += 1
+                else:
+                    remaining.append(memory)
+
+            # 超出上限时按重要性、最近访问保留（待提醒的事件记忆排在最前）
+            remaining.sort(key=lambda memory: (
+                memory.id in protected, memory.importance_score, memory.last_accessed
+            ), reverse=True)
+            for memory in remaining[self.MAX_PER_USER:]:
+                archived.append(self._archive_row(memory, 'cap'))
+                stats['cap'] += 1
+            remaining = remaining[:self.MAX_PER_USER]
+
+            if dry_run:
+                transaction.set_rollback(True)
+                return stats
+
+            archived_ids = {memory.id for memory in memories} - {memory.id for memory in remaining}
+            if archived:
+                ArchivedMemory.objects.bulk_create(archived, batch_size=500)
+                # 关联的事件日历随记忆级联删除
+                UserMemory.objects.filter(id__in=archived_ids).delete()
+            # bulk_update 不会触发 last_accessed 的 auto_now，衰减不算一次访问
+            UserMemory.objects.bulk_update(remaining, ['importance_score', 'decayed_at'], batch_size=500)
+            # 批量写入绕过了模型钩子：提交后递增记忆版本，检索索引与上下文缓存随之失效
+            # 归档删除了记忆、衰减改写了重要性，记忆向量缓存需整体重建
+            transaction.on_commit(lambda: memory_index.invalidate(user_id, reload=True))
+        return stats
+
+    # -------------------- 分批与检查点 --------------------
+    def get_checkpoint(self):
+        return cache.get(self.CHECKPOINT_KEY) or 0
+
+    def reset_checkpoint(self):
+        cache.delete(self.CHECKPOINT_KEY)
+
+    def run_batch(self, batch_size=None, pause=0.0):
+        """从检查点之后整理一批用户，返回 (处理的用户数, 汇总, 本轮是否已完成)"""
+        from chat_system.models import UserMemory
+
+        batch_size = batch_size or self.BATCH_USERS
+        checkpoint = self.get_checkpoint()
+        user_ids = list(
+            UserMemory.objects.filter(user_id__gt=checkpoint).order_by('user_id')
+            .values_list('user_id', flat=True).distinct()[:batch_size]
+        )
+        totals = {}
+        for user_id in user_ids:
+            try:
+                for name, count in self.consolidate_user(user_id).items():
+                    totals[name] = totals.get(name, 0) + count
+            except Exception as e:
+                logger.error(f"整理用户记忆失败 user_id={user_id}: {e}")
+            # 每个用户处理完即推进检查点
+            cache.set(self.CHECKPOINT_KEY, user_id, timeout=None)
+            if pause:
+                time.sleep(pause)
+        finished = len(user_ids) < batch_size
+        if finished:
+            self.reset_checkpoint()
+        return len(user_ids), totals, finished
+
+
+# 全局实例
+memory_consolidator = MemoryConsolidator()
@@ -0,0 +1,357 @@
+"""
+后台记忆提取
+每个会话记录已提取到的最后一条消息ID（水位）。用户发消息时只把会话标记为“待提取”，
+后台线程在新消息累计到一定条数或会话空闲一段时间后，只提取水位之后的增量对话，
+并把多个会话合并进一次大模型调用；提取失败时水位不前进，下一轮重试
+"""
+
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from chat_system.redis_client import get_redis_client, redis_key
+from ai_engine.memory_manager import memory_manager
+from ai_engine.tencent_client import TencentDeepSeekClient
+
+logger = logging.getLogger(__name__)
+
+# 只删除自己持有的锁：锁已过期并被其他进程取得时不误删
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class MemoryExtractor:
+    """按会话水位增量提取记忆"""
+
+    DIRTY_KEY = 'memory_dirty_sessions'  # 有未提取消息的会话主键集合
+    URGENT_KEY = 'memory_urgent_sessions'  # 用户主动请求、下一轮立即提取的会话
+    LOCK_KEY = 'memory_extractor_lock'  # 多进程时同一时刻只有一个进程执行提取
+    LOCK_TTL = 300
+    BATCH_MESSAGES = 6  # 累计这么多条新的用户消息即提取
+    IDLE_SECONDS = 300  # 会话空闲这么久后提取剩余的增量
+    POLL_INTERVAL = 30
+    MAX_MESSAGES_PER_SESSION = 60  # 单个会话一次最多提取的消息数，其余留到下一轮
+    MAX_SESSIONS_PER_CALL = 5  # 一次大模型调用最多合并的会话数
+    MAX_CHARS_PER_CALL = 6000  # 一次调用的对话文本上限
+    FILTER_CHUNK = 200  # 每条查询合并的会话水位条件数（SQLite 表达式树深度上限约 1000）
+
+    def __init__(self):
+        self.consumer_name = f"{socket.gethostname()}:{os.getpid()}"
+        self._local_dirty = set()  # 非 Redis 缓存后端时的进程内集合
+        self._local_urgent = set()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._release_script = None
+
+    # -------------------- 热路径 --------------------
+    def mark_dirty(self, session_pk, urgent=False):
+        """会话有新消息（一次 SADD）；urgent 时下一轮不等阈值直接提取"""
+        keys = (self.DIRTY_KEY, self.URGENT_KEY) if urgent else (self.DIRTY_KEY,)
+        client = get_redis_client()
+        if client is None:
+            self._local_dirty.add(int(session_pk))
+            if urgent:
+                self._local_urgent.add(int(session_pk))
+        else:
+            for key in keys:
+                client.sadd(redis_key(key), session_pk)
+        if urgent:
+            self._wakeup.set()
+
+    # -------------------- 待提取集合 --------------------
+    def _members(self, key, local):
+        client = get_redis_client()
+        if client is None:
+            return set(local)
+        return {int(member) for member in client.smembers(redis_key(key))}
+
+    def _remove(self, session_pks):
+        if not session_pks:
+            return
+        client = get_redis_client()
+        if client is None:
+            self._local_dirty.difference_update(session_pks)
+            self._local_urgent.difference_update(session_pks)
+            return
+        for key in (self.DIRTY_KEY, self.URGENT_KEY):
+            client.srem(redis_key(key), *session_pks)
+
+    def _delta_filters(self, watermarks):
+        """各会话水位之后的消息，每 FILTER_CHUNK 个会话合并为一个 OR 条件（一次查询覆盖一批会话）"""
+        items = list(watermarks.items())
+        for i in range(0, len(items), self.FILTER_CHUNK):
+            condition = Q()
+            for session_pk, last_id in items[i:i + self.FILTER_CHUNK]:
+                condition |= Q(session_id=session_pk, id__gt=last_id)
+            yield condition
+
+    def _load_watermarks(self, session_pks):
+        from chat_system.models import MemoryExtractionWatermark
+
+        watermarks = dict.fromkeys(session_pks, 0)
+        watermarks.update(MemoryExtractionWatermark.objects.filter(session_id__in=session_pks).values_list(
+            'session_id', 'last_message_id'
+        ))
+        return watermarks
+
+    def _ready_sessions(self, watermarks, urgent):
+        """按增量聚合判断哪些会话该提取，返回 (就绪会话, 已无增量的会话)"""
+        from chat_system.models import Message
+
+        idle_before = timezone.now() - timedelta(seconds=self.IDLE_SECONDS)
+        ready, pending = [], set()
+        for condition in self._delta_filters(watermarks):
+            stats = Message.objects.filter(condition).values('session_id').annotate(
+                user_messages=Count('id', filter=Q(sender='user')),
+                last_at=Max('timestamp'),
+            )
+            for row in stats:
+                session_pk = row['session_id']
+                pending.add(session_pk)
+                if (session_pk in urgent or row['user_messages'] >= self.BATCH_MESSAGES
+                        or row['last_at'] <= idle_before):
+                    ready.append(session_pk)
+        return ready, set(watermarks) - pending
+
+    def _load_deltas(self, watermarks):
+        """读取就绪会话水位之后的消息，返回 {会话主键: (最后消息ID, 对话文本)}
+
+        按时间顺序取消息直到条数或文本长度达到上限，最后消息ID 只到实际放入文本的那条，
+        超出部分留在水位之后，由下一轮继续提取
+        """
+        from chat_system.models import Message
+
+        grouped = {}
+        for condition in self._delta_filters(watermarks):
+            rows = Message.objects.filter(condition, content_type='text').order_by(
+                'session_id', 'id'
+            ).values_list('session_id', 'id', 'sender', 'content')
+            for session_pk, message_id, sender, content in rows:
+                grouped.setdefault(session_pk, []).append((message_id, sender, content))
+        deltas = {}
+        for session_pk, messages in grouped.items():
+            lines, size, last_id = [], 0, None
+            for message_id, sender, content in messages[:self.MAX_MESSAGES_PER_SESSION]:
+                line = f"{'用户' if sender == 'user' else 'Mira'}：{content}"
+                if lines and size + len(line) + 1 > self.MAX_CHARS_PER_CALL:
+                    break
+                # 单条消息本身超长时只取开头
+                lines.append(line[:self.MAX_CHARS_PER_CALL])
+                size += len(lines[-1]) + 1
+                last_id = message_id
+            deltas[session_pk] = (last_id, '\n'.join(lines))
+        return deltas
+
+    # -------------------- 提取 --------------------
+    def _build_prompt(self, sections):
+        """多段对话合并为一个提示词，要求按段落标签返回"""
+        blocks = '\n\n'.join(f"【{label}】\n{text}" for label, text in sections)
+        labels = '、'.join(label for label, _ in sections)
+        return f"""你是Mira的记忆提取助手。下面是 {len(sections)} 段彼此独立的对话（分别来自不同会话），请分别从每段中提取关于该段用户的重要信息。
+
+{blocks}
+
+请提取以下类型的信息：个人信息（personal）、偏好（preference）、人际关系（relationship）、重要事件（event）、情绪状态（emotion）。
+
+返回一个JSON对象，键为段落标签（{labels}），值为该段提取出的记忆数组：
+{{
+    "{sections[0][0]}": [
+        {{
+            "memory_type": "personal",
+            "key": "pet_name",
+            "value": "小白",
+            "context": "用户提到养了一只叫小白的狗",
+            "importance_score": 0.8
+        }}
+    ]
+}}
+
+注意：
+- 只提取明确提到的信息，不同段落的信息不要混在一起
+- importance_score: 0.1-1.0，越重要分数越高
+- 重要事件（event）如果提到了日期，额外返回 "date" 字段，格式为 YYYY-MM-DD，不知道年份时为 MM-DD
+- 某段没有值得记忆的信息时，该段返回空数组[]
+- 确保JSON格式正确"""
+
+    def _parse_response(self, response):
+        """解析按标签分组的结果；无法解析时返回 None"""
+        try:
+            result = json.loads(response)
+        except json.JSONDecodeError:
+            match = re.search(r'\{.*\}', response or '', re.DOTALL)
+            try:
+                result = json.loads(match.group()) if match else None
+            except json.JSONDecodeError:
+                result = None
+        if not isinstance(result, dict):
+            logger.warning(f"无法解析批量记忆响应: {response}")
+            return None
+        return {label: items for label, items in result.items() if isinstance(items, list)}
+
+    def _group_calls(self, deltas):
+        """把就绪会话装箱成若干次调用（会话数与文本长度均有上限）"""
+        calls, current, size = [], [], 0
+        for session_pk, (_, text) in deltas.items():
+            if current and (len(current) >= self.MAX_SESSIONS_PER_CALL or size + len(text) > self.MAX_CHARS_PER_CALL):
+                calls.append(current)
+                current, size = [], 0
+            current.append(session_pk)
+            size += len(text)
+        if current:
+            calls.append(current)
+        return calls
+
+    def _extract_call(self, session_pks, deltas):
+        """一次大模型调用提取多个会话；成功返回 {会话主键: 记忆列表}，调用失败返回 None"""
+        sections = [(f"S{i + 1}", deltas[session_pk][1]) for i, session_pk in enumerate(session_pks)]
+        client = TencentDeepSeekClient()
+        result = client.chat([{"Role": "user", "Content": self._build_prompt(sections)}])
+        if not result.get('success'):
+            logger.warning(f"批量记忆提取调用失败: {result.get('error')}")
+            return None
+        parsed = self._parse_response(result.get('text', ''))
+        # 响应无法解析时按“无可提取内容”处理，水位照常前进，避免同一段对话反复重试
+        parsed = parsed or {}
+        return {session_pk: parsed.get(label, []) for (label, _), session_pk in zip(sections, session_pks)}
+
+    def _advance(self, watermarks):
+        """批量推进水位（一条 upsert）"""
+        from chat_system.models import MemoryExtractionWatermark
+
+        now = timezone.now()
+        MemoryExtractionWatermark.objects.bulk_create(
+            [
+                MemoryExtractionWatermark(session_id=session_pk, last_message_id=last_id, updated_at=now)
+                for session_pk, last_id in watermarks.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['session'],
+            update_fields=['last_message_id', 'updated_at'],
+        )
+
+    def process_once(self):
+        """执行一轮提取，返回本轮处理的会话数"""
+        from chat_system.models import ChatSession
+
+        dirty = self._members(self.DIRTY_KEY, self._local_dirty)
+        if not dirty:
+            return 0
+        urgent = self._members(self.URGENT_KEY, self._local_urgent)
+        watermarks = self._load_watermarks(dirty)
+        ready, drained = self._ready_sessions(watermarks, urgent)
+        # 水位之后已无消息的会话直接移出集合
+        self._remove(drained)
+        if not ready:
+            return 0
+
+        deltas = self._load_deltas({session_pk: watermarks[session_pk] for session_pk in ready})
+        sessions = {
+            row['id']: row for row in ChatSession.objects.filter(id__in=ready).values('id', 'session_id', 'user_id')
+        }
+        users = User.objects.in_bulk({row['user_id'] for row in sessions.values()})
+        advanced = {}
+        for call in self._group_calls(deltas):
+            try:
+                extracted = self._extract_call(call, deltas)
+            except Exception as e:
+                logger.error(f"批量记忆提取失败: {e}")
+                extracted = None
+            if extracted is None:
+                continue
+            for session_pk, items in extracted.items():
+                session, (last_id, text) = sessions.get(session_pk), deltas[session_pk]
+                user = users.get(session['user_id']) if session else None
+                if user is None:
+                    # 会话已在提取期间删除
+                    continue
+                memory_manager._save_memories(user, items, text)
+                memory_manager._record_conversation_history(user, session['session_id'], text, items)
+                advanced[session_pk] = last_id
+        # 只有非文本增量的会话也推进水位
+        for session_pk in ready:
+            if session_pk in sessions and session_pk not in deltas:
+                advanced[session_pk] = self._last_message_id(session_pk, watermarks[session_pk])
+        if advanced:
+            self._advance(advanced)
+            self._remove(list(advanced))
+            self._requeue(advanced)
+        logger.info(f"后台记忆提取: 就绪 {len(ready)} 个会话，完成 {len(advanced)} 个")
+        return len(advanced)
+
+    @staticmethod
+    def _last_message_id(session_pk, last_id):
+        from chat_system.models import Message
+
+        return Message.objects.filter(session_id=session_pk, id__gt=last_id).aggregate(
+            last=Max('id')
+        )['last'] or last_id
+
+    def _requeue(self, advanced):
+        """移出集合期间到达的新消息：仍有增量的会话重新标记（消息先入库后标记，不会漏掉）"""
+        from chat_system.models import Message
+
+        for condition in self._delta_filters(advanced):
+            remaining = Message.objects.filter(condition).values_list('session_id', flat=True).distinct()
+            for session_pk in remaining:
+                self.mark_dirty(session_pk)
+
+    # -------------------- 进程间互斥 --------------------
+    def acquire_lock(self):
+        """取得提取锁，成功时返回本次持有的令牌，否则返回 None"""
+        token = f"{self.consumer_name}:{uuid.uuid4().hex}"
+        client = get_redis_client()
+        if client is None:
+            return token if cache.add(self.LOCK_KEY, token, timeout=self.LOCK_TTL) else None
+        return token if client.set(redis_key(self.LOCK_KEY), token, nx=True, ex=self.LOCK_TTL) else None
+
+    def release_lock(self, token):
+        """令牌一致时才释放：本轮超过 LOCK_TTL 后锁可能已归其他进程"""
+        client = get_redis_client()
+        if client is None:
+            if cache.get(self.LOCK_KEY) == token:
+                cache.delete(self.LOCK_KEY)
+            return
+        if self._release_script is None:
+            self._release_script = client.register_script(RELEASE_LOCK_SCRIPT)
+        self._release_script(keys=[redis_key(self.LOCK_KEY)], args=[token], client=client)
+
+    # -------------------- 后台线程 --------------------
+    def run_forever(self):
+        logger.info("后台记忆提取启动")
+        while True:
+            self._wakeup.wait(self.POLL_INTERVAL)
+            self._wakeup.clear()
+            token = self.acquire_lock()
+            if token is None:
+                continue
+            try:
+                close_old_connections()
+                self.process_once()
+            except Exception as e:
+                logger.error(f"后台记忆提取失败: {e}")
+            finally:
+                self.release_lock(token)
+
+    def start(self):
+        """启动后台提取线程（每进程一个，多进程间由锁互斥）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self.run_forever, daemon=True)
+        self._thread.start()
+
+
+# 全局实例
+memory_extractor = MemoryExtractor()
@@ -0,0 +1,248 @@
+"""
+用户记忆倒排索引
+对 key / value / context 做分词：中文连续片段取字符二元、三元组（单字片段取单字），英文与数字按词切分；
+每个用户一份进程内索引，按 BM25 打分并与 importance_score 加权融合排序。
+记忆保存与软删除时增量更新本进程索引，并递增缓存中的 memory_version:{uid}，其他进程发现版本变化后重建；
+删除记忆或批量改写已有记忆时另外递增 memory_reload_version:{uid}，记忆向量缓存据此区分增量刷新与整体重建
+"""
+
+import logging
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CJK_RUN = re.compile(r'[㐀-䶿一-鿿豈-﫿]+')
+WORD = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """切分为检索词：中文片段的二元/三元组（单字片段保留单字），英文/数字单词"""
+    if not text:
+        return []
+    text = text.lower()
+    tokens = WORD.findall(text)
+    for run in CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+            continue
+        for n in (2, 3):
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+class UserIndex:
+    """单个用户的倒排索引"""
+
+    def __init__(self, version):
+        self.version = version
+        self.postings = {}  # 词 -> {记忆ID: 词频}
+        self.doc_tokens = {}  # 记忆ID -> 词集合（删除时定位倒排项）
+        self.doc_lengths = {}  # 记忆ID -> 词数
+        self.importance = {}  # 记忆ID -> 重要性
+        self.char_grams = {}  # 汉字 -> 含该字的二元组（单字检索时展开，可能含已失效的词）
+        self.total_length = 0
+
+    def add(self, memory_id, text, importance):
+        self.remove(memory_id)
+        counts = Counter(tokenize(text))
+        for token, tf in counts.items():
+            self.postings.setdefault(token, {})[memory_id] = tf
+            if len(token) == 2 and CJK_RUN.fullmatch(token):
+                for char in token:
+                    self.char_grams.setdefault(char, set()).add(token)
+        length = sum(counts.values())
+        self.doc_tokens[memory_id] = tuple(counts)
+        self.doc_lengths[memory_id] = length
+        self.importance[memory_id] = importance
+        self.total_length += length
+
+    def postings_for(self, token):
+        """检索词的倒排表；单个汉字合并所有含该字的二元组（每个字出现在约两个二元组中）"""
+        if len(token) != 1 or not CJK_RUN.fullmatch(token):
+            return self.postings.get(token)
+        merged = dict(self.postings.get(token) or {})
+        for gram in self.char_grams.get(token, ()):
+            for memory_id, tf in (self.postings.get(gram) or {}).items():
+                merged[memory_id] = merged.get(memory_id, 0) + tf
+        return {memory_id: max(1, tf // 2) for memory_id, tf in merged.items()}
+
+    def remove(self, memory_id):
+        if memory_id not in self.doc_lengths:
+            return
+        self.total_length -= self.doc_lengths.pop(memory_id)
+        self.importance.pop(memory_id, None)
+        for token in self.doc_tokens.pop(memory_id, ()):
+            docs = self.postings.get(token)
+            if docs is None:
+                continue
+            docs.pop(memory_id, None)
+            if not docs:
+                del self.postings[token]
+
+
+class MemoryIndex:
+    """记忆检索：每用户倒排索引 + BM25/重要性融合排序"""
+
+    K1 = 1.2
+    B = 0.75
+    IMPORTANCE_WEIGHT = 0.3  # 最终得分中重要性所占比重
+    MAX_USERS = 2048  # 进程内最多保留的用户索引数（LRU）
+    VERSION_TTL = None  # 版本号不过期
+
+    def __init__(self):
+        self._indexes = OrderedDict()
+        self._lock = threading.RLock()
+
+    # -------------------- 版本 --------------------
+    @staticmethod
+    def version_key(user_id):
+        return f"memory_version:{user_id}"
+
+    @staticmethod
+    def reload_key(user_id):
+        return f"memory_reload_version:{user_id}"
+
+    def current_version(self, user_id):
+        """用户记忆的版本号；记忆有任何变化都会递增"""
+        return cache.get(self.version_key(user_id)) or 0
+
+    def versions(self, user_id):
+        """一次缓存读取返回 (记忆版本, 重载版本)；重载版本只在有记忆被删除或批量改写时递增"""
+        values = cache.get_many([self.version_key(user_id), self.reload_key(user_id)])
+        return values.get(self.version_key(user_id)) or 0, values.get(self.reload_key(user_id)) or 0
+
+    def bump_version(self, user_id):
+        """递增版本号，返回新版本"""
+        return self._incr(self.version_key(user_id))
+
+    def bump_reload_version(self, user_id):
+        """递增重载版本：读方不能只按变化的行增量刷新，必须整体重建"""
+        return self._incr(self.reload_key(user_id))
+
+    def _incr(self, key):
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # 键不存在：首次写入
+            if cache.add(key, 1, timeout=self.VERSION_TTL):
+                return 1
+            return cache.incr(key)
+
+    # -------------------- 维护 --------------------
+    @staticmethod
+    def document_text(memory):
+        return f"{memory.key} {memory.value} {memory.context or ''}"
+
+    def on_memory_saved(self, memory):
+        """记忆新增或修改（含软删除）后调用"""
+        if memory.is_active:
+            self._apply(memory.user_id, lambda index: index.add(
+                memory.id, self.document_text(memory), memory.importance_score
+            ))
+        else:
+            self.on_memory_removed(memory.user_id, memory.id)
+
+    def on_memory_removed(self, user_id, memory_id):
+        # 先递增重载版本：看到新记忆版本的读方一定也看到新的重载版本
+        try:
+            self.bump_reload_version(user_id)
+        except Exception as e:
+            logger.error(f"递增记忆重载版本失败: {e}")
+        self._apply(user_id, lambda index: index.remove(memory_id))
+
+    def invalidate(self, user_id, reload=False):
+        """批量写入等无法增量维护的场景：递增版本并丢弃本进程索引；
+        批量写入删除了记忆或改写了已有行而未更新 last_accessed 时传 reload=True"""
+        try:
+            if reload:
+                self.bump_reload_version(user_id)
+            self.bump_version(user_id)
+        except Exception as e:
+            logger.error(f"递增记忆版本失败: {e}")
+        with self._lock:
+            self._indexes.pop(user_id, None)
+
+    def _apply(self, user_id, change):
+        try:
+            new_version = self.bump_version(user_id)
+        except Exception as e:
+            logger.error(f"递增记忆版本失败: {e}")
+            new_version = None
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                return
+            if new_version is not None and new_version == index.version + 1:
+                change(index)
+                index.version = new_version
+            else:
+                # 期间有其他进程写入，本进程索引已过期，下次检索时重建
+                self._indexes.pop(user_id, None)
+
+    def _build(self, user_id, version):
+        from chat_system.models import UserMemory
+
+        index = UserIndex(version)
+        rows = UserMemory.objects.filter(user_id=user_id, is_active=True).values_list(
+            'id', 'key', 'value', 'context', 'importance_score'
+        )
+        for memory_id, key, value, context, importance in rows:
+            index.add(memory_id, f"{key} {value} {context or ''}", importance)
+        return index
+
+    def get_index(self, user_id):
+        """返回与当前版本一致的用户索引（必要时重建）"""
+        version = self.current_version(user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.version == version:
+                self._indexes.move_to_end(user_id)
+                return index
+        index = self._build(user_id, version)
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.MAX_USERS:
+                self._indexes.popitem(last=False)
+        return index
+
+    # -------------------- 检索 --------------------
+    def search(self, user_id, query, limit=50):
+        """返回 [(记忆ID, 得分)]，按得分降序"""
+        query_tokens = set(tokenize(query))
+        if not query_tokens:
+            return []
+        index = self.get_index(user_id)
+        # 与增量维护持同一把锁：其他线程保存记忆时会原地修改同一个索引
+        with self._lock:
+            doc_count = len(index.doc_lengths)
+            if not doc_count:
+                return []
+            avg_length = index.total_length / doc_count or 1
+            scores = {}
+            for token in query_tokens:
+                docs = index.postings_for(token)
+                if not docs:
+                    continue
+                idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+                for memory_id, tf in docs.items():
+                    norm = self.K1 * (1 - self.B + self.B * index.doc_lengths[memory_id] / avg_length)
+                    scores[memory_id] = scores.get(memory_id, 0.0) + idf * tf * (self.K1 + 1) / (tf + norm)
+            if not scores:
+                return []
+            top = max(scores.values())
+            ranked = [
+                (memory_id, (1 - self.IMPORTANCE_WEIGHT) * score / top
+                 + self.IMPORTANCE_WEIGHT * min(1.0, index.importance.get(memory_id, 0.0)))
+                for memory_id, score in scores.items()
+            ]
+        ranked.sort(key=lambda item: item[1], reverse=True)
+        return ranked[:limit]
+
+
+# 全局实例
+memory_index = MemoryIndex()
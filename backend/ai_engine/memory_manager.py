@@ -1,9 +1,16 @@
 import logging
 import json
 from typing import Dict, List, Optional
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
 from django.utils import timezone
 from django.contrib.auth.models import User
 from chat_system.models import UserMemory, ConversationHistory
+from chat_system.event_calendar import event_calendar
+from ai_engine.memory_index import memory_index
+from ai_engine.memory_vectors import memory_vectors, NUMPY_AVAILABLE
 from ai_engine.tencent_client import TencentDeepSeekClient
 
 logger = logging.getLogger(__name__)
@@ -11,6 +18,12 @@ logger = logging.getLogger(__name__)
 class MemoryManager:
     """记忆管理器 - 实现记忆的提取、存储和检索"""
     
+    CONTEXT_CACHE_TTL = 24 * 3600  # 上下文缓存（按版本失效，TTL 只用于回收）
+    STATS_CACHE_TTL = 600  # 统计缓存（按版本失效）
+    CONTEXT_CHAR_BUDGET = getattr(settings, 'MEMORY_CONTEXT_CHAR_BUDGET', 600)  # 记忆上下文的字符预算
+    PACK_CANDIDATES = 50  # 装箱前取的候选记忆数
+    MAX_VALUE_CHARS = 120  # 单条记忆值过长时截断，避免一条记忆占满预算
+    
     def __init__(self):
         self.memory_types = {
             'personal': '个人信息',
@@ -35,12 +48,8 @@ class MemoryManager:
             # 解析AI响应
             extracted_memories = self._parse_memory_response(response)
             
-            # 保存提取的记忆
-            saved_memories = []
-            for memory_data in extracted_memories:
-                saved_memory = self._save_memory(user, memory_data, conversation_text)
-                if saved_memory:
-                    saved_memories.append(saved_memory)
+            # 一次批量写入提取的记忆
+            saved_memories = self._save_memories(user, extracted_memories, conversation_text)
             
             # 记录对话历史
             self._record_conversation_history(user, session_id, conversation_text, extracted_memories)
@@ -79,6 +88,7 @@ class MemoryManager:
 注意：
 - 只提取明确提到的信息
 - importance_score: 0.1-1.0，越重要分数越高
+- 重要事件（event）如果提到了日期，额外返回 "date" 字段，格式为 YYYY-MM-DD，不知道年份时为 MM-DD
 - 如果对话中没有值得记忆的信息，返回空数组[]
 - 确保JSON格式正确"""
 
@@ -106,43 +116,82 @@ class MemoryManager:
         return []
     
     def _save_memory(self, user: User, memory_data: Dict, context: str) -> Optional[UserMemory]:
-        """保存记忆到数据库"""
+        """保存单条记忆到数据库"""
+        saved = self._save_memories(user, [memory_data], context)
+        return saved[0] if saved else None
+
+    def _save_memories(self, user: User, memory_list: List[Dict], context: str) -> List[UserMemory]:
+        """批量保存记忆：一次查询已有重要性 + 一条 upsert 语句 + 一次回读，返回写入后的记忆"""
         try:
-            memory_type = memory_data.get('memory_type', 'personal')
-            key = memory_data.get('key', '')
-            value = memory_data.get('value', '')
-            importance_score = float(memory_data.get('importance_score', 0.5))
-            
-            if not key or not value:
-                return None
-            
-            # 检查是否已存在相同记忆
-            existing_memory, created = UserMemory.objects.get_or_create(
-                user=user,
-                key=key,
-                defaults={
-                    'memory_type': memory_type,
+            # 校验并按 key 去重（同一批次内取最新的值、最高的重要性）
+            items = {}
+            for memory_data in memory_list:
+                if not isinstance(memory_data, dict):
+                    continue
+                key = memory_data.get('key', '')
+                value = memory_data.get('value', '')
+                if not key or not value:
+                    continue
+                try:
+                    importance_score = float(memory_data.get('importance_score', 0.5))
+                except (TypeError, ValueError):
+                    importance_score = 0.5
+                previous = items.get(key)
+                if previous:
+                    importance_score = max(importance_score, previous['importance_score'])
+                items[key] = {
+                    'memory_type': memory_data.get('memory_type', 'personal'),
                     'value': value,
-                    'context': context,
                     'importance_score': importance_score,
-                    'is_active': True
+                    'date': memory_data.get('date') or (previous or {}).get('date'),
                 }
-            )
-            
-            if not created:
-                # 更新现有记忆
-                existing_memory.value = value
-                existing_memory.context = context
-                existing_memory.importance_score = max(existing_memory.importance_score, importance_score)
-                existing_memory.last_accessed = timezone.now()
-                existing_memory.save()
-            
-            logger.info(f"记忆保存成功: {user.username}-{key}: {value}")
-            return existing_memory
+            if not items:
+                return []
+
+            now = timezone.now()
+            with transaction.atomic():
+                # 已有记忆保持“取较高重要性”的合并语义
+                existing = dict(UserMemory.objects.filter(user=user, key__in=list(items)).values_list(
+                    'key', 'importance_score'
+                ))
+                rows = []
+                for key, item in items.items():
+                    row = UserMemory(
+                        user=user,
+                        memory_type=item['memory_type'],
+                        key=key,
+                        value=item['value'],
+                        context=context,
+                        importance_score=max(existing.get(key, item['importance_score']), item['importance_score']),
+                        last_accessed=now,
+                        created_at=now,
+                        is_active=True,
+                    )
+                    # 批量写入不经过 save()，在此计算嵌入
+                    memory_vectors.embed_memory(row)
+                    rows.append(row)
+                # 已存在的记忆只更新内容、重要性与访问时间（类型与启用状态保持不变，与逐条更新一致）
+                UserMemory.objects.bulk_create(
+                    rows,
+                    update_conflicts=True,
+                    unique_fields=['user', 'key'],
+                    update_fields=['value', 'context', 'importance_score', 'last_accessed', 'embedding'],
+                )
+                saved = list(UserMemory.objects.filter(user=user, key__in=list(items)))
+                # 批量写入绕过了模型钩子：提交后统一递增记忆版本、重建检索索引
+                transaction.on_commit(lambda: memory_index.invalidate(user.id))
+
+            # 带日期的事件记忆归一化到事件日历（一次批量同步，查询数与条数无关）
+            event_pairs = [(memory, items[memory.key]['date']) for memory in saved if memory.memory_type == 'event']
+            if event_pairs:
+                event_calendar.sync_memories(event_pairs)
+
+            logger.info(f"记忆保存成功: {user.username} 共 {len(saved)} 条: {', '.join(items)}")
+            return saved
             
         except Exception as e:
             logger.error(f"保存记忆失败: {e}")
-            return None
+            return []
     
     def _record_conversation_history(self, user: User, session_id: str, content: str, extracted_memories: List[Dict]):
         """记录对话历史"""
@@ -171,37 +220,111 @@ class MemoryManager:
             logger.error(f"获取用户记忆失败: {e}")
             return []
     
-    def build_memory_context(self, user: User, max_memories: int = 10) -> str:
-        """构建记忆上下文，用于AI对话"""
+    def get_relevant_memories(self, user: User, query: str, limit: int = 10) -> List[UserMemory]:
+        """按与当前对话的向量相似度（融合重要性与最近访问）挑选记忆"""
+        ranked = memory_vectors.top_k(user.id, query, k=limit)
+        if not ranked:
+            return []
+        memories = UserMemory.objects.filter(is_active=True).in_bulk([memory_id for memory_id, _ in ranked])
+        return [memories[memory_id] for memory_id, _ in ranked if memory_id in memories]
+
+    def context_cache_key(self, user_id: int, max_memories: int, budget: int) -> str:
+        return f"memory_context:{user_id}:{max_memories}:{budget}"
+
+    def build_memory_context(self, user: User, max_memories: int = 10, query: str = None, budget: int = None) -> str:
+        """构建记忆上下文，用于AI对话；在 budget 个字符内挑选记忆，传入 query 时按与当前对话的相关性挑选"""
         try:
-            memories = self.get_user_memories(user, limit=max_memories)
-            
-            if not memories:
-                return "用户信息：暂无记忆"
-            
-            context_parts = ["用户记忆信息："]
-            
-            # 按类型分组
-            memory_groups = {}
-            for memory in memories:
-                memory_type = memory.memory_type
-                if memory_type not in memory_groups:
-                    memory_groups[memory_type] = []
-                memory_groups[memory_type].append(memory)
-            
-            # 构建上下文
-            for memory_type, memory_list in memory_groups.items():
-                type_name = self.memory_types.get(memory_type, memory_type)
-                context_parts.append(f"\n{type_name}：")
-                
-                for memory in memory_list:
-                    context_parts.append(f"- {memory.key}: {memory.value}")
-            
-            return "\n".join(context_parts)
+            budget = budget or self.CONTEXT_CHAR_BUDGET
+            if query and NUMPY_AVAILABLE:
+                return self._render_memory_context(
+                    self.select_memories_within_budget(user, budget, query=query, limit=max_memories)
+                )
+
+            # 按重要性选取的上下文只随记忆变化，按用户记忆版本缓存：
+            # 版本号与缓存的 (版本, 上下文) 一次 MGET 取回，版本不一致即视为过期
+            version_key = memory_index.version_key(user.id)
+            context_key = self.context_cache_key(user.id, max_memories, budget)
+            cached = cache.get_many([version_key, context_key])
+            version = cached.get(version_key) or 0
+            entry = cached.get(context_key)
+            if entry and entry[0] == version:
+                return entry[1]
+
+            context = self._render_memory_context(
+                self.select_memories_within_budget(user, budget, limit=max_memories)
+            )
+            cache.set(context_key, (version, context), timeout=self.CONTEXT_CACHE_TTL)
+            return context
             
         except Exception as e:
             logger.error(f"构建记忆上下文失败: {e}")
             return "用户信息：记忆加载失败"
+
+    def select_memories_within_budget(self, user: User, budget: int, query: str = None, limit: int = None) -> List[UserMemory]:
+        """在字符预算内挑选记忆：有 query 时按相关性融合得分，否则按重要性"""
+        if query and NUMPY_AVAILABLE:
+            ranked = memory_vectors.top_k(user.id, query, k=self.PACK_CANDIDATES)
+            memories = UserMemory.objects.filter(is_active=True).in_bulk([memory_id for memory_id, _ in ranked])
+            scored = [(memories[memory_id], score) for memory_id, score in ranked if memory_id in memories]
+        else:
+            scored = [
+                (memory, memory.importance_score)
+                for memory in self.get_user_memories(user, limit=self.PACK_CANDIDATES)
+            ]
+        return self.pack_memories(scored, budget, limit)
+
+    def _memory_line(self, memory: UserMemory) -> str:
+        value = memory.value
+        if len(value) > self.MAX_VALUE_CHARS:
+            value = value[:self.MAX_VALUE_CHARS - 1] + '…'
+        return f"{memory.key}: {value}"
+
+    def pack_memories(self, scored: List, budget: int, limit: int = None) -> List[UserMemory]:
+        """贪心背包：按 得分/字符数 从高到低装入，使所选记忆的总得分在预算内尽量大。
+        字符数与 render_memory_lines 的输出一致：每条记忆一段，每种类型首次出现时多一个类型前缀"""
+        candidates = [
+            (memory, max(score, 0.0) + 1e-6, len(self._memory_line(memory)) + 1)
+            for memory, score in scored
+        ]
+        candidates.sort(key=lambda item: item[1] / item[2], reverse=True)
+        chosen, used, total, types = [], 0, 0.0, set()
+        for memory, score, cost in candidates:
+            if limit and len(chosen) >= limit:
+                break
+            if memory.memory_type not in types:
+                cost += len(self.memory_types.get(memory.memory_type, memory.memory_type)) + 2
+            if used + cost > budget:
+                continue
+            chosen.append((memory, score))
+            types.add(memory.memory_type)
+            used += cost
+            total += score
+        # 贪心的经典修正：单条得分最高且放得下的记忆若胜过整个组合，则只取它
+        fitting = [
+            (memory, score) for memory, score, cost in candidates
+            if cost + len(self.memory_types.get(memory.memory_type, memory.memory_type)) + 2 <= budget
+        ]
+        best = max(fitting, key=lambda item: item[1], default=None)
+        if best is not None and best[1] > total:
+            chosen = [best]
+        chosen.sort(key=lambda item: item[1], reverse=True)
+        return [memory for memory, _ in chosen]
+
+    def render_memory_lines(self, memories: List[UserMemory]) -> str:
+        """紧凑渲染：每种类型一行，同类记忆以分号分隔"""
+        memory_groups = {}
+        for memory in memories:
+            memory_groups.setdefault(memory.memory_type, []).append(self._memory_line(memory))
+        return "\n".join(
+            f"{self.memory_types.get(memory_type, memory_type)}：{'；'.join(lines)}"
+            for memory_type, lines in memory_groups.items()
+        )
+
+    def _render_memory_context(self, memories: List[UserMemory]) -> str:
+        """按类型分组渲染记忆上下文"""
+        if not memories:
+            return "用户信息：暂无记忆"
+        return "用户记忆信息：\n" + self.render_memory_lines(memories)
     
     def update_memory_importance(self, user: User, key: str, importance_score: float):
         """更新记忆重要性"""
@@ -224,6 +347,8 @@ class MemoryManager:
             memory = UserMemory.objects.get(user=user, key=key)
             memory.is_active = False
             memory.save()
+            if memory.memory_type == 'event':
+                event_calendar.sync_memory(memory)
             
             logger.info(f"记忆已删除: {user.username}-{key}")
             return True
@@ -235,50 +360,57 @@ class MemoryManager:
             logger.error(f"删除记忆失败: {e}")
             return False
     
-    def search_memories(self, user: User, query: str) -> List[UserMemory]:
-        """搜索记忆"""
+    def search_memories(self, user: User, query: str, limit: int = 50) -> List[UserMemory]:
+        """搜索记忆：倒排索引检索，BM25 与重要性融合排序"""
         try:
-            memories = UserMemory.objects.filter(
-                user=user,
-                is_active=True
-            ).filter(
-                Q(key__icontains=query) | 
-                Q(value__icontains=query) |
-                Q(context__icontains=query)
-            ).order_by('-importance_score', '-last_accessed')
-            
-            return list(memories)
+            ranked = memory_index.search(user.id, query, limit=limit)
+            if not ranked:
+                return []
+            memories = UserMemory.objects.filter(is_active=True).in_bulk([memory_id for memory_id, _ in ranked])
+            # 按检索得分顺序返回（索引与数据库之间被删除的记忆跳过）
+            return [memories[memory_id] for memory_id, _ in ranked if memory_id in memories]
             
         except Exception as e:
             logger.error(f"搜索记忆失败: {e}")
             return []
     
+    def stats_cache_key(self, user_id: int) -> str:
+        return f"memory_stats:{user_id}"
+
     def get_memory_statistics(self, user: User) -> Dict:
-        """获取记忆统计信息"""
+        """获取记忆统计信息：按类型一次 GROUP BY 聚合，结果按用户记忆版本缓存"""
         try:
-            total_memories = UserMemory.objects.filter(user=user, is_active=True).count()
-            
-            type_counts = {}
-            for memory_type in self.memory_types.keys():
-                count = UserMemory.objects.filter(
-                    user=user, 
-                    memory_type=memory_type, 
-                    is_active=True
-                ).count()
-                type_counts[memory_type] = count
-            
-            recent_memories = UserMemory.objects.filter(
-                user=user,
-                is_active=True,
-                last_accessed__gte=timezone.now() - timezone.timedelta(days=7)
-            ).count()
-            
-            return {
+            version_key = memory_index.version_key(user.id)
+            stats_key = self.stats_cache_key(user.id)
+            cached = cache.get_many([version_key, stats_key])
+            version = cached.get(version_key) or 0
+            entry = cached.get(stats_key)
+            if entry and entry[0] == version:
+                return entry[1]
+
+            recent_since = timezone.now() - timezone.timedelta(days=7)
+            rows = UserMemory.objects.filter(user=user, is_active=True).values('memory_type').annotate(
+                total=Count('id'),
+                recent=Count('id', filter=Q(last_accessed__gte=recent_since)),
+            ).order_by()
+            
+            type_counts = dict.fromkeys(self.memory_types, 0)
+            total_memories = recent_memories = 0
+            for row in rows:
+                total_memories += row['total']
+                recent_memories += row['recent']
+                if row['memory_type'] in type_counts:
+                    type_counts[row['memory_type']] = row['total']
+            
+            stats = {
                 'total_memories': total_memories,
                 'type_counts': type_counts,
                 'recent_accessed': recent_memories,
                 'last_updated': timezone.now().isoformat()
             }
+            # “最近7天访问”会随时间滑动，TTL 限制记忆无变化时的陈旧程度
+            cache.set(stats_key, (version, stats), timeout=self.STATS_CACHE_TTL)
+            return stats
             
         except Exception as e:
             logger.error(f"获取记忆统计失败: {e}")
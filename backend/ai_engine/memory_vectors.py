@@ -0,0 +1,217 @@
+"""
+记忆向量检索
+本地哈希嵌入：中文字符一元/二元组与英文单词经 crc32 散列到固定维度（带符号），L2 归一化后以 float16 存入 UserMemory.embedding；
+每个用户的记忆向量按 memory_version 缓存为一个矩阵，检索时一次矩阵乘法得到全部余弦相似度，
+再与重要性、最近访问时间加权融合取 top-k。
+版本变化时只查询上次加载以来 last_accessed 有更新的行，原地更新或追加到矩阵；
+只有重载版本也变化（有记忆被删除或被批量改写）时才整体重建
+"""
+
+import logging
+import math
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import timedelta
+from django.utils import timezone
+from ai_engine.memory_index import CJK_RUN, WORD, memory_index
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class HashingEmbedder:
+    """字符 n-gram 哈希嵌入（无需模型文件）"""
+
+    DIM = 1024
+    NGRAM_WEIGHTS = {1: 0.5, 2: 1.0}  # 中文以二元组为主，单字辅助（三元组几乎不增加召回，反而增加哈希碰撞）
+    WORD_WEIGHT = 1.0  # 英文/数字整词
+
+    def features(self, text):
+        """返回 [(特征, 权重)]：中文片段取字符 n-gram，英文与数字取整词（snake_case 拆开）"""
+        text = (text or '').lower()
+        features = [(word, self.WORD_WEIGHT) for word in WORD.findall(text)]
+        for run in CJK_RUN.findall(text):
+            for n, weight in self.NGRAM_WEIGHTS.items():
+                features.extend((run[i:i + n], weight) for i in range(len(run) - n + 1))
+        return features
+
+    def encode(self, text):
+        """返回 L2 归一化的 float32 向量；空文本返回全零向量"""
+        vector = np.zeros(self.DIM, dtype=np.float32)
+        for feature, weight in self.features(text):
+            h = zlib.crc32(feature.encode('utf-8'))
+            # 低位决定维度，高位决定符号，减少哈希碰撞带来的偏差
+            vector[h % self.DIM] += weight if h & 0x80000000 else -weight
+        norm = float(np.linalg.norm(vector))
+        if norm:
+            vector /= norm
+        return vector
+
+    def to_bytes(self, vector):
+        return vector.astype(np.float16).tobytes()
+
+    def from_bytes(self, data):
+        vector = np.frombuffer(bytes(data), dtype=np.float16)
+        return vector.astype(np.float32) if vector.size == self.DIM else None
+
+
+class UserMatrix:
+    """单个用户的记忆向量矩阵"""
+
+    def __init__(self, version, reload_version, loaded_at, ids, matrix, importance, accessed):
+        self.version = version
+        self.reload_version = reload_version
+        self.loaded_at = loaded_at  # 本次加载开始的时间，下次增量刷新从这里往前留出余量
+        self.ids = ids  # 记忆ID数组
+        self.positions = {int(memory_id): i for i, memory_id in enumerate(ids)}  # 记忆ID -> 行号
+        self.matrix = matrix
+        self.importance = importance
+        self.accessed = accessed  # 最近访问时间戳
+
+
+class MemoryVectors:
+    """按当前对话挑选相关记忆"""
+
+    SIMILARITY_WEIGHT = 0.6
+    IMPORTANCE_WEIGHT = 0.25
+    RECENCY_WEIGHT = 0.15
+    RECENCY_HALF_LIFE_DAYS = 30
+    MIN_SIMILARITY = 0.1  # 低于该相似度的记忆不注入提示词
+    MAX_USERS = 512  # 进程内缓存的用户矩阵数（LRU）
+    REFRESH_MARGIN = 60  # 增量刷新向前多取的秒数（覆盖事务提交延迟与进程间时钟偏差，重复取到的行只会原地覆盖）
+
+    def __init__(self):
+        self.embedder = HashingEmbedder() if NUMPY_AVAILABLE else None
+        self._matrices = OrderedDict()  # user_id -> UserMatrix
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def memory_text(key, value):
+        # 向量只取 key 与 value，context 是整段对话原文，会稀释语义
+        return f"{key} {value}"
+
+    def embed_memory(self, memory):
+        """保存前为记忆计算嵌入（numpy 不可用时跳过）"""
+        if self.embedder is None:
+            return
+        try:
+            vector = self.embedder.encode(self.memory_text(memory.key, memory.value))
+            memory.embedding = self.embedder.to_bytes(vector)
+        except Exception as e:
+            logger.error(f"计算记忆向量失败: {e}")
+
+    def _vector(self, key, value, embedding):
+        vector = self.embedder.from_bytes(embedding) if embedding else None
+        # 历史记忆没有存储向量时现场计算
+        return vector if vector is not None else self.embedder.encode(self.memory_text(key, value))
+
+    @staticmethod
+    def _timestamp(last_accessed):
+        return last_accessed.timestamp() if last_accessed else 0.0
+
+    def _build(self, user_id, version, reload_version):
+        """从数据库整体加载用户的全部启用记忆"""
+        from chat_system.models import UserMemory
+
+        loaded_at = timezone.now()
+        rows = list(UserMemory.objects.filter(user_id=user_id, is_active=True).values_list(
+            'id', 'key', 'value', 'embedding', 'importance_score', 'last_accessed'
+        ))
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        matrix = np.zeros((len(rows), self.embedder.DIM), dtype=np.float32)
+        for i, (_, key, value, embedding, _, _) in enumerate(rows):
+            matrix[i] = self._vector(key, value, embedding)
+        importance = np.clip(np.array([row[4] for row in rows], dtype=np.float32), 0.0, 1.0)
+        accessed = np.array([self._timestamp(row[5]) for row in rows], dtype=np.float64)
+        return UserMatrix(version, reload_version, loaded_at, ids, matrix, importance, accessed)
+
+    def _refresh(self, user_id, entry, version):
+        """只加载上次加载以来有变化的记忆：已有的行原地更新，新记忆追加到末尾；
+        变化中出现已停用的记忆时返回 None，由调用方整体重建"""
+        from chat_system.models import UserMemory
+
+        loaded_at = timezone.now()
+        rows = list(UserMemory.objects.filter(
+            user_id=user_id,
+            last_accessed__gte=entry.loaded_at - timedelta(seconds=self.REFRESH_MARGIN),
+        ).values_list('id', 'key', 'value', 'embedding', 'importance_score', 'last_accessed', 'is_active'))
+        if any(not row[6] and row[0] in entry.positions for row in rows):
+            return None
+        appended = [row for row in rows if row[6] and row[0] not in entry.positions]
+        with self._lock:
+            for memory_id, key, value, embedding, importance, last_accessed, is_active in rows:
+                position = entry.positions.get(memory_id)
+                if position is None:
+                    continue
+                entry.matrix[position] = self._vector(key, value, embedding)
+                entry.importance[position] = min(max(importance, 0.0), 1.0)
+                entry.accessed[position] = self._timestamp(last_accessed)
+            if appended:
+                # 追加会换成新数组：检索方在锁内取到的始终是长度一致的一组数组
+                start = len(entry.ids)
+                entry.ids = np.concatenate([entry.ids, np.array([row[0] for row in appended], dtype=np.int64)])
+                entry.matrix = np.concatenate([entry.matrix, np.stack([
+                    self._vector(row[1], row[2], row[3]) for row in appended
+                ])])
+                entry.importance = np.concatenate([entry.importance, np.clip(
+                    np.array([row[4] for row in appended], dtype=np.float32), 0.0, 1.0
+                )])
+                entry.accessed = np.concatenate([entry.accessed, np.array(
+                    [self._timestamp(row[5]) for row in appended], dtype=np.float64
+                )])
+                entry.positions.update({row[0]: start + i for i, row in enumerate(appended)})
+            entry.version = version
+            entry.loaded_at = loaded_at
+        return entry
+
+    def _load(self, user_id):
+        """返回与当前记忆版本一致的用户矩阵：版本不变直接复用，只有新增或修改时增量刷新，有删除时整体重建"""
+        version, reload_version = memory_index.versions(user_id)
+        with self._lock:
+            cached = self._matrices.get(user_id)
+            if cached is not None and cached.version == version:
+                self._matrices.move_to_end(user_id)
+                return cached
+        entry = None
+        if cached is not None and cached.reload_version == reload_version:
+            entry = self._refresh(user_id, cached, version)
+        if entry is None:
+            entry = self._build(user_id, version, reload_version)
+        with self._lock:
+            self._matrices[user_id] = entry
+            self._matrices.move_to_end(user_id)
+            while len(self._matrices) > self.MAX_USERS:
+                self._matrices.popitem(last=False)
+        return entry
+
+    def top_k(self, user_id, query, k=10):
+        """返回 [(记忆ID, 得分)]；numpy 不可用或无相关记忆时返回空列表"""
+        if self.embedder is None or not query:
+            return []
+        entry = self._load(user_id)
+        with self._lock:
+            ids, matrix, importance, accessed = entry.ids, entry.matrix, entry.importance, entry.accessed
+        if not len(ids):
+            return []
+        similarity = matrix @ self.embedder.encode(query)
+        age_days = np.maximum(timezone.now().timestamp() - accessed, 0) / 86400
+        recency = np.exp(-math.log(2) * age_days / self.RECENCY_HALF_LIFE_DAYS)
+        scores = (self.SIMILARITY_WEIGHT * similarity
+                  + self.IMPORTANCE_WEIGHT * importance
+                  + self.RECENCY_WEIGHT * recency)
+        # 只保留与当前话题相关的记忆
+        scores = np.where(similarity >= self.MIN_SIMILARITY, scores, -np.inf)
+        k = min(k, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+# 全局实例
+memory_vectors = MemoryVectors()
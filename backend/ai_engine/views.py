@@ -16,14 +16,11 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 
-from .core import AIEngine
+from .core import ai_engine
 from .models import AIConversation, AIMessage, AIResponse
 
 logger = logging.getLogger(__name__)
 
-# 初始化AI引擎
-ai_engine = AIEngine()
-
 @api_view(['POST'])
 @permission_classes([])  # 暂时移除认证要求，用于开发测试
 def chat(request):
@@ -0,0 +1,318 @@
+"""
+用户活动流水线
+热路径只向 Redis Stream 追加一条事件；后台消费者批量写入 UserActivity，
+并为每个用户维护滑动窗口，窗口内出现新的消息时才更新情绪状态。
+写入失败的事件留在待确认列表中，每个重试周期（CLAIM_INTERVAL）重试一次，超过次数后转入死信流并确认；
+已停止的消费者遗留的事件由存活的消费者在重试周期开始时通过 XAUTOCLAIM 接管
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from django.db import close_old_connections
+from django.utils import timezone
+from .redis_client import get_redis_client, redis_key
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityStream:
+    """用户活动流"""
+
+    STREAM_KEY = 'user_activity_stream'
+    DEAD_LETTER_KEY = 'user_activity_dead'  # 多次写入失败的事件
+    GROUP = 'activity_writers'
+    MAXLEN = 100000  # 流的近似最大长度，防止消费者长时间停摆时无限增长
+    BATCH_SIZE = 200
+    BLOCK_MS = 2000  # 无新事件时阻塞等待的时长
+    WINDOW_SECONDS = 600  # 滑动窗口长度
+    WINDOW_MAX_EVENTS = 10  # 每个用户窗口内最多保留的事件数
+    MAX_ATTEMPTS = 5  # 单个事件的最多写入次数，超过后转入死信流
+    CLAIM_IDLE_MS = 60000  # 其他消费者的待确认事件闲置超过该时长即接管
+    CLAIM_INTERVAL = 30  # 重试周期：两次接管检查、重读本消费者待确认事件之间的秒数
+
+    def __init__(self):
+        self.consumer_name = f"{socket.gethostname()}:{os.getpid()}"
+        self.windows = {}  # user_id -> deque[(ts, activity_type, content)]
+        self.window_listener = None  # 窗口变化回调 (user_id, summary) -> None
+        self._local_buffer = deque()  # 非 Redis 缓存后端时的进程内缓冲
+        self._local_retry = []  # 进程内缓冲中写入失败、等待下个重试周期的事件
+        self._pending_cursor = None  # 本重试周期内重读待确认事件的位置，None 表示本周期已读完
+        self._group_ready = False
+        self._attempts = {}  # 事件ID -> 已失败的写入次数
+        self._last_claim = 0.0
+        self._thread = None
+
+    # -------------------- 热路径 --------------------
+    def append(self, user_id, activity_type, content=None, metadata=None):
+        """追加一条活动事件（一次 XADD）"""
+        event = {
+            'u': str(user_id),
+            't': activity_type,
+            'c': content or '',
+            'ts': str(timezone.now().timestamp()),
+        }
+        if metadata:
+            event['m'] = json.dumps(metadata, ensure_ascii=False)
+        client = get_redis_client()
+        if client is None:
+            self._local_buffer.append(event)
+            return
+        client.xadd(redis_key(self.STREAM_KEY), event, maxlen=self.MAXLEN, approximate=True)
+
+    # -------------------- 消费者 --------------------
+    def _ensure_group(self, client):
+        if self._group_ready:
+            return
+        try:
+            client.xgroup_create(redis_key(self.STREAM_KEY), self.GROUP, id='0', mkstream=True)
+        except Exception as e:
+            # 消费组已存在
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._group_ready = True
+
+    def _decode(self, fields):
+        return {
+            (k.decode('utf-8') if isinstance(k, bytes) else k): (v.decode('utf-8') if isinstance(v, bytes) else v)
+            for k, v in fields.items()
+        }
+
+    def _retry_due(self):
+        """是否开始新的重试周期（每 CLAIM_INTERVAL 秒一次，进程启动后的第一次读取立即开始）"""
+        now = time.monotonic()
+        if now - self._last_claim < self.CLAIM_INTERVAL:
+            return False
+        self._last_claim = now
+        return True
+
+    def _claim_stale(self, client, stream):
+        """把已停止的消费者遗留、闲置过久的待确认事件接管到本消费者"""
+        start_id = '0-0'
+        while True:
+            result = client.xautoclaim(
+                stream, self.GROUP, self.consumer_name, self.CLAIM_IDLE_MS,
+                start_id=start_id, count=self.BATCH_SIZE,
+            )
+            start_id, claimed = result[0], result[1]
+            if claimed:
+                logger.info(f"接管闲置的活动事件 {len(claimed)} 条")
+            if start_id in (b'0-0', '0-0'):
+                break
+
+    def read_batch(self, block_ms=None):
+        """读取一批事件，返回 (消息ID列表, 事件列表)"""
+        client = get_redis_client()
+        if client is None:
+            if self._local_retry and self._retry_due():
+                self._local_buffer.extend(self._local_retry)
+                self._local_retry = []
+            events = []
+            while self._local_buffer and len(events) < self.BATCH_SIZE:
+                events.append(self._local_buffer.popleft())
+            return [None] * len(events), events
+        self._ensure_group(client)
+        stream = redis_key(self.STREAM_KEY)
+        if self._retry_due():
+            self._claim_stale(client, stream)
+            self._pending_cursor = '0'
+        # 重试周期内先分页重读本消费者未确认的事件（上次崩溃遗留、写入失败待重试或刚接管的），
+        # 读完后本周期内只读新事件，失败的事件不会在两次读取之间空转重试
+        while self._pending_cursor is not None:
+            result = client.xreadgroup(
+                self.GROUP, self.consumer_name, {stream: self._pending_cursor}, count=self.BATCH_SIZE,
+            )
+            entries = result[0][1] if result else []
+            if not entries:
+                self._pending_cursor = None
+                break
+            self._pending_cursor = entries[-1][0]
+            entries = self._drop_trimmed(entries)
+            if entries:
+                return [entry_id for entry_id, _ in entries], [self._decode(fields) for _, fields in entries]
+        result = client.xreadgroup(
+            self.GROUP, self.consumer_name, {stream: '>'},
+            count=self.BATCH_SIZE,
+            block=self.BLOCK_MS if block_ms is None else block_ms,
+        )
+        entries = self._drop_trimmed(result[0][1] if result else [])
+        return [entry_id for entry_id, _ in entries], [self._decode(fields) for _, fields in entries]
+
+    def _drop_trimmed(self, entries):
+        """已被 MAXLEN 裁掉的待确认事件没有内容，直接确认"""
+        trimmed = [entry_id for entry_id, fields in entries if not fields]
+        if trimmed:
+            self.ack(trimmed)
+        return [(entry_id, fields) for entry_id, fields in entries if fields]
+
+    def ack(self, ids):
+        ids = [entry_id for entry_id in ids if entry_id is not None]
+        if not ids:
+            return
+        client = get_redis_client()
+        if client is not None:
+            client.xack(redis_key(self.STREAM_KEY), self.GROUP, *ids)
+
+    def _build_row(self, event):
+        from .models import UserActivity
+        return UserActivity(
+            user_id=int(event['u']),
+            activity_type=event['t'],
+            content=event.get('c') or None,
+            metadata=json.loads(event['m']) if event.get('m') else {},
+        )
+
+    def write_batch(self, events):
+        """一次 bulk_create 写入一批活动（timestamp 为写入时间，最多滞后一个批次周期）
+
+        整批写入失败时逐行重试，返回 (写入成功的下标列表, {写入失败的下标: 错误})；
+        格式无效的事件既不写入也不重试，计入成功以便确认
+        """
+        from .models import UserActivity
+        rows, indexes = [], []
+        for index, event in enumerate(events):
+            try:
+                rows.append(self._build_row(event))
+                indexes.append(index)
+            except (KeyError, ValueError) as e:
+                logger.warning(f"丢弃无效活动事件: {event} ({e})")
+        invalid = sorted(set(range(len(events))) - set(indexes))
+        if not rows:
+            return invalid, {}
+        try:
+            UserActivity.objects.bulk_create(rows, batch_size=self.BATCH_SIZE)
+            return sorted(invalid + indexes), {}
+        except Exception as e:
+            logger.error(f"批量写入用户活动失败，改为逐行写入: {e}")
+        written, failed = list(invalid), {}
+        for index, row in zip(indexes, rows):
+            try:
+                row.save()
+                written.append(index)
+            except Exception as e:
+                failed[index] = e
+        return sorted(written), failed
+
+    def _dead_letter(self, entry_id, event, error):
+        """写入多次失败的事件转入死信流（保留原始字段与错误信息）"""
+        logger.error(f"用户活动事件写入 {self.MAX_ATTEMPTS} 次失败，转入死信流: {entry_id} {event} ({error})")
+        client = get_redis_client()
+        if client is None:
+            return
+        fields = {**event, 'error': str(error)[:500]}
+        if entry_id is not None:
+            fields['id'] = entry_id.decode('utf-8') if isinstance(entry_id, bytes) else entry_id
+        client.xadd(redis_key(self.DEAD_LETTER_KEY), fields, maxlen=self.MAXLEN, approximate=True)
+
+    def handle_failures(self, ids, events, failed):
+        """写入失败的事件：未到次数上限的留到下个重试周期，超过上限的转入死信流，返回可以确认的事件ID"""
+        done = []
+        for index, error in failed.items():
+            entry_id, event = ids[index], events[index]
+            key = entry_id if entry_id is not None else id(event)
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts < self.MAX_ATTEMPTS:
+                self._attempts[key] = attempts
+                if entry_id is None:
+                    # 进程内缓冲没有待确认列表，暂存到下个重试周期再放回缓冲
+                    self._local_retry.append(event)
+                continue
+            self._attempts.pop(key, None)
+            self._dead_letter(entry_id, event, error)
+            done.append(entry_id)
+        return done
+
+    def update_windows(self, events):
+        """更新滑动窗口，返回 {用户ID: 本批新增的消息文本列表}（只含窗口有变化的用户）"""
+        changed = {}
+        now_ts = timezone.now().timestamp()
+        for event in events:
+            try:
+                user_id = int(event['u'])
+                ts = float(event.get('ts') or now_ts)
+            except (KeyError, ValueError):
+                continue
+            window = self.windows.setdefault(user_id, deque(maxlen=self.WINDOW_MAX_EVENTS))
+            window.append((ts, event.get('t'), event.get('c') or ''))
+            if event.get('t') == 'message' and event.get('c'):
+                changed.setdefault(user_id, []).append(event['c'])
+        # 过期淘汰
+        cutoff = now_ts - self.WINDOW_SECONDS
+        for user_id in list(self.windows.keys()):
+            window = self.windows[user_id]
+            while window and window[0][0] < cutoff:
+                window.popleft()
+            if not window:
+                del self.windows[user_id]
+        return changed
+
+    def window_summary(self, user_id):
+        """窗口聚合：各类型事件数与窗口内的用户消息"""
+        window = self.windows.get(user_id) or ()
+        counts = {}
+        for _, activity_type, _ in window:
+            counts[activity_type] = counts.get(activity_type, 0) + 1
+        messages = [
+            {'sender': 'user', 'content': content}
+            for _, activity_type, content in window
+            if activity_type == 'message' and content
+        ]
+        return {'counts': counts, 'recent_messages': messages}
+
+    def process_once(self, block_ms=None):
+        """消费一批事件：批量入库 -> 更新窗口 -> 对窗口有变化的用户回调 -> 确认
+
+        只有写入成功的事件进入窗口并确认，失败的留待重试，避免重试时重复计入窗口
+        """
+        ids, events = self.read_batch(block_ms)
+        if not events:
+            return 0
+        written, failed = self.write_batch(events)
+        for index in written:
+            self._attempts.pop(ids[index] if ids[index] is not None else id(events[index]), None)
+        changed = self.update_windows([events[index] for index in written])
+        if self.window_listener:
+            for user_id, new_messages in changed.items():
+                try:
+                    summary = self.window_summary(user_id)
+                    summary['new_messages'] = new_messages
+                    self.window_listener(user_id, summary)
+                except Exception as e:
+                    logger.error(f"活动窗口分析失败 user_id={user_id}: {e}")
+        dead = self.handle_failures(ids, events, failed)
+        self.ack([ids[index] for index in written] + dead)
+        if not written and len(dead) < len(failed):
+            # 整批失败（多半是数据库不可用）：交给 run_forever 退避后重试
+            raise RuntimeError(f"用户活动写入失败 {len(failed)} 条")
+        return len(events)
+
+    def run_forever(self):
+        logger.info("用户活动消费者启动")
+        failures = 0
+        while True:
+            try:
+                close_old_connections()
+                processed = self.process_once()
+                failures = 0
+                if not processed and get_redis_client() is None:
+                    time.sleep(self.BLOCK_MS / 1000.0)
+            except Exception as e:
+                logger.error(f"用户活动消费失败: {e}")
+                # 指数退避：数据库短暂不可用时，事件不会在几秒内用完重试次数
+                time.sleep(min(2 ** failures, 60))
+                failures += 1
+
+    def start(self):
+        """启动后台消费线程（每进程一个）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self.run_forever, daemon=True)
+        self._thread.start()
+
+
+# 全局实例
+activity_stream = ActivityStream()
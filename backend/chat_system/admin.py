@@ -0,0 +1,20 @@
+from django.contrib import admin
+from .models import ProactiveTrigger, MemoryEvent
+
+
+@admin.register(ProactiveTrigger)
+class ProactiveTriggerAdmin(admin.ModelAdmin):
+    """主动触发规则管理（运维可按用户调整触发频率，无需重新部署）"""
+    list_display = ['user', 'trigger_type', 'is_enabled', 'frequency_hours', 'last_triggered', 'next_fire_at']
+    list_filter = ['trigger_type', 'is_enabled']
+    search_fields = ['user__username']
+    readonly_fields = ['last_triggered', 'next_fire_at', 'created_at']
+
+
+@admin.register(MemoryEvent)
+class MemoryEventAdmin(admin.ModelAdmin):
+    """记忆事件日历"""
+    list_display = ['user', 'title', 'event_date', 'recurrence', 'next_occurrence', 'last_reminded', 'is_active']
+    list_filter = ['recurrence', 'is_active']
+    search_fields = ['user__username', 'title']
+    readonly_fields = ['memory', 'last_reminded', 'created_at', 'updated_at']
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 import threading
 import logging
 
@@ -7,16 +8,21 @@ logger = logging.getLogger(__name__)
 class ChatSystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat_system'
+    _services_started = False
     
-    def ready(self):
-        """Django应用启动时自动运行"""
-        # 避免在迁移时运行
-        import sys
-        if 'migrate' in sys.argv or 'makemigrations' in sys.argv:
+    def start_background_services(self):
+        """由服务入口（core/asgi.py、core/wsgi.py）显式调用，每进程只启动一次；
+        管理命令、测试脚本与模拟只加载应用，不会启动后台线程"""
+        if self._services_started or not getattr(settings, 'BACKGROUND_SERVICES', True):
             return
-            
+        self._services_started = True
+        
         # 启动主动触发引擎后台线程
         self.start_proactive_engine()
+        # 启动用户活动流消费者
+        self.start_activity_consumer()
+        # 启动后台记忆提取
+        self.start_memory_extractor()
     
     def start_proactive_engine(self):
         """启动主动触发引擎后台线程"""
@@ -39,6 +45,26 @@ class ChatSystemConfig(AppConfig):
             
         except Exception as e:
             logger.error(f"启动主动触发引擎失败: {e}")
+
+    def start_activity_consumer(self):
+        """启动用户活动流的后台消费线程"""
+        try:
+            from .proactive import proactive_engine  # 注册活动窗口回调
+            from .activity_stream import activity_stream
+            activity_stream.start()
+            logger.info("✅ 用户活动消费者已启动")
+        except Exception as e:
+            logger.error(f"启动用户活动消费者失败: {e}")
+
+    def start_memory_extractor(self):
+        """启动按会话水位增量提取记忆的后台线程"""
+        try:
+            from ai_engine.memory_extractor import memory_extractor
+            memory_extractor.start()
+            logger.info("✅ 后台记忆提取已启动")
+        except Exception as e:
+            logger.error(f"启动后台记忆提取失败: {e}")
+
     verbose_name = '聊天系统'
 
 
@@ -1,70 +1,116 @@
-import json
+import asyncio
+import heapq
 import logging
-from asgiref.sync import sync_to_async
+import random
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
-from .models import ChatSession, Message
+from urllib.parse import parse_qs
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .framing import json_codec, negotiate
+from .message_service import message_service
+from .outbound import OutboundQueue
+from .presence import presence_buffer
 from .proactive import proactive_engine
-from django.core.cache import cache
+from .session_cache import session_resolver
+from .session_events import session_events
 
 logger = logging.getLogger(__name__)
 
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    WELCOME_DELAY = (1, 3)  # 连接确认后延迟问候的秒数范围，打散重连风暴
+    codec = json_codec  # 帧编解码器，connect 时按协商结果替换
+    SENT_SEQ_WINDOW = 512  # 记住最近下发过的序号数；更早的序号视为已下发
+
     async def connect(self):
         try:
             self.session_id = self.scope['url_route']['kwargs']['session_id']
             self.user = self.scope.get('user', None)
             self._owner_user_id = None
-            self._owner_username = None
+            self._welcome_task = None
+            self._session_pk = None
+            self._last_sent_seq = 0  # 已下发给该连接的最大序号（resume_complete 回报给客户端）
+            # 已下发的序号（有界窗口），补发与实时推送据此去重；广播可能乱序到达，不能只比较最大序号
+            self._sent_seqs = set()
+            self._sent_heap = []
+            self._sent_floor = 0  # 移出窗口的最大序号，不大于它的都视为已下发
+            # 上行消息需要认证：scope 中的登录用户，或连接后第一帧 {type: 'auth', token} 携带的 JWT
+            # （令牌不放在 URL 查询参数里，避免被访问日志与代理记录）
+            self._auth_user_id = self.authenticate_user_id()
+            # 帧格式协商：默认 JSON 文本帧，客户端可选 msgpack 二进制帧
+            self.codec, subprotocol = negotiate(self.scope, self.query_param('proto'))
+            # 所有下行帧经有界出站队列写出，慢客户端不拖累 channel layer
+            self.outbound = OutboundQueue(self.write_frame, self.close, self.session_id, self.channel_name)
+            self.outbound.start()
             
             # 先接受连接，避免认证失败导致连接关闭
-            await self.accept()
+            await self.accept(subprotocol)
             
-            # 验证会话（非阻塞）
-            session_valid = await self.verify_session()
-            if not session_valid:
+            # 一次两级缓存查找同时完成会话校验与归属解析
+            session_info = await self.resolve_session()
+            if session_info is None:
                 logger.warning(f"会话验证失败: {self.session_id}")
                 # 发送错误消息但不关闭连接
-                await self.send(json.dumps({
+                await self.send_frame({
                     'type': 'error',
                     'message': '会话验证失败，但连接已建立'
-                }))
+                })
             
             # 添加到聊天组
             await self.channel_layer.group_add(f"chat_{self.session_id}", self.channel_name)
             
-            # 解析会话所属用户（用于主动触发）
-            try:
-                owner_id, owner_username = await self.get_session_owner()
-                self._owner_user_id = owner_id
-                self._owner_username = owner_username
-
+            # 会话所属用户（用于主动触发）
+            if session_info is not None:
+                self._owner_user_id = session_info.owner_id
+                self._session_pk = session_info.pk
                 # 添加到用户组（用于主动触发消息）
-                if owner_id is not None:
-                    await self.channel_layer.group_add(f"chat_{owner_id}", self.channel_name)
-                    # 通知主动触发引擎用户已连接
-                    proactive_engine.add_connected_user(owner_id, self.session_id)
-                    logger.info(f"用户 {owner_username} (ID: {owner_id}) 已连接WebSocket（由会话归属识别）")
-                    # 连接即问候（带冷却）
-                    await sync_to_async(proactive_engine.send_welcome_on_connect)(owner_id)
-            except Exception as e:
-                logger.error(f"获取会话所有者失败: {e}")
+                await self.channel_layer.group_add(f"chat_{self._owner_user_id}", self.channel_name)
+                # 通知主动触发引擎用户已连接
+                proactive_engine.add_connected_user(self._owner_user_id, self.session_id)
+                logger.info(f"用户(ID: {self._owner_user_id}) 已连接WebSocket（由会话归属识别）")
             
             # 发送连接确认
-            await self.send(json.dumps({
+            await self.send_frame({
                 'type': 'connection_established', 
                 'session_id': self.session_id,
                 'user_id': self._owner_user_id,
                 'status': 'connected'
-            }))
+            })
+
+            # 断线重连：客户端携带 last_seq 时只补发缺失的事件
+            last_seq = self.query_param('last_seq')
+            if last_seq is not None:
+                await self.replay_since(last_seq)
+
+            # 连接即问候（带冷却）：放到后台任务，不阻塞握手
+            if self._owner_user_id is not None:
+                self._welcome_task = asyncio.create_task(self.send_welcome(self._owner_user_id))
             
         except Exception as e:
             logger.error(f"WebSocket连接失败: {e}")
             await self.close()
 
+    async def send_welcome(self, owner_id):
+        """连接确认之后的后台问候；期间断开连接会被取消"""
+        try:
+            await asyncio.sleep(random.uniform(*self.WELCOME_DELAY))
+            # 不占用串行的数据库线程，避免阻塞其他连接的握手
+            await database_sync_to_async(proactive_engine.send_welcome_on_connect, thread_sensitive=False)(owner_id)
+        except Exception as e:
+            logger.error(f"连接问候任务失败: {e}")
+
     async def disconnect(self, close_code):
+        # 取消尚未完成的连接问候
+        welcome_task = getattr(self, '_welcome_task', None)
+        if welcome_task and not welcome_task.done():
+            welcome_task.cancel()
+        outbound = getattr(self, 'outbound', None)
+        if outbound is not None:
+            await outbound.stop()
+
         # 从聊天组移除
         await self.channel_layer.group_discard(f"chat_{self.session_id}", self.channel_name)
         
@@ -79,82 +125,197 @@ class ChatConsumer(AsyncWebsocketConsumer):
             proactive_engine.remove_connected_user(target_user_id)
             logger.info(f"用户(ID: {target_user_id}) 已断开WebSocket")
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def send_frame(self, payload, coalesce_key=None):
+        """下行帧入出站队列；coalesce_key 相同且尚未写出的帧只保留最新一条"""
+        self.outbound.put(payload, coalesce_key)
+
+    async def write_frame(self, payload):
+        """按协商的帧格式编码并写出（由出站队列的写出任务调用）"""
+        frame = self.codec.encode(payload)
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            # 二进制帧按协商的编解码器解析，文本帧始终按 JSON 解析（兼容旧客户端）
+            data = self.codec.decode(bytes_data) if bytes_data is not None else json_codec.decode(text_data)
+        except Exception as e:
+            logger.warning(f"WebSocket帧解析失败: {e}")
+            return
         # 心跳
         if data.get('type') == 'ping':
-            await self.send(json.dumps({'type': 'pong', 'ts': data.get('ts')}))
+            # 尚未写出的 pong 合并为一条（只回最新的 ts）
+            await self.send_frame({'type': 'pong', 'ts': data.get('ts')}, coalesce_key='pong')
+            return
+        if data.get('type') == 'resume':
+            # 连接保持期间的补发请求
+            await self.replay_since(data.get('last_seq'))
+            return
+        if data.get('type') == 'auth':
+            await self.receive_auth(data)
             return
         if data.get('type') == 'chat_message':
-            # 改为仅作为上行通道，不再在WS端保存与广播用户消息，避免与REST重复
-            # 用户侧入库与AI回复由REST负责
+            # 与 REST 创建消息同一语义入库，回 ack 帧；用户消息不在WS端广播，前端已本地展示
+            await self.receive_chat_message(data)
             return
         if data.get('type') == 'activity':
-            # 记录用户活动心跳（用于主动引擎节流）
+            # 记录用户活动心跳（主动消息闸门据此暂缓打扰）：写进程内缓冲，由后台批量刷入Redis；
+            # 以服务端收到的时间为准，不信任客户端时钟
             owner_id = self._owner_user_id or (self.user.id if getattr(self.user, 'is_authenticated', False) else None)
             if owner_id:
-                cache.set(f"last_activity_at:{owner_id}", data.get('ts') or 0, timeout=3600)
+                presence_buffer.mark_activity(owner_id)
+            return
+
+    async def receive_auth(self, data):
+        """首帧认证：校验 JWT，回复 auth_result"""
+        user_id = await self.authenticate_token(data.get('token'))
+        if user_id is not None:
+            self._auth_user_id = user_id
+        await self.send_frame({'type': 'auth_result', 'success': user_id is not None})
+
+    async def receive_chat_message(self, data):
+        """处理WebSocket上行的用户消息，回复 chat_ack（含入库后的消息ID）"""
+        client_msg_id = data.get('client_msg_id')
+        ack = {'type': 'chat_ack', 'client_msg_id': client_msg_id}
+        if self._auth_user_id is None or self._auth_user_id != self._owner_user_id:
+            ack.update({'success': False, 'message': '未认证或无权限，请通过REST发送'})
+            await self.send_frame(ack)
             return
+        try:
+            message, created = await self.ingest_message(
+                data.get('content', ''),
+                data.get('content_type', 'text'),
+                client_msg_id,
+            )
+        except Exception as e:
+            logger.error(f"WebSocket消息入库失败: {e}")
+            message, created = None, False
+        if message is None:
+            ack.update({'success': False, 'message': '会话不存在或已停用'})
+        else:
+            ack.update({
+                'success': True,
+                'id': message.id,
+                'seq': message.seq,
+                'timestamp': message.timestamp.isoformat(),
+                'duplicate': not created,
+            })
+        await self.send_frame(ack)
 
     async def chat_message(self, event):
         # 统一规范字段命名，补充缺失的字段，便于前端去重
         msg = event['message']
-        payload = {
-            'type': 'chat_message',
-            'message': {
-                'id': msg.get('id'),
-                'content': msg.get('content'),
-                'content_type': msg.get('content_type', 'text'),
-                'sender': msg.get('sender', 'ai'),
-                'timestamp': msg.get('timestamp')
-            }
+        seq = msg.get('seq')
+        # 已通过补发或实时推送下发过的事件不再重复推送
+        if seq and not self.mark_sent(seq):
+            return
+        await self.send_frame({'type': 'chat_message', 'message': self.message_frame(msg)})
+
+    def mark_sent(self, seq):
+        """记录序号已下发；已下发过时返回 False"""
+        if seq <= self._sent_floor or seq in self._sent_seqs:
+            return False
+        self._sent_seqs.add(seq)
+        heapq.heappush(self._sent_heap, seq)
+        if len(self._sent_heap) > self.SENT_SEQ_WINDOW:
+            self._sent_floor = heapq.heappop(self._sent_heap)
+            self._sent_seqs.discard(self._sent_floor)
+        self._last_sent_seq = max(self._last_sent_seq, seq)
+        return True
+
+    def message_frame(self, msg):
+        frame = {
+            'id': msg.get('id'),
+            'seq': msg.get('seq'),
+            'content': msg.get('content'),
+            'content_type': msg.get('content_type', 'text'),
+            'sender': msg.get('sender', 'ai'),
+            'timestamp': msg.get('timestamp')
         }
-        await self.send(json.dumps(payload))
+        for field in ('text', 'is_proactive', 'message_type', 'client_msg_id'):
+            if msg.get(field):
+                frame[field] = msg[field]
+        return frame
+
+    async def replay_since(self, last_seq):
+        """补发 seq > last_seq 的事件，最后发送 resume_complete"""
+        try:
+            last_seq = int(last_seq)
+        except (TypeError, ValueError):
+            return
+        if self._session_pk is None:
+            return
+        events = await database_sync_to_async(session_events.replay)(self._session_pk, last_seq)
+        frames = []
+        for event in events:
+            if event.get('seq') and not self.mark_sent(event['seq']):
+                continue
+            frames.append(self.message_frame(event))
+        if self.codec.binary:
+            # 二进制协议下整批补发合成一帧，超过阈值时整体压缩
+            if frames:
+                await self.send_frame({'type': 'replay', 'events': frames})
+        else:
+            for frame in frames:
+                await self.send_frame({'type': 'chat_message', 'message': frame, 'replayed': True})
+        await self.send_frame({
+            'type': 'resume_complete',
+            'count': len(frames),
+            'last_seq': max(self._last_sent_seq, last_seq),
+        })
 
     async def typing_status(self, event):
         # 将服务端的打字状态透传给前端
         is_typing = event.get('is_typing', False)
         sender = event.get('sender', 'ai')
-        await self.send(json.dumps({
+        await self.send_frame({
             'type': 'typing_status',
             'is_typing': is_typing,
             'sender': sender,
             'session_id': self.session_id
-        }))
+        }, coalesce_key=f"typing:{sender}")
 
     @database_sync_to_async
-    def verify_session(self):
-        try:
-            sid = str(self.session_id)
-            if sid.isdigit():
-                ChatSession.objects.get(id=int(sid))
-            else:
-                ChatSession.objects.get(session_id=sid)
-            return True
-        except ChatSession.DoesNotExist:
-            return False
+    def resolve_session(self):
+        """解析会话（兼容整数主键与字符串 session_id），不存在返回 None"""
+        return session_resolver.resolve(self.session_id)
 
-    @database_sync_to_async
-    def save_message(self, content, content_type):
-        sid = str(self.session_id)
-        if sid.isdigit():
-            session = ChatSession.objects.get(id=int(sid))
-        else:
-            session = ChatSession.objects.get(session_id=sid)
-        return Message.objects.create(session=session, content=content, content_type=content_type, sender='user')
+    def query_param(self, name):
+        return parse_qs(self.scope.get('query_string', b'').decode('utf-8')).get(name, [None])[0]
+
+    def authenticate_user_id(self):
+        """scope 中已登录且未停用的用户ID；否则返回 None，等待首帧认证"""
+        if getattr(self.user, 'is_authenticated', False) and getattr(self.user, 'is_active', False):
+            return self.user.id
+        return None
 
     @database_sync_to_async
-    def get_session_owner(self):
-        """返回会话所属用户 (id, username)；若异常返回 (None, None)"""
+    def authenticate_token(self, token):
+        """校验 JWT 并确认用户存在且未停用（与 DRF 的 JWTAuthentication 一致），返回用户ID或 None"""
+        if not token:
+            return None
         try:
-            sid = str(self.session_id)
-            if sid.isdigit():
-                session = ChatSession.objects.get(id=int(sid))
-            else:
-                session = ChatSession.objects.get(session_id=sid)
-            user = session.user
-            return user.id, getattr(user, 'username', None)
-        except Exception:
-            return None, None
-
+            user_id = AccessToken(token)[api_settings.USER_ID_CLAIM]
+        except (TokenError, KeyError) as e:
+            logger.warning(f"WebSocket令牌校验失败: {e}")
+            return None
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).only('id', 'is_active').first()
+        if user is None or not user.is_active:
+            logger.warning(f"WebSocket令牌对应的用户不存在或已停用: {user_id}")
+            return None
+        return user.id
 
+    @database_sync_to_async
+    def ingest_message(self, content, content_type, client_msg_id):
+        """入库并调度AI回复；会话不存在或已停用时返回 (None, False)"""
+        info = session_resolver.resolve(self.session_id)
+        if info is None or not info.is_active or info.owner_id != self._auth_user_id:
+            return None, False
+        message, created = message_service.ingest_user_message(
+            info.owner_id, info.pk, content, content_type, client_msg_id
+        )
+        if created:
+            message_service.schedule_reply(info.pk, info.owner_id)
+        return message, created
@@ -0,0 +1,127 @@
+"""
+用户滚动情绪状态
+每条新的用户消息只分析一次，按指数加权移动平均累积情绪效价与强度；
+实时状态以紧凑结构存放在缓存中，并定期快照到 UserEmotionState，关怀判断只需一次查找
+"""
+
+import logging
+from django.core.cache import cache
+from django.utils import timezone
+from ai_engine.emotion_analyzer import emotion_analyzer
+
+logger = logging.getLogger(__name__)
+
+
+class EmotionStateTracker:
+    """用户情绪状态跟踪器"""
+
+    ALPHA = 0.3  # EWMA 平滑系数，越大越偏向最新消息
+    STATE_TTL = 7 * 24 * 3600
+    SNAPSHOT_EVERY = 10  # 每累积多少条消息落库一次
+    SNAPSHOT_INTERVAL = 600  # 距上次落库超过该秒数也会落库
+
+    # 关怀阈值（与 EmotionAnalyzer.should_trigger_care 的单条判断口径对齐）
+    CARE_VALENCE = -0.4
+    CARE_INTENSITY = 0.8
+    CARE_MAX_AGE = 24 * 3600  # 超过该秒数没有新消息的状态不再触发关怀
+    KEYWORD_MAX_CONFIDENCE = 0.8  # 仅凭关键词分析时的置信度上限
+
+    VALENCE_MAP = {'positive': 1.0, 'neutral': 0.0, 'negative': -1.0}
+    INTENSITY_MAP = {'high': 1.0, 'medium': 0.5, 'low': 0.2}
+
+    def _key(self, user_id):
+        return f"emotion_state:{user_id}"
+
+    def observe(self, emotion_analysis):
+        """把一次情绪分析结果转换为 (效价, 强度, 具体情绪)"""
+        confidence = float(emotion_analysis.get('confidence', 0.5) or 0.0)
+        valence = self.VALENCE_MAP.get(emotion_analysis.get('primary_emotion'), 0.0) * confidence
+        intensity = self.INTENSITY_MAP.get(emotion_analysis.get('intensity'), 0.5) * confidence
+        return valence, intensity, emotion_analysis.get('specific_emotion', '')
+
+    def get(self, user_id):
+        """读取用户情绪状态：缓存未命中时从数据库快照恢复"""
+        state = cache.get(self._key(user_id))
+        if state is not None:
+            return state
+        from .models import UserEmotionState
+        row = UserEmotionState.objects.filter(user_id=user_id).first()
+        if row is None:
+            return None
+        state = {
+            'v': row.valence,
+            'i': row.intensity,
+            'e': row.last_emotion,
+            'n': row.message_count,
+            's': row.message_count,  # 已落库的消息数
+            't': row.updated_at.timestamp(),
+            'st': row.updated_at.timestamp(),  # 上次落库时间
+        }
+        cache.set(self._key(user_id), state, timeout=self.STATE_TTL)
+        return state
+
+    def update(self, user_id, emotion_analysis):
+        """计入一条新消息的情绪分析结果，返回更新后的状态"""
+        valence, intensity, emotion = self.observe(emotion_analysis)
+        now_ts = timezone.now().timestamp()
+        state = self.get(user_id)
+        if not state or not state.get('n'):
+            state = {'v': valence, 'i': intensity, 'e': emotion, 'n': 1, 's': 0, 't': now_ts, 'st': now_ts}
+        else:
+            state['v'] = self.ALPHA * valence + (1 - self.ALPHA) * state['v']
+            state['i'] = self.ALPHA * intensity + (1 - self.ALPHA) * state['i']
+            state['e'] = emotion or state.get('e', '')
+            state['n'] += 1
+            state['t'] = now_ts
+        if state['n'] - state.get('s', 0) >= self.SNAPSHOT_EVERY or now_ts - state.get('st', 0) >= self.SNAPSHOT_INTERVAL:
+            self.snapshot(user_id, state)
+            state['s'] = state['n']
+            state['st'] = now_ts
+        cache.set(self._key(user_id), state, timeout=self.STATE_TTL)
+        return state
+
+    def keyword_analysis(self, text):
+        """仅凭情绪关键词的分析结果（不调用大模型），格式与 analyze_text_emotion 一致"""
+        scores = emotion_analyzer._calculate_keyword_scores(text)
+        if not any(scores.values()):
+            return {'primary_emotion': 'neutral', 'intensity': 'low', 'specific_emotion': '平静', 'confidence': 0.3}
+        primary_emotion = max(scores, key=scores.get)
+        return {
+            'primary_emotion': primary_emotion,
+            'intensity': 'medium',
+            'specific_emotion': '',
+            # 关键词越集中于主情绪越可信，上限低于大模型分析
+            'confidence': self.KEYWORD_MAX_CONFIDENCE * scores[primary_emotion],
+        }
+
+    def update_from_text(self, user_id, text):
+        """按关键词分析计入一条新消息，返回更新后的状态"""
+        return self.update(user_id, self.keyword_analysis(text))
+
+    def snapshot(self, user_id, state):
+        """把实时状态写入数据库"""
+        from .models import UserEmotionState
+        try:
+            UserEmotionState.objects.update_or_create(
+                user_id=user_id,
+                defaults={
+                    'valence': state['v'],
+                    'intensity': state['i'],
+                    'last_emotion': (state.get('e') or '')[:50],
+                    'message_count': state['n'],
+                }
+            )
+        except Exception as e:
+            logger.error(f"情绪状态落库失败 user_id={user_id}: {e}")
+
+    def should_care(self, state):
+        """基于滚动状态判断是否需要关怀（周期任务按用户取出存储的状态调用）"""
+        if not state or not state.get('n'):
+            return False
+        if timezone.now().timestamp() - state.get('t', 0) > self.CARE_MAX_AGE:
+            return False
+        return state['v'] <= self.CARE_VALENCE or state['i'] >= self.CARE_INTENSITY
+
+
+# 全局实例
+emotion_state = EmotionStateTracker()
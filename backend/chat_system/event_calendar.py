@@ -0,0 +1,171 @@
+"""
+记忆事件日历
+记忆提取时把带日期的事件记忆（生日、纪念日、计划等）归一化为 MemoryEvent，
+每日任务按 next_occurrence 索引一次范围查询取出当天的事件，经主动发送通道发出提醒
+"""
+
+import logging
+import re
+from datetime import date, timedelta
+from django.utils import timezone
+from .models import MemoryEvent
+
+logger = logging.getLogger(__name__)
+
+
+class EventCalendar:
+    """记忆事件日历"""
+
+    # 带年份的完整日期：2024-05-03 / 2024/5/3 / 2024.5.3 / 2024年5月3日
+    FULL_DATE_RE = re.compile(r'(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})\s*[日号]?')
+    # 只有月日：5月3日 / 5月3号（必须带“月”，避免把“每周健身3-4次”这类范围当成日期）
+    MONTH_DAY_RE = re.compile(r'(?<!\d)(\d{1,2})\s*月\s*(\d{1,2})\s*[日号]?')
+    # 整段文本只是一个月日：05-03 / 5/3（大模型返回的 date 字段）
+    BARE_MONTH_DAY_RE = re.compile(r'\s*(\d{1,2})\s*[-/]\s*(\d{1,2})\s*')
+    # 相对日期
+    RELATIVE_DAYS = {'今天': 0, '明天': 1, '后天': 2, '大后天': 3}
+    # 这些关键词的事件每年重复
+    YEARLY_KEYWORDS = ('生日', '纪念日', '周年', '节日', 'birthday', 'anniversary')
+    # 常见记忆键对应的标题
+    KEY_TITLES = {
+        'birthday': '生日',
+        'user_birthday': '生日',
+        'anniversary': '纪念日',
+    }
+
+    # -------------------- 日期解析 --------------------
+    def parse_date(self, text, today=None):
+        """从文本中解析日期，返回 (date, 是否包含年份)；无法解析时返回 (None, False)"""
+        if not text:
+            return None, False
+        today = today or timezone.localdate()
+        match = self.FULL_DATE_RE.search(text)
+        if match:
+            try:
+                return date(int(match.group(1)), int(match.group(2)), int(match.group(3))), True
+            except ValueError:
+                pass
+        match = self.BARE_MONTH_DAY_RE.fullmatch(text) or self.MONTH_DAY_RE.search(text)
+        if match:
+            month, day = int(match.group(1)), int(match.group(2))
+            # 年份未知：取今天及之后的第一次出现（保留原始月日，2月29日取下一个闰年，平年的顺延在计算下次发生日期时处理）
+            for year in range(today.year, today.year + 9):
+                try:
+                    candidate = date(year, month, day)
+                except ValueError:
+                    continue
+                if candidate >= today:
+                    return candidate, False
+        # 按长度优先匹配，避免“大后天”被“后天”截断
+        for word in sorted(self.RELATIVE_DAYS, key=len, reverse=True):
+            if word in text:
+                return today + timedelta(days=self.RELATIVE_DAYS[word]), True
+        return None, False
+
+    def is_yearly(self, memory, has_year):
+        """生日、纪念日等每年重复；没有年份的月日也按每年处理"""
+        text = f"{memory.key} {memory.value}".lower()
+        if any(keyword in text for keyword in self.YEARLY_KEYWORDS):
+            return True
+        return not has_year
+
+    def build_title(self, memory):
+        """事件标题：去掉日期部分的记忆值，为空时按记忆键取默认标题"""
+        title = memory.value
+        for pattern in (self.FULL_DATE_RE, self.MONTH_DAY_RE):
+            title = pattern.sub('', title)
+        title = title.strip(' ，,：:。是在')
+        if not title:
+            title = self.KEY_TITLES.get(memory.key, memory.key)
+        return title[:100]
+
+    # -------------------- 同步 --------------------
+    def build_event(self, memory, date_hint=None, today=None):
+        """由记忆构造日历事件（未入库）；不是事件记忆或解析不出日期时返回 None
+
+        只从日期字段与记忆值中解析日期；context 是整段对话，其中的“今天”等词多半与该事件无关
+        """
+        if not (memory.is_active and memory.memory_type == 'event'):
+            return None
+        today = today or timezone.localdate()
+        event_date, has_year = (None, False)
+        for text in (date_hint, memory.value):
+            event_date, has_year = self.parse_date(text, today)
+            if event_date:
+                break
+        if not event_date:
+            return None
+        event = MemoryEvent(
+            user_id=memory.user_id,
+            memory=memory,
+            title=self.build_title(memory),
+            event_date=event_date,
+            recurrence='yearly' if self.is_yearly(memory, has_year) else 'once',
+        )
+        event.next_occurrence = event.compute_next_occurrence(today)
+        event.is_active = event.next_occurrence is not None
+        return event
+
+    def sync_memories(self, pairs, today=None):
+        """批量同步日历：pairs 为 [(记忆, 日期字段)]，一条 upsert 写入带日期的事件、一条删除移除其余事件，
+        返回写入的事件列表"""
+        try:
+            today = today or timezone.localdate()
+            events, removed = [], []
+            for memory, date_hint in pairs:
+                event = self.build_event(memory, date_hint, today)
+                if event is None:
+                    removed.append(memory.pk)
+                else:
+                    events.append(event)
+            if removed:
+                MemoryEvent.objects.filter(memory_id__in=removed).delete()
+            if events:
+                MemoryEvent.objects.bulk_create(
+                    events,
+                    update_conflicts=True,
+                    unique_fields=['memory'],
+                    update_fields=['user', 'title', 'event_date', 'recurrence', 'next_occurrence', 'is_active',
+                                   'updated_at'],
+                )
+            return events
+        except Exception as e:
+            logger.error(f"同步记忆事件失败 memory_ids={[memory.pk for memory, _ in pairs]}: {e}")
+            return []
+
+    def sync_memory(self, memory, date_hint=None, today=None):
+        """单条记忆保存后同步日历：事件记忆带日期时写入/更新 MemoryEvent，否则移除已有事件"""
+        events = self.sync_memories([(memory, date_hint)], today)
+        return events[0] if events else None
+
+    # -------------------- 每日扫描 --------------------
+    def due_events(self, today=None, user_ids=None):
+        """一次索引范围查询取出已到期（含今天之前漏掉的）事件"""
+        today = today or timezone.localdate()
+        queryset = MemoryEvent.objects.filter(is_active=True, next_occurrence__lte=today)
+        if user_ids is not None:
+            queryset = queryset.filter(user_id__in=list(user_ids))
+        return list(queryset.select_related('user'))
+
+    def advance(self, events, today=None):
+        """把已提醒或已错过的事件推进到下一次发生日期，单次事件随之停用"""
+        if not events:
+            return 0
+        today = today or timezone.localdate()
+        for event in events:
+            event.next_occurrence = event.compute_next_occurrence(today + timedelta(days=1))
+            event.is_active = event.next_occurrence is not None
+        MemoryEvent.objects.bulk_update(events, ['next_occurrence', 'is_active', 'last_reminded'])
+        return len(events)
+
+    def reminder_message(self, event):
+        """提醒文案"""
+        if event.title == '生日':
+            return "今天是你的生日呀！🎂 生日快乐～有什么庆祝计划吗？"
+        if event.recurrence == 'yearly':
+            return f"今天是{event.title}呢，我一直记着～想听听你打算怎么过！"
+        return f"今天就是{event.title}的日子啦，准备得怎么样了？加油，我在这儿等你的好消息～"
+
+
+# 全局实例
+event_calendar = EventCalendar()
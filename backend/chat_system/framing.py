@@ -0,0 +1,154 @@
+"""
+WebSocket 帧编解码
+默认 JSON 文本帧（兼容旧客户端）；客户端通过子协议 mira.msgpack.v1 或查询参数 ?proto=msgpack 协商后，
+改用 msgpack 二进制帧：字段名替换为短整数ID、type 取值替换为整数码、时间戳转为毫秒整数，
+帧首字节为标志位，超过阈值的帧（历史/补发批次）用 zlib 压缩
+"""
+
+import json
+import logging
+import zlib
+from datetime import datetime
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MSGPACK_SUBPROTOCOL = 'mira.msgpack.v1'
+
+# 字段名 -> 短ID（只追加，不修改已有编号）
+FIELD_IDS = {
+    'type': 0,
+    'message': 1,
+    'id': 2,
+    'seq': 3,
+    'content': 4,
+    'content_type': 5,
+    'sender': 6,
+    'timestamp': 7,
+    'session_id': 8,
+    'is_typing': 9,
+    'text': 10,
+    'is_proactive': 11,
+    'message_type': 12,
+    'client_msg_id': 13,
+    'replayed': 14,
+    'count': 15,
+    'last_seq': 16,
+    'events': 17,
+    'success': 18,
+    'duplicate': 19,
+    'user_id': 20,
+    'status': 21,
+    'ts': 22,
+    'is_read': 23,
+    'token': 24,
+}
+FIELD_NAMES = {v: k for k, v in FIELD_IDS.items()}
+
+# type 取值 -> 短码
+TYPE_CODES = {
+    'chat_message': 1,
+    'typing_status': 2,
+    'chat_ack': 3,
+    'ping': 4,
+    'pong': 5,
+    'connection_established': 6,
+    'error': 7,
+    'resume': 8,
+    'resume_complete': 9,
+    'replay': 10,
+    'activity': 11,
+    'auth': 12,
+    'auth_result': 13,
+}
+TYPE_NAMES = {v: k for k, v in TYPE_CODES.items()}
+
+FLAG_PLAIN = 0
+FLAG_ZLIB = 1
+
+
+class JsonCodec:
+    """JSON 文本帧（默认）"""
+
+    name = 'json'
+    binary = False
+
+    def encode(self, payload):
+        return json.dumps(payload)
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    """msgpack 二进制帧"""
+
+    name = 'msgpack'
+    binary = True
+    COMPRESS_THRESHOLD = 1024  # 超过该字节数的帧压缩
+    COMPRESS_LEVEL = 6
+
+    def _pack_value(self, key, value):
+        if key == 'type' and value in TYPE_CODES:
+            return TYPE_CODES[value]
+        if key == 'timestamp' and isinstance(value, str):
+            try:
+                return int(datetime.fromisoformat(value).timestamp() * 1000)
+            except ValueError:
+                return value
+        return self._pack(value)
+
+    def _pack(self, value):
+        if isinstance(value, dict):
+            return {FIELD_IDS.get(k, k): self._pack_value(k, v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._pack(item) for item in value]
+        return value
+
+    def _unpack(self, value):
+        if isinstance(value, dict):
+            result = {}
+            for k, v in value.items():
+                name = FIELD_NAMES.get(k, k)
+                if name == 'type' and isinstance(v, int):
+                    v = TYPE_NAMES.get(v, v)
+                else:
+                    v = self._unpack(v)
+                result[name] = v
+            return result
+        if isinstance(value, list):
+            return [self._unpack(item) for item in value]
+        return value
+
+    def encode(self, payload):
+        body = msgpack.packb(self._pack(payload), use_bin_type=True)
+        if len(body) > self.COMPRESS_THRESHOLD:
+            return bytes([FLAG_ZLIB]) + zlib.compress(body, self.COMPRESS_LEVEL)
+        return bytes([FLAG_PLAIN]) + body
+
+    def decode(self, data):
+        flag, body = data[0], data[1:]
+        if flag == FLAG_ZLIB:
+            body = zlib.decompress(body)
+        return self._unpack(msgpack.unpackb(body, raw=False, strict_map_key=False))
+
+
+json_codec = JsonCodec()
+msgpack_codec = MsgpackCodec() if MSGPACK_AVAILABLE else None
+
+
+def negotiate(scope, query_proto=None):
+    """按子协议或查询参数选择编解码器，返回 (codec, 需回应的子协议)"""
+    subprotocols = scope.get('subprotocols') or []
+    if MSGPACK_SUBPROTOCOL in subprotocols:
+        if msgpack_codec is not None:
+            return msgpack_codec, MSGPACK_SUBPROTOCOL
+        logger.warning("客户端请求 msgpack 帧，但服务端未安装 msgpack，退回 JSON")
+    elif query_proto == 'msgpack' and msgpack_codec is not None:
+        return msgpack_codec, None
+    return json_codec, None
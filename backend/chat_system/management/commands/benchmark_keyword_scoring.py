@@ -0,0 +1,91 @@
+# Django management commands
+from django.core.management.base import BaseCommand
+from ai_engine.emotion_analyzer import emotion_analyzer
+import random
+import time
+
+
+# 聊天消息常见的几种写法：短回复 / 普通句子 / 长段落
+SAMPLE_MESSAGES = [
+    '嗯嗯好的',
+    '今天真的好累啊，压力好大😭',
+    '哈哈哈哈太棒了，超级开心！',
+    '有点焦虑，不知道明天的面试会不会顺利，感觉自己准备得还不够充分，好烦躁',
+    '我们周末去看电影吧，最近上映的那部好像还不错，你觉得呢🤔',
+]
+
+
+class Command(BaseCommand):
+    help = '对比逐个关键词 str.count 与 Aho–Corasick 一次扫描的情绪关键词打分耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000, help='参与测试的消息条数')
+        parser.add_argument('--repeat', type=int, default=3, help='重复次数（取最快一次）')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['messages']
+        # 短消息随机拼接 1~3 句；长文本（如整段对话回填）拼接 10~20 句
+        datasets = [
+            ('聊天消息', [
+                ''.join(rng.choice(SAMPLE_MESSAGES) for _ in range(rng.randint(1, 3))) for _ in range(count)
+            ]),
+            ('长文本', [
+                ''.join(rng.choice(SAMPLE_MESSAGES) for _ in range(rng.randint(10, 20))) for _ in range(count // 10)
+            ]),
+        ]
+        keyword_groups = {**emotion_analyzer.emotion_keywords, **emotion_analyzer.intensity_words}
+        automaton = emotion_analyzer.keyword_automaton
+
+        def automaton_count(text):
+            # 共享自动机还包含其他组（如 AIEngine 的褒贬词），只比较情绪词与强度词
+            counts = automaton.group_counts(text)
+            return {label: counts[label] for label in keyword_groups}
+
+        def loop_count(text):
+            # 原实现：每个关键词各扫描一次全文
+            return {
+                label: sum(text.count(keyword) for keyword in keywords)
+                for label, keywords in keyword_groups.items()
+            }
+
+        def best_of(func):
+            best = None
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+
+        self.stdout.write(self.style.SUCCESS(
+            f'📊 共享自动机关键词 {len(automaton.keywords)} 个（情绪词与强度词 {len(set().union(*keyword_groups.values()))} 个）'
+        ))
+        for dataset, texts in datasets:
+            # 结果一致性校验
+            mismatches = sum(1 for text in texts[:2000] if loop_count(text) != automaton_count(text))
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f'❌ {dataset}: 两种实现结果不一致 {mismatches} 条'))
+                return
+
+            avg_chars = sum(len(text) for text in texts) / len(texts)
+            self.stdout.write(f'\n{dataset}: {len(texts)} 条，平均 {avg_chars:.1f} 字')
+            cases = [
+                ('逐个关键词 str.count', lambda: [loop_count(text) for text in texts]),
+                ('KeywordAutomaton', lambda: automaton.group_counts_batch(texts)),
+                ('analyze_batch(含打分)', lambda: emotion_analyzer.analyze_batch(texts)),
+            ]
+            baseline = None
+            for name, func in cases:
+                elapsed = best_of(func)
+                baseline = baseline or elapsed
+                self.stdout.write(
+                    f'  {name:<22} 总耗时 {elapsed * 1000:8.1f} ms   每条 {elapsed / len(texts) * 1e6:7.2f} µs   '
+                    f'相对原实现 {baseline / elapsed:4.1f}x'
+                )
+                if name == 'KeywordAutomaton' and elapsed > baseline:
+                    # 自动机逐字扫描是 Python 循环，长文本上可能慢于多次 C 实现的 str.count，如实报告
+                    self.stdout.write(self.style.WARNING(
+                        f'  ⚠️  {dataset}上 {name} 比逐个关键词 str.count 慢 {elapsed / baseline:.1f} 倍'
+                    ))
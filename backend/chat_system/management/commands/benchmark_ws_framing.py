@@ -0,0 +1,84 @@
+# Django management commands
+from django.core.management.base import BaseCommand
+from chat_system.framing import json_codec, msgpack_codec, MSGPACK_AVAILABLE
+import random
+import time
+
+
+# 常见气泡长度（字符数）：短回复 / 普通句子 / 长段落
+BUBBLE_SIZES = [8, 30, 120, 400]
+SAMPLE_TEXT = '今天天气不错我们一起去散步吧你最近工作还顺利吗记得按时吃饭早点休息哈哈'
+
+
+class Command(BaseCommand):
+    help = '对比 JSON 与 msgpack WebSocket 帧的每条消息字节数与编码耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=2000, help='每种帧的编码次数')
+        parser.add_argument('--replay-size', type=int, default=50, help='补发批次的事件数')
+        parser.add_argument('--seed', type=int, default=42, help='随机种子')
+
+    def handle(self, *args, **options):
+        if not MSGPACK_AVAILABLE:
+            self.stdout.write(self.style.ERROR('❌ 未安装 msgpack，无法对比（pip install msgpack）'))
+            return
+
+        rng = random.Random(options['seed'])
+        iterations = options['iterations']
+
+        def bubble(length, seq):
+            content = ''.join(rng.choice(SAMPLE_TEXT) for _ in range(length))
+            return {
+                'id': 100000 + seq,
+                'seq': seq,
+                'content': content,
+                'content_type': 'text',
+                'sender': 'ai',
+                'timestamp': '2024-05-01T12:00:00.123456+00:00',
+            }
+
+        cases = [
+            (f'气泡 {size} 字', {'type': 'chat_message', 'message': bubble(size, 1)})
+            for size in BUBBLE_SIZES
+        ]
+        cases.append(('打字状态', {
+            'type': 'typing_status', 'is_typing': True, 'sender': 'ai', 'session_id': 'session_1714550400000'
+        }))
+        events = [bubble(rng.choice(BUBBLE_SIZES), seq) for seq in range(1, options['replay_size'] + 1)]
+        # JSON 客户端逐条补发，msgpack 客户端整批一帧
+        json_replay = [{'type': 'chat_message', 'message': event, 'replayed': True} for event in events]
+        msgpack_replay = {'type': 'replay', 'events': events}
+
+        self.stdout.write(f"📏 每种帧编码 {iterations} 次")
+        self.stdout.write("-" * 70)
+        self.stdout.write(f"{'帧':<14}{'JSON 字节':>10}{'msgpack 字节':>14}{'节省':>8}{'JSON µs':>10}{'msgpack µs':>12}")
+        for label, payload in cases:
+            json_bytes, json_us = self._measure(json_codec, payload, iterations)
+            mp_bytes, mp_us = self._measure(msgpack_codec, payload, iterations)
+            self._row(label, json_bytes, mp_bytes, json_us, mp_us)
+
+        json_bytes, json_us = 0, 0.0
+        for frame in json_replay:
+            size, cost = self._measure(json_codec, frame, max(1, iterations // 10))
+            json_bytes += size
+            json_us += cost
+        mp_bytes, mp_us = self._measure(msgpack_codec, msgpack_replay, max(1, iterations // 10))
+        self._row(f"补发 {len(events)} 条", json_bytes, mp_bytes, json_us, mp_us)
+        self.stdout.write("-" * 70)
+        self.stdout.write(
+            f"💡 msgpack 帧超过 {msgpack_codec.COMPRESS_THRESHOLD} 字节时以 zlib 压缩（帧首字节标志位）"
+        )
+        self.stdout.write(self.style.SUCCESS('✅ 基准测试完成'))
+
+    def _measure(self, codec, payload, iterations):
+        """返回 (编码后字节数, 平均编码耗时µs)"""
+        frame = codec.encode(payload)
+        size = len(frame.encode('utf-8')) if isinstance(frame, str) else len(frame)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            codec.encode(payload)
+        return size, (time.perf_counter() - start) / iterations * 1e6
+
+    def _row(self, label, json_bytes, mp_bytes, json_us, mp_us):
+        saving = f"{(1 - mp_bytes / json_bytes) * 100:.0f}%" if json_bytes else '-'
+        self.stdout.write(f"{label:<14}{json_bytes:>10}{mp_bytes:>14}{saving:>8}{json_us:>10.1f}{mp_us:>12.1f}")
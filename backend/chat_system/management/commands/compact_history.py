@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from chat_system.retention import history_retention
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = '按保留期把超期的对话历史与用户活动归档为按用户压缩的 NDJSON，并分批从数据库删除'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--table',
+            action='append',
+            choices=list(history_retention.RETENTION_DAYS),
+            help='只处理指定的表（可重复）',
+        )
+        parser.add_argument('--pause', type=float, default=history_retention.BATCH_PAUSE, help='两批删除之间的间隔秒数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计超期行数，不归档也不删除')
+
+    def handle(self, *args, **options):
+        try:
+            for table in options['table'] or history_retention.RETENTION_DAYS:
+                days = history_retention.RETENTION_DAYS.get(table)
+                self.stdout.write(f"  {table}: 保留 {days or '不限'} 天")
+            self.stdout.write(self.style.SUCCESS(f'🗄️  归档目录: {history_retention.ARCHIVE_DIR}'))
+
+            results = history_retention.compact(options['table'], dry_run=options['dry_run'], pause=options['pause'])
+            for table, (archived, deleted) in results.items():
+                if options['dry_run']:
+                    self.stdout.write(f'🔍 {table}: {archived} 行超期')
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'✅ {table}: 归档 {archived} 行，删除 {deleted} 行'))
+
+        except Exception as e:
+            logger.error(f"历史数据归档失败: {e}")
+            self.stdout.write(self.style.ERROR(f'❌ 归档失败: {e}'))
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from ai_engine.memory_consolidator import memory_consolidator
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = '整理用户记忆：衰减重要性、合并重复记忆、归档冷门与超出上限的记忆'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=memory_consolidator.BATCH_USERS, help='每批处理的用户数')
+        parser.add_argument('--pause', type=float, default=0.2, help='每个用户之间的间隔秒数（降低对数据库的压力）')
+        parser.add_argument('--loop', action='store_true', help='持续运行：一轮完成后等待 --cycle-interval 秒再开始下一轮')
+        parser.add_argument('--cycle-interval', type=int, default=6 * 3600, help='两轮之间的间隔秒数')
+        parser.add_argument('--user', type=int, help='只整理指定用户ID')
+        parser.add_argument('--dry-run', action='store_true', help='配合 --user 使用：只统计不写入')
+        parser.add_argument('--reset', action='store_true', help='清除检查点，从第一个用户开始')
+
+    def handle(self, *args, **options):
+        try:
+            if options['user']:
+                stats = memory_consolidator.consolidate_user(options['user'], dry_run=options['dry_run'])
+                prefix = '🔍 预览' if options['dry_run'] else '✅ 整理完成'
+                self.stdout.write(self.style.SUCCESS(f"{prefix} 用户 {options['user']}: {self._format(stats)}"))
+                return
+
+            if options['reset']:
+                memory_consolidator.reset_checkpoint()
+            self.stdout.write(self.style.SUCCESS(
+                f'🧹 开始整理记忆（检查点: 用户 {memory_consolidator.get_checkpoint()}）...'
+            ))
+
+            totals, users = {}, 0
+            while True:
+                processed, stats, finished = memory_consolidator.run_batch(options['batch_size'], options['pause'])
+                users += processed
+                for name, count in stats.items():
+                    totals[name] = totals.get(name, 0) + count
+                if processed:
+                    self.stdout.write(f'  已处理 {users} 个用户（检查点: 用户 {memory_consolidator.get_checkpoint()}）')
+                if not finished:
+                    continue
+
+                self.stdout.write(self.style.SUCCESS(f'✅ 本轮整理完成，共 {users} 个用户: {self._format(totals)}'))
+                if not options['loop']:
+                    break
+                totals, users = {}, 0
+                time.sleep(options['cycle_interval'])
+
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('\n⚠️  记忆整理已停止，下次从检查点继续'))
+        except Exception as e:
+            logger.error(f"记忆整理失败: {e}")
+            self.stdout.write(self.style.ERROR(f'❌ 整理失败: {e}'))
+
+    def _format(self, stats):
+        return (f"衰减 {stats.get('decayed', 0)} 条，合并重复 {stats.get('duplicate', 0)} 条，"
+                f"归档冷门 {stats.get('cold', 0)} 条，超出上限 {stats.get('cap', 0)} 条")
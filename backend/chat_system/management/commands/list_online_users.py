@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
+from chat_system.outbound import OutboundQueue
 from chat_system.proactive import proactive_engine
 import logging
 
@@ -35,6 +36,12 @@ class Command(BaseCommand):
                     self.stdout.write(
                         f"👤 {user.username} (ID: {user_id}, 会话: {session_id})"
                     )
+                    # 出站队列指标（由各连接定期写入缓存）
+                    for channel, metrics in OutboundQueue.session_metrics(session_id).items():
+                        self.stdout.write(
+                            f"   📤 出站队列 {channel}: 深度 {metrics['depth']} (峰值 {metrics['max_depth']}), "
+                            f"已发 {metrics['sent']}, 合并 {metrics['coalesced']}, 丢弃 {metrics['dropped']}"
+                        )
                 except User.DoesNotExist:
                     self.stdout.write(
                         f"❌ 用户ID {user_id} 不存在（已从在线列表移除）"
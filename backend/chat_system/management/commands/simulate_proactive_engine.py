@@ -0,0 +1,66 @@
+# Django management commands
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from chat_system.simulation import ProactiveSimulation
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 默认使用隔离的本地内存缓存，避免模拟数据污染线上 Redis
+SIMULATION_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'proactive-simulation',
+    }
+}
+
+
+class Command(BaseCommand):
+    help = '以虚拟时钟模拟主动触发引擎，评估在线用户规模下的每轮开销（模拟数据会回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='模拟在线用户数')
+        parser.add_argument('--ticks', type=int, default=30, help='模拟的周期任务轮数')
+        parser.add_argument('--speak-ratio', type=float, default=0.05, help='每轮发言用户占比')
+        parser.add_argument('--history', type=int, default=5, help='每个会话预置的历史消息数')
+        parser.add_argument('--start-hour', type=int, default=9, help='虚拟时钟起始小时（UTC，避开免打扰时段）')
+        parser.add_argument('--seed', type=int, default=None, help='随机种子')
+        parser.add_argument('--redis', action='store_true', help='使用项目配置的缓存（Redis）而非隔离的内存缓存')
+
+    def handle(self, *args, **options):
+        simulation = ProactiveSimulation(
+            users=options['users'],
+            ticks=options['ticks'],
+            speak_ratio=options['speak_ratio'],
+            history=options['history'],
+            start_hour=options['start_hour'],
+            seed=options['seed'],
+        )
+        self.stdout.write(f"🧪 开始模拟: {options['users']} 个在线用户, {options['ticks']} 轮")
+        try:
+            if options['redis']:
+                report = simulation.run()
+            else:
+                with override_settings(CACHES=SIMULATION_CACHES):
+                    report = simulation.run()
+        except Exception as e:
+            logger.error(f"主动引擎模拟失败: {e}")
+            self.stdout.write(self.style.ERROR(f'❌ 模拟失败: {e}'))
+            return
+
+        self.stdout.write("-" * 50)
+        self.stdout.write(f"⏱️  虚拟时长: {report['virtual_minutes']} 分钟 / {report['ticks']} 轮")
+        self.stdout.write(
+            f"⚙️  每轮耗时: 平均 {report['tick_ms_avg']}ms, P95 {report['tick_ms_p95']}ms, 最大 {report['tick_ms_max']}ms"
+        )
+        self.stdout.write(f"🗄️  每轮数据库查询: {report['db_per_tick']}")
+        self.stdout.write(f"🧠 每轮缓存/Redis 操作: {report['cache_per_tick']}")
+        self.stdout.write(
+            f"📥 活动消费: 平均 {report['consumer_ms_avg']}ms/批, {report['consumer_db_per_batch']} 次查询/批"
+        )
+        self.stdout.write(f"🤖 大模型调用: {report['llm_calls']}")
+        self.stdout.write(f"📤 发送: {report['sends']} 条, {report['sends_per_minute']} 条/虚拟分钟")
+        self.stdout.write(f"🚫 配额命中: {report['quota_hits']}")
+        for reason, count in sorted(report['gate_decisions'].items(), key=lambda item: -item[1]):
+            self.stdout.write(f"   - {reason}: {count}")
+        self.stdout.write(self.style.SUCCESS('✅ 模拟完成，模拟数据已回滚'))
@@ -6,7 +6,10 @@ from django.contrib.auth.models import User
 from django.db.models import Q
 from .models import UserMemory
 from .memory_serializers import UserMemorySerializer
+from .event_calendar import event_calendar
+from .session_cache import session_resolver
 from ai_engine.memory_manager import memory_manager
+from ai_engine.memory_extractor import memory_extractor
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,18 +28,22 @@ class UserMemoryViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """创建记忆时设置用户"""
-        serializer.save(user=self.request.user)
+        memory = serializer.save(user=self.request.user)
+        event_calendar.sync_memory(memory)
         logger.info(f"用户 {self.request.user.username} 创建记忆: {serializer.validated_data.get('key')}")
     
     def perform_update(self, serializer):
         """更新记忆时记录日志"""
         logger.info(f"用户 {self.request.user.username} 更新记忆: {serializer.instance.key}")
-        serializer.save()
+        memory = serializer.save()
+        # 类型或日期可能被修改，重新同步事件日历
+        event_calendar.sync_memory(memory)
     
     def perform_destroy(self, instance):
         """软删除记忆"""
         instance.is_active = False
         instance.save()
+        event_calendar.sync_memory(instance)
         logger.info(f"用户 {self.request.user.username} 删除记忆: {instance.key}")
     
     @action(detail=False, methods=['get'])
@@ -82,6 +89,16 @@ class UserMemoryViewSet(viewsets.ModelViewSet):
             conversation_text = request.data.get('text', '')
             session_id = request.data.get('session_id', '')
             
+            # 属于当前用户的会话：交给后台按水位只提取未处理过的消息，不在请求内调用大模型
+            session = session_resolver.resolve(session_id) if session_id else None
+            if session is not None and session.owner_id == request.user.id:
+                memory_extractor.mark_dirty(session.pk, urgent=True)
+                return Response({
+                    'success': True,
+                    'queued': True,
+                    'session_id': session.session_id
+                }, status=status.HTTP_202_ACCEPTED)
+            
             if not conversation_text:
                 return Response(
                     {'error': '对话文本不能为空'},
@@ -139,11 +156,17 @@ class UserMemoryViewSet(viewsets.ModelViewSet):
         """获取记忆上下文"""
         try:
             max_memories = int(request.query_params.get('max_memories', 10))
-            context = memory_manager.build_memory_context(request.user, max_memories)
+            # 传入当前对话内容时按相关性挑选记忆
+            query = request.query_params.get('query') or None
+            # 记忆上下文的字符预算，不传时使用默认预算
+            budget = int(request.query_params.get('budget', 0)) or None
+            context = memory_manager.build_memory_context(request.user, max_memories, query=query, budget=budget)
             
             return Response({
                 'context': context,
-                'max_memories': max_memories
+                'max_memories': max_memories,
+                'query': query,
+                'budget': budget or memory_manager.CONTEXT_CHAR_BUDGET
             })
             
         except Exception as e:
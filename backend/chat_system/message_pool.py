@@ -0,0 +1,196 @@
+"""
+主动消息预生成池
+按 (触发类型, 时段) 维护一批预先生成的消息模板，发送时只需弹出并做轻量个性化，
+发送路径上不再同步调用大模型；补货放在低峰期由后台引擎完成
+"""
+
+import logging
+from django.core.cache import cache
+from django.utils import timezone
+from ai_engine.prompt_library import get_proactive_prompt
+from .redis_client import get_redis_client, redis_key
+from .proactive_gate import proactive_gate
+
+logger = logging.getLogger(__name__)
+
+
+class ProactiveMessagePool:
+    """主动消息池"""
+
+    TRIGGER_TYPES = ('greeting', 'share', 'care', 'reminder')
+    # 时段 -> 生成时使用的问候语（与 ProactiveEngine.get_time_greeting 保持一致）
+    TIME_SLOTS = {
+        'morning': '早上好',
+        'afternoon': '下午好',
+        'evening': '晚上好',
+        'night': '夜深了',
+    }
+    TARGET_SIZE = 20  # 每个池的目标容量
+    LOW_WATERMARK = 8  # 低于该数量才补货
+    MAX_GENERATE_PER_REFILL = 6  # 单次补货最多调用大模型的次数，避免集中打满上游
+    LOW_TRAFFIC_ONLINE_USERS = 50  # 在线人数不超过该值视为低峰
+    POOL_TTL = 24 * 3600
+
+    NAME_PLACEHOLDER = '【称呼】'
+    MEMORY_PLACEHOLDER = '【记忆】'
+
+    def _pool_key(self, trigger_type, slot):
+        return f"proactive_pool:{trigger_type}:{slot}"
+
+    def time_slot(self, now=None):
+        """根据时间返回时段标识"""
+        hour = (now or timezone.now()).hour
+        if 5 <= hour < 12:
+            return 'morning'
+        elif 12 <= hour < 18:
+            return 'afternoon'
+        elif 18 <= hour < 22:
+            return 'evening'
+        return 'night'
+
+    def next_time_slot(self, now=None):
+        """返回下一个时段标识，用于提前备货"""
+        slots = list(self.TIME_SLOTS.keys())
+        idx = slots.index(self.time_slot(now))
+        return slots[(idx + 1) % len(slots)]
+
+    # -------------------- 存取 --------------------
+    def size(self, trigger_type, slot):
+        """当前池内消息数量"""
+        key = self._pool_key(trigger_type, slot)
+        client = get_redis_client()
+        if client is not None:
+            return client.llen(redis_key(key))
+        return len(cache.get(key) or [])
+
+    def push(self, trigger_type, slot, messages):
+        """放入一批消息，超出目标容量的旧消息被裁掉"""
+        messages = [m for m in messages if m]
+        if not messages:
+            return 0
+        key = self._pool_key(trigger_type, slot)
+        client = get_redis_client()
+        if client is not None:
+            full_key = redis_key(key)
+            pipe = client.pipeline()
+            pipe.lpush(full_key, *[m.encode('utf-8') for m in messages])
+            pipe.ltrim(full_key, 0, self.TARGET_SIZE - 1)
+            pipe.expire(full_key, self.POOL_TTL)
+            pipe.execute()
+        else:
+            pool = (messages + (cache.get(key) or []))[:self.TARGET_SIZE]
+            cache.set(key, pool, timeout=self.POOL_TTL)
+        return len(messages)
+
+    def pop(self, trigger_type, slot):
+        """弹出一条最早放入的消息；池为空返回 None"""
+        key = self._pool_key(trigger_type, slot)
+        client = get_redis_client()
+        if client is not None:
+            raw = client.rpop(redis_key(key))
+            return raw.decode('utf-8') if raw else None
+        pool = cache.get(key) or []
+        if not pool:
+            return None
+        message = pool.pop()
+        cache.set(key, pool, timeout=self.POOL_TTL)
+        return message
+
+    # -------------------- 发送侧 --------------------
+    def personalize(self, text, user_name=None, memory_hint=None):
+        """轻量个性化：填充称呼与记忆占位符"""
+        text = text.replace(self.NAME_PLACEHOLDER, user_name or '')
+        text = text.replace(self.MEMORY_PLACEHOLDER, memory_hint or '最近的事')
+        # 无称呼时去掉残留在句首的标点
+        return text.strip().lstrip('，,、 ')
+
+    def get_memory_hint(self, user):
+        """取一条适合在主动消息里提起的用户记忆"""
+        if user is None:
+            return None
+        try:
+            from ai_engine.memory_manager import memory_manager
+            memories = memory_manager.get_user_memories(user, limit=5)
+            candidates = [m for m in memories if m.memory_type in ('preference', 'relationship', 'event')]
+            if candidates:
+                return candidates[0].value[:20]
+        except Exception as e:
+            logger.error(f"获取记忆提示失败: {e}")
+        return None
+
+    def get_message(self, trigger_type, user=None, default_message=None, now=None):
+        """从池中取一条消息并个性化；池为空时退回默认消息，不做同步生成"""
+        slot = self.time_slot(now)
+        text = None
+        try:
+            text = self.pop(trigger_type, slot)
+        except Exception as e:
+            logger.error(f"主动消息池读取失败: {e}")
+        if not text:
+            logger.info(f"主动消息池为空: {trigger_type}/{slot}，使用默认消息")
+            text = default_message or ''
+        user_name = getattr(user, 'username', None)
+        # 只有模板里有记忆占位符时才查询记忆
+        memory_hint = self.get_memory_hint(user) if self.MEMORY_PLACEHOLDER in text else None
+        return self.personalize(text, user_name, memory_hint)
+
+    # -------------------- 补货侧 --------------------
+    def _build_prompt(self, trigger_type, slot):
+        prompt = get_proactive_prompt(trigger_type, {
+            'user_name': self.NAME_PLACEHOLDER,
+            'time_of_day': self.TIME_SLOTS[slot],
+        })
+        return prompt + (
+            f"\n\n补充要求：需要称呼对方时直接写“{self.NAME_PLACEHOLDER}”；"
+            f"如果想提到对方之前分享过的事情，用“{self.MEMORY_PLACEHOLDER}”代替具体内容；"
+            "不要出现其他占位符。"
+        )
+
+    def generate_template(self, trigger_type, slot):
+        """调用大模型生成一条带占位符的消息模板"""
+        from ai_engine.tencent_client import TencentDeepSeekClient
+        client = TencentDeepSeekClient()
+        result = client.chat([{"Role": "user", "Content": self._build_prompt(trigger_type, slot)}])
+        return (result.get('text') or '').strip() if result.get('success') else ''
+
+    def is_low_traffic(self, online_count, now=None):
+        """低峰判断：在线人数少，或处于不主动触发的安静时段"""
+        return online_count <= self.LOW_TRAFFIC_ONLINE_USERS or proactive_gate.is_quiet_hours(now)
+
+    def refill(self, online_count=0, now=None, budget=None):
+        """低峰期为当前与下一时段补货，返回本次生成的消息数"""
+        if not self.is_low_traffic(online_count, now):
+            return 0
+        budget = self.MAX_GENERATE_PER_REFILL if budget is None else budget
+        generated = 0
+        slots = [self.time_slot(now), self.next_time_slot(now)]
+        # 按缺口从大到小补，优先保证最空的池
+        shortages = []
+        for slot in slots:
+            for trigger_type in self.TRIGGER_TYPES:
+                try:
+                    size = self.size(trigger_type, slot)
+                except Exception as e:
+                    logger.error(f"主动消息池容量读取失败: {e}")
+                    continue
+                if size < self.LOW_WATERMARK:
+                    shortages.append((size, trigger_type, slot))
+        shortages.sort()
+        for _, trigger_type, slot in shortages:
+            if generated >= budget:
+                break
+            try:
+                text = self.generate_template(trigger_type, slot)
+            except Exception as e:
+                logger.error(f"主动消息模板生成失败: {e}")
+                continue
+            if text:
+                self.push(trigger_type, slot, [text])
+                generated += 1
+        if generated:
+            logger.info(f"主动消息池补货 {generated} 条")
+        return generated
+
+
+# 全局实例
+message_pool = ProactiveMessagePool()
@@ -0,0 +1,78 @@
+"""
+用户消息入库服务
+REST（MessageViewSet.create）与 WebSocket 上行共用同一套语义：
+client_msg_id 幂等去重、活动流记录、发言时间戳、清除“等待用户回应”、去抖动调度AI回复
+"""
+
+import logging
+from django.core.cache import cache
+from django.utils import timezone
+from .models import Message
+from .proactive import proactive_engine
+from .session_events import session_events
+from ai_engine.memory_extractor import memory_extractor
+
+logger = logging.getLogger(__name__)
+user_logger = logging.getLogger('user_messages')
+
+
+class MessageService:
+    """用户消息入库服务"""
+
+    DEBOUNCE_PENDING_TTL = 6
+
+    def ingest_user_message(self, user_id, session_pk, content, content_type='text', client_msg_id=None):
+        """保存一条用户消息，返回 (消息, 是否新建)；client_msg_id 重复时返回已有消息"""
+        # 幂等去重：若存在相同 client_msg_id 的用户消息则直接返回，避免重复入库与重复AI回复
+        if client_msg_id:
+            existed = Message.objects.filter(
+                session_id=session_pk,
+                sender='user',
+                metadata__client_msg_id=client_msg_id
+            ).order_by('-timestamp').first()
+            if existed:
+                return existed, False
+
+        # 记录用户消息到日志
+        user_logger.info(f"用户消息 | 会话ID: {session_pk} | 用户ID: {user_id} | 内容类型: {content_type} | 内容: {content}")
+
+        user_msg = Message.objects.create(
+            session_id=session_pk,
+            content=content,
+            content_type=content_type,
+            sender='user',
+            metadata={'client_msg_id': client_msg_id} if client_msg_id else {}
+        )
+        # 用户消息也写入会话事件流，保证序号连续（发送端已本地展示，不再广播）
+        session_events.record(user_msg)
+        # 记入活动流（一次追加），后台消费者据此更新情绪状态
+        if content_type == 'text' and content:
+            proactive_engine.process_user_activity(user_id, 'message', content)
+            # 标记会话有待提取的新消息，记忆由后台按水位增量提取
+            memory_extractor.mark_dirty(session_pk)
+
+        now_ts = timezone.now().timestamp()
+        # 用户级时间戳存整数秒，主动闸门的Redis脚本可直接读取
+        cache.set(f"last_user_message_at:{user_id}", int(now_ts), timeout=3600)
+        cache.set(f"last_user_message_at_session:{session_pk}", now_ts, timeout=3600)
+        # 用户发言，清除“等待用户回应”标志，允许AI继续本回合
+        cache.delete(f"await_user_reply:{session_pk}")
+        return user_msg, True
+
+    def schedule_reply(self, session_pk, user_id):
+        """去抖动聚合：用户可能连续发送多句，已有待生成的回复时不重复调度；返回是否新调度"""
+        pending_key = f"debounce_pending:{session_pk}"
+        if cache.get(pending_key):
+            return False
+        # 标记去抖动中并启动后台聚合生成
+        cache.set(pending_key, 1, timeout=self.DEBOUNCE_PENDING_TTL)
+        try:
+            from .views import MessageViewSet
+            MessageViewSet()._schedule_debounced_reply(session_pk, user_id)
+        except Exception as e:
+            logger.error(f"调度AI回复失败: {e}")
+        return True
+
+
+# 全局实例
+message_service = MessageService()
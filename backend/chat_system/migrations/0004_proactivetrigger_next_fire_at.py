@@ -0,0 +1,42 @@
+# Generated by Django 5.0.2 on 2026-10-19 03:13
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_next_fire_at(apps, schema_editor):
+    ProactiveTrigger = apps.get_model("chat_system", "ProactiveTrigger")
+    now = timezone.now()
+    rows = list(ProactiveTrigger.objects.all())
+    for row in rows:
+        if row.last_triggered:
+            row.next_fire_at = row.last_triggered + timedelta(hours=row.frequency_hours)
+        else:
+            row.next_fire_at = now
+    ProactiveTrigger.objects.bulk_update(rows, ["next_fire_at"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_system", "0003_message_emotion_score_message_is_proactive_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="proactivetrigger",
+            name="next_fire_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="proactivetrigger",
+            index=models.Index(
+                fields=["is_enabled", "next_fire_at"], name="proactive_due_idx"
+            ),
+        ),
+        migrations.RunPython(fill_next_fire_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.0.2 on 2026-10-19 03:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_system", "0005_useremotionstate"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MemoryEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("title", models.CharField(max_length=100)),
+                ("event_date", models.DateField()),
+                (
+                    "recurrence",
+                    models.CharField(
+                        choices=[("once", "单次"), ("yearly", "每年")],
+                        default="yearly",
+                        max_length=10,
+                    ),
+                ),
+                ("next_occurrence", models.DateField(blank=True, null=True)),
+                ("last_reminded", models.DateField(blank=True, null=True)),
+                ("is_active", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "memory",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="calendar_event",
+                        to="chat_system.usermemory",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="memory_events",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["next_occurrence"],
+                "indexes": [
+                    models.Index(
+                        fields=["is_active", "next_occurrence"],
+                        name="memory_event_due_idx",
+                    )
+                ],
+            },
+        ),
+    ]
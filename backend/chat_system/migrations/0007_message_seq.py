@@ -0,0 +1,43 @@
+# Generated by Django 5.0.2 on 2026-10-19 03:24
+
+from django.db import migrations, models
+
+
+def backfill_seq(apps, schema_editor):
+    ChatSession = apps.get_model("chat_system", "ChatSession")
+    Message = apps.get_model("chat_system", "Message")
+    for session in ChatSession.objects.all().iterator():
+        rows = list(
+            Message.objects.filter(session_id=session.pk).order_by("timestamp", "id")
+        )
+        for seq, row in enumerate(rows, start=1):
+            row.seq = seq
+        Message.objects.bulk_update(rows, ["seq"], batch_size=500)
+        ChatSession.objects.filter(pk=session.pk).update(last_seq=len(rows))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_system", "0006_memoryevent"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatsession",
+            name="last_seq",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="seq",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["session", "seq"], name="message_session_seq_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-19 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_system", "0007_message_seq"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usermemory",
+            name="embedding",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
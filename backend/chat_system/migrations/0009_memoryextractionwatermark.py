@@ -0,0 +1,38 @@
+# Generated by Django 5.0.2 on 2026-10-19 03:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_system", "0008_usermemory_embedding"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MemoryExtractionWatermark",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_message_id", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "session",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="memory_watermark",
+                        to="chat_system.chatsession",
+                    ),
+                ),
+            ],
+        ),
+    ]
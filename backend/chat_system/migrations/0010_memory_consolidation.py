@@ -0,0 +1,84 @@
+# Generated by Django 5.0.2 on 2026-10-19 03:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_system", "0009_memoryextractionwatermark"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="usermemory",
+            name="decayed_at",
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name="ArchivedMemory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "memory_type",
+                    models.CharField(
+                        choices=[
+                            ("personal", "个人信息"),
+                            ("preference", "偏好"),
+                            ("relationship", "人际关系"),
+                            ("event", "重要事件"),
+                            ("emotion", "情绪状态"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("key", models.CharField(max_length=100)),
+                ("value", models.TextField()),
+                ("context", models.TextField(blank=True)),
+                ("importance_score", models.FloatField(default=0.0)),
+                ("last_accessed", models.DateTimeField()),
+                ("created_at", models.DateTimeField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "reason",
+                    models.CharField(
+                        choices=[
+                            ("cold", "长期未访问"),
+                            ("duplicate", "重复合并"),
+                            ("cap", "超出上限"),
+                            ("inactive", "已删除"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("merged_into", models.CharField(blank=True, max_length=100)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_memories",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-archived_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["user", "key"], name="archived_memory_user_key_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-19 03:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat_system", "0010_memory_consolidation"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="conversationhistory",
+            index=models.Index(
+                fields=["user", "timestamp"], name="conversation_user_ts_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="useractivity",
+            index=models.Index(
+                fields=["user", "timestamp"], name="user_activity_user_ts_idx"
+            ),
+        ),
+    ]
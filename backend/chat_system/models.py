@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.core.cache import cache
+from datetime import timedelta
 import json
 
 
@@ -10,6 +12,7 @@ class ChatSession(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    last_seq = models.PositiveIntegerField(default=0)  # 会话内最后一条消息的序号
 
     class Meta:
         ordering = ['-updated_at']
@@ -17,6 +20,19 @@ class ChatSession(models.Model):
     def __str__(self):
         return f"{self.user.username}-{self.session_id}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # 停用或改动会话时让会话解析缓存失效
+        from .session_cache import session_resolver
+        session_resolver.invalidate(self.pk, self.session_id)
+
+    def delete(self, *args, **kwargs):
+        pk, session_id = self.pk, self.session_id
+        result = super().delete(*args, **kwargs)
+        from .session_cache import session_resolver
+        session_resolver.invalidate(pk, session_id)
+        return result
+
 
 class Message(models.Model):
     CONTENT_TYPES = [
@@ -37,9 +53,13 @@ class Message(models.Model):
     is_proactive = models.BooleanField(default=False)  # 是否为主动触发消息
     emotion_score = models.FloatField(null=True, blank=True)  # 情绪分析得分
     metadata = models.JSONField(default=dict, blank=True)  # 额外元数据
+    seq = models.PositiveIntegerField(default=0)  # 会话内单调递增的序号，用于断线续传
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['session', 'seq'], name='message_session_seq_idx'),
+        ]
 
     def __str__(self):
         try:
@@ -48,6 +68,19 @@ class Message(models.Model):
             sid = 'unknown'
         return f"{sid}-{self.sender}-{self.content_type}"
 
+    def save(self, *args, **kwargs):
+        # 新消息在同一事务里原子地占用会话序号，同时刷新会话更新时间
+        if self._state.adding and not self.seq:
+            with transaction.atomic():
+                ChatSession.objects.filter(pk=self.session_id).update(
+                    last_seq=models.F('last_seq') + 1,
+                    updated_at=timezone.now(),
+                )
+                self.seq = ChatSession.objects.filter(pk=self.session_id).values_list('last_seq', flat=True).first() or 0
+                super().save(*args, **kwargs)
+            return
+        super().save(*args, **kwargs)
+
 
 class UserActivity(models.Model):
     """用户活动记录 - 用于主动触发分析"""
@@ -67,11 +100,27 @@ class UserActivity(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='user_activity_user_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}-{self.activity_type}"
 
 
+class UserEmotionState(models.Model):
+    """用户滚动情绪状态快照 - Redis 中实时状态的定期落库"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='emotion_state')
+    valence = models.FloatField(default=0.0)  # 情绪效价的指数加权平均，-1(消极) ~ 1(积极)
+    intensity = models.FloatField(default=0.0)  # 情绪强度的指数加权平均，0 ~ 1
+    last_emotion = models.CharField(max_length=50, blank=True)  # 最近一次的具体情绪
+    message_count = models.IntegerField(default=0)  # 已计入的用户消息数
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username}-{self.valence:.2f}/{self.intensity:.2f}"
+
+
 class UserMemory(models.Model):
     """用户记忆库 - 存储AI对用户的了解"""
     MEMORY_TYPES = [
@@ -91,6 +140,8 @@ class UserMemory(models.Model):
     last_accessed = models.DateTimeField(auto_now=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
+    embedding = models.BinaryField(null=True, blank=True, editable=False)  # key+value 的哈希嵌入（float16）
+    decayed_at = models.DateTimeField(null=True, blank=True, editable=False)  # 整理任务最近一次衰减重要性的时间
 
     class Meta:
         unique_together = ['user', 'key']
@@ -99,6 +150,96 @@ class UserMemory(models.Model):
     def __str__(self):
         return f"{self.user.username}-{self.key}: {self.value}"
 
+    def save(self, *args, **kwargs):
+        from ai_engine.memory_vectors import memory_vectors
+        memory_vectors.embed_memory(self)
+        super().save(*args, **kwargs)
+        # 新增、修改与软删除都同步记忆检索索引并递增用户记忆版本；
+        # 提交后再递增，避免读方在事务提交前按新版本缓存旧数据
+        from ai_engine.memory_index import memory_index
+        transaction.on_commit(lambda: memory_index.on_memory_saved(self))
+
+    def delete(self, *args, **kwargs):
+        user_id, pk = self.user_id, self.pk
+        result = super().delete(*args, **kwargs)
+        from ai_engine.memory_index import memory_index
+        transaction.on_commit(lambda: memory_index.on_memory_removed(user_id, pk))
+        return result
+
+
+class ArchivedMemory(models.Model):
+    """归档记忆 - 整理任务移出热表的冷门、重复与超出上限的记忆"""
+    REASONS = [
+        ('cold', '长期未访问'),
+        ('duplicate', '重复合并'),
+        ('cap', '超出上限'),
+        ('inactive', '已删除'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_memories')
+    memory_type = models.CharField(max_length=20, choices=UserMemory.MEMORY_TYPES)
+    key = models.CharField(max_length=100)
+    value = models.TextField()
+    context = models.TextField(blank=True)
+    importance_score = models.FloatField(default=0.0)
+    last_accessed = models.DateTimeField()
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    reason = models.CharField(max_length=20, choices=REASONS)
+    merged_into = models.CharField(max_length=100, blank=True)  # 重复合并时保留的记忆键
+
+    class Meta:
+        ordering = ['-archived_at']
+        indexes = [
+            models.Index(fields=['user', 'key'], name='archived_memory_user_key_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}-{self.key}({self.reason})"
+
+
+class MemoryEvent(models.Model):
+    """记忆事件日历 - 从带日期的事件记忆中归一化出的提醒日期"""
+    RECURRENCE_CHOICES = [
+        ('once', '单次'),
+        ('yearly', '每年'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='memory_events')
+    memory = models.OneToOneField(UserMemory, on_delete=models.CASCADE, related_name='calendar_event')
+    title = models.CharField(max_length=100)
+    event_date = models.DateField()  # 首次/原始日期（年份未知时取首次出现的年份，2月29日取闰年）
+    recurrence = models.CharField(max_length=10, choices=RECURRENCE_CHOICES, default='yearly')
+    next_occurrence = models.DateField(null=True, blank=True)  # 下次发生日期，每日任务按此范围扫描
+    last_reminded = models.DateField(null=True, blank=True)
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['next_occurrence']
+        indexes = [
+            models.Index(fields=['is_active', 'next_occurrence'], name='memory_event_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}-{self.title}-{self.next_occurrence}"
+
+    def compute_next_occurrence(self, today=None):
+        """计算今天及之后的下一次发生日期；单次事件已过期时返回 None"""
+        today = today or timezone.localdate()
+        if self.recurrence == 'once':
+            return self.event_date if self.event_date >= today else None
+        for year in (today.year, today.year + 1):
+            # 2月29日的每年事件在平年落到2月28日
+            day = self.event_date.day
+            if self.event_date.month == 2 and day == 29 and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+                day = 28
+            candidate = self.event_date.replace(year=year, day=day)
+            if candidate >= today:
+                return candidate
+        return None
+
 
 class ProactiveTrigger(models.Model):
     """主动触发规则配置"""
@@ -114,15 +255,36 @@ class ProactiveTrigger(models.Model):
     is_enabled = models.BooleanField(default=True)
     frequency_hours = models.IntegerField(default=6)  # 触发频率（小时）
     last_triggered = models.DateTimeField(null=True, blank=True)
+    next_fire_at = models.DateTimeField(null=True, blank=True)  # 下次可触发时间，周期任务按此范围扫描
     conditions = models.JSONField(default=dict, blank=True)  # 触发条件
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ['user', 'trigger_type']
+        indexes = [
+            models.Index(fields=['is_enabled', 'next_fire_at'], name='proactive_due_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}-{self.trigger_type}"
 
+    @staticmethod
+    def rules_cache_key(user_id):
+        """用户规则快照的缓存键"""
+        return f"proactive_rules:{user_id}"
+
+    def compute_next_fire_at(self, now=None):
+        """根据上次触发时间与频率计算下次可触发时间"""
+        if not self.last_triggered:
+            return now or timezone.now()
+        return self.last_triggered + timedelta(hours=self.frequency_hours)
+
+    def save(self, *args, **kwargs):
+        # 频率或触发时间可能被运维修改，保存时重算下次触发时间并让规则快照失效
+        self.next_fire_at = self.compute_next_fire_at()
+        super().save(*args, **kwargs)
+        cache.delete(self.rules_cache_key(self.user_id))
+
 
 class ConversationHistory(models.Model):
     """对话历史 - 用于上下文理解"""
@@ -136,8 +298,19 @@ class ConversationHistory(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['user', 'timestamp'], name='conversation_user_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}-{self.sender}-{self.timestamp}"
 
 
+class MemoryExtractionWatermark(models.Model):
+    """记忆提取水位 - 会话中已提取过记忆的最后一条消息"""
+    session = models.OneToOneField(ChatSession, on_delete=models.CASCADE, related_name='memory_watermark')
+    last_message_id = models.BigIntegerField(default=0)  # 已处理的最后一条消息ID
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.session_id}-{self.last_message_id}"
@@ -0,0 +1,156 @@
+"""
+WebSocket 连接级出站队列
+组消息到达后只入队不直接写套接字，由每个连接独立的写出任务逐帧发送：
+- 队列有界：不读数据的客户端（如切到后台的手机页面）不会让 channel layer 队列无限增长
+- 可合并帧（如打字状态）在队列中只保留最新一条
+- 队列满或单帧写出超时时按策略丢弃或以 4008 关闭连接，客户端重连后按 seq 补发
+- 队列深度等指标按连接定期写入缓存（异步写，不阻塞事件循环），便于排查慢客户端
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from django.conf import settings
+from django.core.cache import cache
+from .redis_client import get_redis_client, redis_key
+
+logger = logging.getLogger(__name__)
+
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+class OutboundQueue:
+    """单个连接的有界出站队列与写出任务；指标按连接写入缓存"""
+
+    MAX_DEPTH = getattr(settings, 'WS_OUTBOUND_MAX_DEPTH', 256)  # 需大于单次补发上限
+    OVERFLOW_POLICY = getattr(settings, 'WS_OUTBOUND_POLICY', 'close')  # close: 关闭慢连接; drop: 丢弃新帧
+    SEND_TIMEOUT = 10  # 单帧写出超时（秒），超时视为慢客户端
+    METRICS_INTERVAL = 5  # 指标写入缓存的最小间隔（秒）
+    METRICS_TTL = 60
+
+    def __init__(self, send, close, name, channel=''):
+        self._send = send  # 协程函数，接收一个待发送的帧
+        self._close = close  # 协程函数，接收关闭码
+        self.name = name
+        self.channel = channel  # channel layer 通道名：同一会话可能有多个连接
+        self._frames = deque()  # 元素为 [合并键, 帧]
+        self._pending = {}  # 合并键 -> 队列中的元素
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.closed = False
+        self.stats = {'sent': 0, 'coalesced': 0, 'dropped': 0, 'max_depth': 0}
+        self._metrics_at = 0
+
+    @staticmethod
+    def metrics_key(name, channel=''):
+        return f"ws_outbound:{name}:{channel}"
+
+    @classmethod
+    def session_metrics(cls, name):
+        """读取一个会话下所有连接的指标，返回 {通道名: 指标}；需要 Redis 缓存后端"""
+        client = get_redis_client(write=False)
+        if client is None:
+            return {}
+        prefix = cls.metrics_key(name)
+        # 原生键名带有缓存前缀与版本，去掉后才能交给 cache.get_many
+        raw_prefix = redis_key(prefix)
+        keys = [
+            prefix + (key.decode('utf-8') if isinstance(key, bytes) else key)[len(raw_prefix):]
+            for key in client.scan_iter(match=f"{raw_prefix}*", count=100)
+        ]
+        return {key[len(prefix):]: metrics for key, metrics in cache.get_many(keys).items()}
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        self.closed = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await cache.adelete(self.metrics_key(self.name, self.channel))
+        except Exception as e:
+            logger.error(f"删除出站队列指标失败: {e}")
+
+    @property
+    def depth(self):
+        return len(self._frames)
+
+    def put(self, frame, coalesce_key=None):
+        """入队一帧（不阻塞）；返回 False 表示队列已满、连接将被关闭"""
+        if self.closed:
+            return True
+        if coalesce_key is not None:
+            entry = self._pending.get(coalesce_key)
+            if entry is not None:
+                # 尚未写出的同类帧直接替换为最新状态，保持原有位置
+                entry[1] = frame
+                self.stats['coalesced'] += 1
+                return True
+        if len(self._frames) >= self.MAX_DEPTH:
+            self.stats['dropped'] += 1
+            # 可合并帧是瞬时状态，丢弃无损；带序号的消息可由客户端重连补发
+            if coalesce_key is not None or self.OVERFLOW_POLICY == 'drop':
+                return True
+            logger.warning(f"出站队列已满，关闭慢连接: {self.name} depth={len(self._frames)}")
+            self._evict()
+            return False
+        entry = [coalesce_key, frame]
+        self._frames.append(entry)
+        if coalesce_key is not None:
+            self._pending[coalesce_key] = entry
+        self.stats['max_depth'] = max(self.stats['max_depth'], len(self._frames))
+        self._wakeup.set()
+        return True
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                if not self._frames:
+                    # 先清除唤醒标志再异步写指标：写指标期间入队的帧会重新置位，不会错过
+                    self._wakeup.clear()
+                    await self._publish_metrics()
+                    await self._wakeup.wait()
+                    continue
+                coalesce_key, frame = self._frames.popleft()
+                if coalesce_key is not None:
+                    self._pending.pop(coalesce_key, None)
+                try:
+                    await asyncio.wait_for(self._send(frame), self.SEND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning(f"出站帧写出超时，关闭慢连接: {self.name}")
+                    self._evict()
+                    return
+                self.stats['sent'] += 1
+                await self._publish_metrics()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"出站队列写出失败 {self.name}: {e}")
+
+    def _evict(self):
+        """停止写出并以 4008 关闭连接"""
+        self.closed = True
+        self._frames.clear()
+        self._pending.clear()
+        asyncio.ensure_future(self._publish_metrics(force=True))
+        asyncio.ensure_future(self._close(SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _publish_metrics(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._metrics_at < self.METRICS_INTERVAL:
+            return
+        self._metrics_at = now
+        try:
+            await cache.aset(
+                self.metrics_key(self.name, self.channel),
+                dict(self.stats, depth=len(self._frames)),
+                timeout=self.METRICS_TTL,
+            )
+        except Exception as e:
+            logger.error(f"写入出站队列指标失败: {e}")
@@ -0,0 +1,85 @@
+"""
+在线活动时间戳缓冲
+WebSocket 的 activity 心跳只写入进程内字典，由后台线程每隔几秒用一次 set_many（Redis 管道）批量落盘；
+同一用户在一个周期内的多次心跳只保留最新值。读取时优先查本进程缓冲，保证与直写时相同的新鲜度；
+主动消息闸门读取该时间戳，用户正在输入或刚回到页面时不打断
+"""
+
+import atexit
+import logging
+import threading
+import time
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceBuffer:
+    """活动时间戳的进程内缓冲与批量刷新"""
+
+    FLUSH_INTERVAL = 3  # 刷新周期（秒），跨进程读取的最大延迟
+    KEY_TTL = 3600
+
+    def __init__(self):
+        self._pending = {}  # 缓存键 -> 最新值
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {'marks': 0, 'flushes': 0, 'keys_written': 0}
+
+    @staticmethod
+    def activity_key(user_id):
+        return f"last_activity_at:{user_id}"
+
+    def mark_activity(self, user_id, ts=None):
+        """记录用户活动心跳（不访问Redis）；时间戳取服务端秒数，与 last_user_message_at 口径一致"""
+        ts = int(time.time()) if ts is None else ts
+        with self._lock:
+            self._pending[self.activity_key(user_id)] = ts
+            self.stats['marks'] += 1
+        self._ensure_started()
+
+    def get_last_activity(self, user_id):
+        """读取最近活动时间：本进程尚未刷新的值优先，其次读缓存"""
+        key = self.activity_key(user_id)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+        return cache.get(key)
+
+    def flush(self):
+        """把缓冲中的时间戳一次性写入缓存，返回写入的键数"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+        try:
+            cache.set_many(batch, timeout=self.KEY_TTL)
+        except Exception as e:
+            logger.error(f"刷新活动时间戳失败: {e}")
+            # 写失败时放回缓冲，下个周期重试（不覆盖期间的新值）
+            with self._lock:
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+            return 0
+        self.stats['flushes'] += 1
+        self.stats['keys_written'] += len(batch)
+        return len(batch)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='presence-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while not self._stop.wait(self.FLUSH_INTERVAL):
+            self.flush()
+
+
+# 全局实例
+presence_buffer = PresenceBuffer()
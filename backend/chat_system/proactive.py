@@ -8,51 +8,48 @@ from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from ai_engine.tencent_client import TencentDeepSeekClient
 from ai_engine.prompt_library import get_proactive_prompt
-from ai_engine.emotion_analyzer import emotion_analyzer
+from ai_engine.memory_consolidator import memory_consolidator
 import time
 from django.core.cache import cache
+from .message_pool import message_pool
+from .proactive_gate import proactive_gate, SKIP_REASONS
+from .trigger_rules import trigger_rule_store
+from .activity_stream import activity_stream
+from .emotion_state import emotion_state
+from .event_calendar import event_calendar
+from .session_cache import session_resolver
+from .session_events import session_events
 
 logger = logging.getLogger(__name__)
 
 class ProactiveEngine:
     """主动触发引擎 - Mira的核心创新功能"""
+
+    TICK_INTERVAL = (60, 120)  # 周期任务间隔范围（秒）
     
     def __init__(self):
         self.channel_layer = get_channel_layer()
         self.connected_users = set()  # 存储在线用户ID
         self.user_sessions = {}  # 存储用户会话信息
-        self.last_connect_greet_at = {}  # 记录连接后问候的时间
+        self.consolidation_due = False  # 每日任务开启一轮记忆整理，之后每个周期任务整理一批用户
+        activity_stream.window_listener = self.handle_activity_window
         
     def should_trigger_greeting(self, user_id, last_interaction):
         """判断是否应该发送问候"""
         if not last_interaction:
             return True
             
-        # 如果超过12小时没有互动，发送问候
+        # 超过规则频率（默认12小时）没有互动，发送问候
+        hours = trigger_rule_store.frequency_hours(trigger_rule_store.get_snapshot(user_id), 'greeting')
         time_diff = timezone.now() - last_interaction
-        return time_diff > timedelta(hours=12)
+        return time_diff > timedelta(hours=hours)
     
-    def should_trigger_care(self, user_id, recent_messages):
-        """基于最近对话内容判断是否需要关怀"""
-        if not recent_messages:
-            return False
-            
-        # 获取最近5条用户消息
-        recent_user_messages = [msg for msg in recent_messages[-5:] if msg.get('sender') == 'user']
-        if not recent_user_messages:
-            return False
-        
-        # 合并最近消息文本
-        recent_text = ' '.join([msg.get('content', '') for msg in recent_user_messages])
-        
-        # 使用情绪分析器分析
-        emotion_analysis = emotion_analyzer.analyze_text_emotion(recent_text)
-        
-        # 判断是否需要关怀
-        should_care = emotion_analyzer.should_trigger_care(emotion_analysis)
-        
-        logger.info(f"用户 {user_id} 情绪分析: {emotion_analysis['primary_emotion']}, 需要关怀: {should_care}")
-        
+    def should_trigger_care(self, user_id):
+        """基于用户滚动情绪状态判断是否需要关怀（一次缓存查找，不再重复分析历史消息）"""
+        state = emotion_state.get(user_id)
+        should_care = emotion_state.should_care(state)
+        if state:
+            logger.info(f"用户 {user_id} 情绪状态: 效价={state['v']:.2f}, 强度={state['i']:.2f}, 最近情绪={state.get('e')}, 需要关怀: {should_care}")
         return should_care
     
     def should_trigger_share(self, user_id, last_share):
@@ -60,9 +57,10 @@ class ProactiveEngine:
         if not last_share:
             return True
             
-        # 如果超过6小时没有主动分享，发起话题
+        # 超过规则频率（默认6小时）没有主动分享，发起话题
+        hours = trigger_rule_store.frequency_hours(trigger_rule_store.get_snapshot(user_id), 'share')
         time_diff = timezone.now() - last_share
-        return time_diff > timedelta(hours=6)
+        return time_diff > timedelta(hours=hours)
     
     def generate_proactive_message(self, trigger_type, user_context=None):
         """生成主动消息"""
@@ -93,6 +91,22 @@ class ProactiveEngine:
             'reminder': "我们好像好久没聊天了，想你了！最近有什么新鲜事吗？"
         }
         return default_messages.get(trigger_type, "嗨！想和你聊聊天～")
+
+    def get_pooled_message(self, trigger_type, user=None):
+        """从预生成消息池取一条个性化消息（发送路径不调用大模型）"""
+        return message_pool.get_message(
+            trigger_type,
+            user=user,
+            default_message=self.get_default_message(trigger_type)
+        )
+
+    def refill_message_pool(self):
+        """低峰期补充预生成消息池"""
+        try:
+            return message_pool.refill(online_count=len(self.connected_users))
+        except Exception as e:
+            logger.error(f"主动消息池补货失败: {e}")
+            return 0
     
     def add_connected_user(self, user_id, session_id=None):
         """添加在线用户"""
@@ -115,81 +129,59 @@ class ProactiveEngine:
         """获取所有在线用户"""
         return list(self.connected_users)
     
-    def send_proactive_message(self, user_id, message, message_type="proactive"):
-        """发送主动消息到指定用户"""
+    def send_proactive_message(self, user_id, message, message_type="proactive", quota_limit=None):
+        """发送主动消息到指定用户；quota_limit 为空时从用户规则快照读取每日配额"""
         try:
-            # 安静时段（22:30-07:30）默认不主动触发
-            hour = timezone.now().hour
-            if hour >= 22 or hour < 7:
-                logger.info("安静时段，跳过主动触发")
-                return False
-
-            # 每日配额：每用户每日最多 6 条主动消息
-            quota_key = f"proactive_quota:{user_id}:{timezone.now().date().isoformat()}"
-            quota = cache.get(quota_key, 0)
-            if quota >= 6:
-                logger.info("主动消息达到今日配额，跳过")
-                return False
-
-            # 在用户主动发言后60秒内暂停主动触发
-            last_ts = cache.get(f"last_user_message_at:{user_id}")
-            if last_ts:
-                delta = timezone.now().timestamp() - float(last_ts)
-                if delta < 60:
-                    logger.info(f"用户 {user_id} 最近{int(delta)}秒内有发言，跳过主动触发")
-                    return False
-
-            # 最近10分钟内若AI刚说过话，且会话内最后一条消息是AI，则不要插话，等待用户先说
-            last_ai_ts = cache.get(f"last_ai_message_at:{user_id}")
-            if last_ai_ts:
-                if timezone.now().timestamp() - float(last_ai_ts) < 600:
-                    try:
-                        from chat_system.models import ChatSession, Message
-                        session_id = self.user_sessions.get(user_id)
-                        if session_id:
-                            if str(session_id).isdigit():
-                                session = ChatSession.objects.get(id=int(session_id))
-                            else:
-                                session = ChatSession.objects.get(session_id=str(session_id))
-                            last_msg = Message.objects.filter(session=session).order_by('-timestamp').first()
-                            if last_msg and last_msg.sender == 'ai':
-                                logger.info("上条为AI消息，等待用户先说，跳过主动触发")
-                                return False
-                    except Exception:
-                        pass
-            # 检查用户是否在线
+            # 检查用户是否在线（内存判断，无需访问Redis）
             if not self.is_user_online(user_id):
                 logger.warning(f"用户 {user_id} 不在线，跳过主动消息发送")
                 return False
-            
-            payload = {
-                "type": "chat.message",
-                "message": {
-                    "content": message,
-                    "sender": "ai",
-                    "content_type": "text",
-                    "message_type": message_type,
-                    "timestamp": timezone.now().isoformat(),
-                    "is_proactive": True
-                }
-            }
 
-            # 若会话处于等待用户回应阶段（回合制），则不主动打断
+            # 安静时段、每日配额、用户/AI最近发言、回合制等待等条件在一个Redis脚本里原子判断并占用配额
             session_id = self.user_sessions.get(user_id)
-            if session_id:
-                await_key = f"await_user_reply:{session_id}"
-                if cache.get(await_key):
-                    logger.info(f"会话 {session_id} 正在等待用户回应，跳过主动触发")
-                    return False
+            if quota_limit is None:
+                quota_limit = trigger_rule_store.daily_quota(trigger_rule_store.get_snapshot(user_id))
+            # 在线会话可能以字符串 session_id 登记，而“等待用户回应”标志按会话主键存放
+            session_pk = session_resolver.resolve_pk(session_id) if session_id else None
+            decision = proactive_gate.check_and_reserve(user_id, session_key=session_pk, quota_limit=quota_limit)
+            if not decision.allowed:
+                logger.info(f"跳过主动触发: user_id={user_id}, 原因={SKIP_REASONS.get(decision.reason, decision.reason)}")
+                return False
 
             # 仅发送到优先的会话组；若没有已知会话，退回到用户组
-            if session_id:
-                async_to_sync(self.channel_layer.group_send)(f"chat_{session_id}", payload)
-            else:
-                async_to_sync(self.channel_layer.group_send)(f"chat_{user_id}", payload)
-            
-            logger.info(f"主动消息发送成功: user_id={user_id}, type={message_type}")
-            cache.set(quota_key, quota + 1, timeout=24*3600)
+            try:
+                if session_pk:
+                    # 主动消息入库并占用会话序号，断线重连的客户端可以补发
+                    from .models import Message
+                    proactive_msg = Message.objects.create(
+                        session_id=session_pk,
+                        content=message,
+                        content_type='text',
+                        sender='ai',
+                        is_proactive=True,
+                        metadata={'message_type': message_type},
+                    )
+                    session_events.broadcast_message(
+                        proactive_msg, group=f"chat_{session_id}", channel_layer=self.channel_layer
+                    )
+                else:
+                    payload = {
+                        "type": "chat.message",
+                        "message": {
+                            "content": message,
+                            "sender": "ai",
+                            "content_type": "text",
+                            "message_type": message_type,
+                            "timestamp": timezone.now().isoformat(),
+                            "is_proactive": True
+                        }
+                    }
+                    async_to_sync(self.channel_layer.group_send)(f"chat_{user_id}", payload)
+            except Exception:
+                proactive_gate.release(user_id)
+                raise
+
+            logger.info(f"主动消息发送成功: user_id={user_id}, type={message_type}, 今日第{decision.quota}条")
             return True
             
         except Exception as e:
@@ -221,11 +213,14 @@ class ProactiveEngine:
         recent = self._get_user_recent_messages(user, within_seconds=10)
         return not recent.exists()
 
+    def welcome_cooldown_key(self, user_id):
+        return f"welcome_greeted:{user_id}"
+
     def send_welcome_on_connect(self, user_id: int, cooldown_minutes: int = 5):
-        """用户建立连接后发送一次问候（带冷却）"""
+        """用户建立连接后发送一次问候（带跨进程冷却）"""
         try:
-            last_at = self.last_connect_greet_at.get(user_id)
-            if last_at and timezone.now() - last_at < timedelta(minutes=cooldown_minutes):
+            # 冷却在尝试时即占用：部署后的重连风暴里同一用户只会尝试一次
+            if not cache.add(self.welcome_cooldown_key(user_id), 1, timeout=cooldown_minutes * 60):
                 return False
 
             from django.contrib.auth.models import User
@@ -233,55 +228,73 @@ class ProactiveEngine:
             # 若最近10秒内已有对话（用户或AI），则跳过此次问候，避免打断
             if not self.should_send_silent_prompt(user):
                 return False
-            greeting_message = self.generate_proactive_message('greeting', {
-                'user_name': user.username,
-                'time_of_day': self.get_time_greeting()
-            })
-            sent = self.send_proactive_message(user_id, greeting_message, 'greeting')
-            if sent:
-                self.last_connect_greet_at[user_id] = timezone.now()
-            return sent
+            greeting_message = self.get_pooled_message('greeting', user)
+            return self.send_proactive_message(user_id, greeting_message, 'greeting')
         except Exception as e:
             logger.error(f"连接问候发送失败: {e}")
             return False
     
     def process_user_activity(self, user_id, activity_type, content=None):
-        """处理用户活动，决定是否触发主动关怀"""
+        """记录用户活动：仅追加到活动流，入库与关怀分析由后台消费者完成"""
         try:
-            from chat_system.models import UserActivity, ConversationHistory
-            
-            # 记录用户活动
-            UserActivity.objects.create(
-                user_id=user_id,
-                activity_type=activity_type,
-                content=content,
-                timestamp=timezone.now()
-            )
-            
-            # 获取用户最近活动
-            recent_activities = UserActivity.objects.filter(
-                user_id=user_id
-            ).order_by('-timestamp')[:10]
-            
-            # 分析是否需要主动关怀
-            if self.should_trigger_care(user_id, recent_activities):
-                care_message = self.generate_proactive_message('care', {
-                    'recent_activities': recent_activities
-                })
-                self.send_proactive_message(user_id, care_message, 'care')
-                
+            activity_stream.append(user_id, activity_type, content)
         except Exception as e:
             logger.error(f"处理用户活动失败: {e}")
+
+    def handle_activity_window(self, user_id, summary):
+        """活动窗口出现新消息时回调：更新滚动情绪状态
+
+        在活动消费者线程里、确认事件之前同步执行，只做关键词分析（不调用大模型）；
+        用户刚发过言，此时不判断关怀，由周期任务按累积的情绪状态决定
+        """
+        # 每条新消息只分析一次
+        for text in summary.get('new_messages', []):
+            emotion_state.update_from_text(user_id, text)
     
-    def run_daily_tasks(self):
-        """保留的低频任务（可扩展），当前不做重度逻辑"""
+    def run_daily_tasks(self, today=None):
+        """每日任务：一次索引范围查询取出今天有记忆事件的所有用户，发送提醒并顺延错过的事件；
+        同时开启新一轮记忆整理"""
+        self.consolidation_due = True
         try:
-            pass
+            return self.send_event_reminders(today)
         except Exception as e:
             logger.error(f"运行每日任务失败: {e}")
+            return 0
+
+    def run_consolidation_batch(self):
+        """整理一批用户的记忆（从检查点继续），本轮全部完成后停止，等待下一次每日任务"""
+        try:
+            processed, totals, finished = memory_consolidator.run_batch()
+            if processed:
+                logger.info(f"记忆整理 {processed} 个用户: {totals}")
+            if finished:
+                self.consolidation_due = False
+        except Exception as e:
+            logger.error(f"记忆整理失败: {e}")
+
+    def send_event_reminders(self, today=None, user_ids=None):
+        """发送记忆事件提醒；当天不在线的用户留到其上线后的周期任务中补发"""
+        today = today or timezone.localdate()
+        done = []
+        sent_count = 0
+        for event in event_calendar.due_events(today, user_ids):
+            # 已错过或今天已提醒过的事件直接顺延
+            if event.next_occurrence < today or event.last_reminded == today:
+                done.append(event)
+                continue
+            if not self.is_user_online(event.user_id):
+                continue
+            if self.send_proactive_message(event.user_id, event_calendar.reminder_message(event), 'reminder'):
+                event.last_reminded = today
+                done.append(event)
+                sent_count += 1
+        event_calendar.advance(done, today)
+        if sent_count:
+            logger.info(f"记忆事件提醒发送 {sent_count} 条")
+        return sent_count
 
     def run_periodic_tasks(self):
-        """高频周期任务：每1~2分钟检测静默并发送关怀/分享"""
+        """高频周期任务：按 ProactiveTrigger 规则取出到期的在线用户，检测静默并发送关怀/分享"""
         try:
             from django.contrib.auth.models import User
             online_users = self.get_online_users()
@@ -289,25 +302,51 @@ class ProactiveEngine:
                 logger.info("没有在线用户，跳过周期任务")
                 return
 
-            for user_id in online_users:
+            now = timezone.now()
+            trigger_rule_store.ensure_rules(online_users, now)
+
+            # 一次索引范围扫描取出所有到期规则，按用户分组
+            due_by_user = {}
+            for rule in trigger_rule_store.due_rules(online_users, now, trigger_types=trigger_rule_store.DEFAULT_RULES.keys()):
+                due_by_user.setdefault(rule.user_id, []).append(rule)
+            if not due_by_user:
+                return
+
+            users = User.objects.in_bulk(list(due_by_user.keys()))
+            snapshots = trigger_rule_store.get_snapshots(due_by_user.keys())
+            fired = []
+            for user_id, rules in due_by_user.items():
                 try:
-                    user = User.objects.get(id=user_id)
+                    user = users.get(user_id)
+                    if user is None:
+                        self.remove_connected_user(user_id)
+                        continue
                     # 10秒内无任何消息 -> 触发
                     if self.should_send_silent_prompt(user):
-                        # 随机选择更自然的消息类型
-                        trigger_type = random.choice(['share', 'greeting', 'care'])
-                        message = self.generate_proactive_message(trigger_type, {
-                            'user_name': user.username,
-                            'time_of_day': self.get_time_greeting()
-                        })
-                        self.send_proactive_message(user.id, message, trigger_type)
-                except User.DoesNotExist:
-                    self.remove_connected_user(user_id)
+                        rule = self.choose_rule(user_id, rules)
+                        if rule is None:
+                            continue
+                        message = self.get_pooled_message(rule.trigger_type, user)
+                        quota_limit = trigger_rule_store.daily_quota(snapshots.get(user_id, {}))
+                        if self.send_proactive_message(user.id, message, rule.trigger_type, quota_limit=quota_limit):
+                            fired.append(rule)
                 except Exception as e:
                     logger.error(f"周期任务处理用户 {user_id} 异常: {e}")
+
+            # 本轮触发过的规则批量回写
+            trigger_rule_store.mark_fired(fired, now)
         except Exception as e:
             logger.error(f"运行周期任务失败: {e}")
     
+    def choose_rule(self, user_id, rules):
+        """从到期规则中选出本轮要触发的一条：情绪状态需要关怀时优先关怀，否则不发关怀"""
+        care = [rule for rule in rules if rule.trigger_type == 'care']
+        if care and self.should_trigger_care(user_id):
+            return care[0]
+        others = [rule for rule in rules if rule.trigger_type != 'care']
+        # 在到期的触发类型中随机选择，保持自然
+        return random.choice(others) if others else None
+
     def send_message_to_user(self, user_id, message, message_type="proactive"):
         """直接向指定用户发送消息"""
         try:
@@ -333,22 +372,40 @@ class ProactiveEngine:
         else:
             return "夜深了"
     
+    def next_tick_interval(self):
+        """下一次周期任务前的等待秒数（带抖动）"""
+        return random.randint(*self.TICK_INTERVAL)
+
     def start_background_tasks(self):
         """启动后台任务"""
         try:
             logger.info("主动触发引擎后台服务启动中...")
 
-            # 启动时跑一次低频任务
-            self.run_daily_tasks()
+            # 启动时跑一次低频任务，并预热消息池
+            last_daily_date = timezone.localdate()
+            self.run_daily_tasks(last_daily_date)
+            self.refill_message_pool()
 
             # 高频周期：每1~2分钟带抖动执行一次静默检测
             while True:
                 try:
                     # 随机等待 60~120 秒，避免同质化
-                    wait_s = random.randint(60, 120)
+                    wait_s = self.next_tick_interval()
                     time.sleep(wait_s)
                     logger.info(f"执行主动触发引擎周期任务（间隔 {wait_s}s）...")
                     self.run_periodic_tasks()
+                    # 日期变化时跑每日任务；其余时间只为在线用户补发当天的事件提醒
+                    today = timezone.localdate()
+                    if today != last_daily_date:
+                        last_daily_date = today
+                        self.run_daily_tasks(today)
+                    elif self.connected_users:
+                        self.send_event_reminders(today, self.get_online_users())
+                    logger.info(f"会话解析缓存命中统计: {session_resolver.stats()}")
+                    if self.consolidation_due:
+                        self.run_consolidation_batch()
+                    # 周期任务之后利用空闲补货，把大模型调用挪到低峰
+                    self.refill_message_pool()
                 except KeyboardInterrupt:
                     logger.info("主动触发引擎收到停止信号")
                     break
@@ -0,0 +1,153 @@
+"""
+主动消息发送闸门
+把配额、用户刚发言、用户正在输入、AI刚说完、等待用户回应等判断与配额自增合并到一个 Redis 脚本里，
+每个候选用户只需一次往返，并发下也不会超出每日配额
+"""
+
+import logging
+from collections import namedtuple
+from django.core.cache import cache
+from django.utils import timezone
+from .presence import presence_buffer
+from .redis_client import get_redis_client, redis_key
+
+logger = logging.getLogger(__name__)
+
+GateDecision = namedtuple('GateDecision', ['allowed', 'reason', 'quota'])
+
+# 跳过原因 -> 日志文案
+SKIP_REASONS = {
+    'quiet_hours': '安静时段',
+    'offline': '用户不在线',
+    'quota_exceeded': '达到今日配额',
+    'user_recently_active': '用户最近有发言',
+    'user_composing': '用户正在输入或刚回到页面',
+    'awaiting_user_after_ai': '上条为AI消息，等待用户先说',
+    'awaiting_user_reply': '会话正在等待用户回应',
+}
+
+# KEYS: 配额、用户最近发言时间、AI最近发言时间、用户最近活动心跳时间、[等待用户回应标志]
+# ARGV: 当前时间戳(秒)、每日配额、配额过期秒数、用户发言静默秒数、AI发言静默秒数、活动心跳静默秒数
+GATE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local quota = tonumber(redis.call('GET', KEYS[1]) or '0') or 0
+if quota >= tonumber(ARGV[2]) then
+    return {0, 'quota_exceeded', quota}
+end
+local last_user = tonumber(redis.call('GET', KEYS[2]) or '')
+if last_user and now - last_user < tonumber(ARGV[4]) then
+    return {0, 'user_recently_active', quota}
+end
+local last_activity = tonumber(redis.call('GET', KEYS[4]) or '')
+if last_activity and now - last_activity < tonumber(ARGV[6]) then
+    return {0, 'user_composing', quota}
+end
+local last_ai = tonumber(redis.call('GET', KEYS[3]) or '')
+if last_ai and now - last_ai < tonumber(ARGV[5]) and ((not last_user) or last_ai >= last_user) then
+    return {0, 'awaiting_user_after_ai', quota}
+end
+if #KEYS >= 5 and redis.call('EXISTS', KEYS[5]) == 1 then
+    return {0, 'awaiting_user_reply', quota}
+end
+quota = redis.call('INCR', KEYS[1])
+if quota == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return {1, 'ok', quota}
+"""
+
+
+class ProactiveGate:
+    """主动消息闸门"""
+
+    DAILY_QUOTA = 6  # 每用户每日最多主动消息数
+    QUOTA_TTL = 24 * 3600
+    USER_QUIET_SECONDS = 60  # 用户发言后暂停主动触发的时长
+    ACTIVITY_QUIET_SECONDS = 30  # 活动心跳（输入、切回页面）后暂停主动触发的时长
+    AI_QUIET_SECONDS = 600  # AI发言后等待用户先说的时长
+    QUIET_HOURS = (22, 7)  # 安静时段 [22点, 次日7点)
+
+    def __init__(self):
+        self._script = None
+
+    def quota_key(self, user_id, now=None):
+        return f"proactive_quota:{user_id}:{(now or timezone.now()).date().isoformat()}"
+
+    def is_quiet_hours(self, now=None):
+        hour = (now or timezone.now()).hour
+        start, end = self.QUIET_HOURS
+        return hour >= start or hour < end
+
+    def _get_script(self, client):
+        if self._script is None:
+            self._script = client.register_script(GATE_SCRIPT)
+        return self._script
+
+    def check_and_reserve(self, user_id, session_key=None, quota_limit=None, now=None):
+        """评估全部闸门条件，通过时原子地占用一个配额，返回 GateDecision"""
+        now = now or timezone.now()
+        quota_limit = self.DAILY_QUOTA if quota_limit is None else quota_limit
+        if self.is_quiet_hours(now):
+            return GateDecision(False, 'quiet_hours', None)
+
+        keys = [
+            self.quota_key(user_id, now),
+            f"last_user_message_at:{user_id}",
+            f"last_ai_message_at:{user_id}",
+            presence_buffer.activity_key(user_id),
+        ]
+        if session_key:
+            keys.append(f"await_user_reply:{session_key}")
+
+        client = get_redis_client()
+        if client is None:
+            return self._check_without_script(keys, quota_limit, now)
+
+        script = self._get_script(client)
+        allowed, reason, quota = script(
+            keys=[redis_key(k) for k in keys],
+            args=[int(now.timestamp()), quota_limit, self.QUOTA_TTL,
+                  self.USER_QUIET_SECONDS, self.AI_QUIET_SECONDS, self.ACTIVITY_QUIET_SECONDS],
+            client=client,
+        )
+        if isinstance(reason, bytes):
+            reason = reason.decode('utf-8')
+        return GateDecision(bool(allowed), reason, quota)
+
+    def _check_without_script(self, keys, quota_limit, now):
+        """非 Redis 缓存后端（本地开发）下的等价判断"""
+        ts = now.timestamp()
+        values = cache.get_many(keys)
+        quota = values.get(keys[0], 0)
+        if quota >= quota_limit:
+            return GateDecision(False, 'quota_exceeded', quota)
+        last_user = values.get(keys[1])
+        if last_user and ts - float(last_user) < self.USER_QUIET_SECONDS:
+            return GateDecision(False, 'user_recently_active', quota)
+        last_activity = values.get(keys[3])
+        if last_activity and ts - float(last_activity) < self.ACTIVITY_QUIET_SECONDS:
+            return GateDecision(False, 'user_composing', quota)
+        last_ai = values.get(keys[2])
+        if last_ai and ts - float(last_ai) < self.AI_QUIET_SECONDS and (not last_user or float(last_ai) >= float(last_user)):
+            return GateDecision(False, 'awaiting_user_after_ai', quota)
+        if len(keys) >= 5 and values.get(keys[4]):
+            return GateDecision(False, 'awaiting_user_reply', quota)
+        cache.add(keys[0], 0, timeout=self.QUOTA_TTL)
+        quota = cache.incr(keys[0])
+        if quota > quota_limit:
+            cache.decr(keys[0])
+            return GateDecision(False, 'quota_exceeded', quota - 1)
+        return GateDecision(True, 'ok', quota)
+
+    def release(self, user_id, now=None):
+        """发送失败时归还已占用的配额"""
+        try:
+            cache.decr(self.quota_key(user_id, now))
+        except ValueError:
+            pass
+        except Exception as e:
+            logger.error(f"归还主动消息配额失败: {e}")
+
+
+# 全局实例
+proactive_gate = ProactiveGate()
@@ -0,0 +1,27 @@
+"""
+Redis 原生访问工具
+部分功能需要列表、脚本、管道等原生命令，这里统一从 Django 缓存后端取出底层客户端
+"""
+
+import logging
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+logger = logging.getLogger(__name__)
+
+
+def get_redis_client(write=True):
+    """返回默认缓存背后的 redis 客户端；缓存后端不是 Redis 时返回 None"""
+    backend = caches['default']
+    if not isinstance(backend, RedisCache):
+        return None
+    try:
+        return backend._cache.get_client(write=write)
+    except Exception as e:
+        logger.error(f"获取Redis客户端失败: {e}")
+        return None
+
+
+def redis_key(key):
+    """生成与 Django 缓存一致的完整键名（带前缀与版本），便于原生命令与 cache.get 共用同一个键"""
+    return caches['default'].make_and_validate_key(key)
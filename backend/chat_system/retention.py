@@ -0,0 +1,178 @@
+"""
+历史数据保留与归档
+ConversationHistory 与 UserActivity 只增不减。超过保留期的行按用户压缩为 NDJSON，
+以 gzip 成员的形式追加到 {归档目录}/{表}/user_{用户ID}.ndjson.gz，
+每个成员在 {归档目录}/{表}/index.ndjson 中记一行（偏移、长度、ID 与时间范围），
+查询时只解压命中的成员；归档落盘后再按小批次删除，避免长时间占用数据库写锁
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryRetention:
+    """超期历史数据的归档与清理"""
+
+    # 各表保留天数，可在 settings.DATA_RETENTION_DAYS 中按表覆盖；0 表示不清理
+    RETENTION_DAYS = {
+        'conversation_history': 90,
+        'user_activity': 30,
+        **getattr(settings, 'DATA_RETENTION_DAYS', {}),
+    }
+    ARCHIVE_DIR = getattr(settings, 'DATA_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archives'))
+    CHUNK_SIZE = 2000  # 每个 gzip 成员的行数
+    DELETE_BATCH = 500  # 每条 DELETE 语句删除的行数（每批一个短事务）
+    BATCH_PAUSE = 0.05  # 两批删除之间让出写锁的时间（秒）
+
+    def models(self):
+        from .models import ConversationHistory, UserActivity
+
+        return {'conversation_history': ConversationHistory, 'user_activity': UserActivity}
+
+    # -------------------- 归档文件 --------------------
+    def table_dir(self, table):
+        return os.path.join(self.ARCHIVE_DIR, table)
+
+    def index_path(self, table):
+        return os.path.join(self.table_dir(table), 'index.ndjson')
+
+    def archive_name(self, user_id):
+        return f"user_{user_id}.ndjson.gz"
+
+    def read_index(self, table, user_id=None):
+        """读取归档索引，返回条目列表（可按用户过滤）"""
+        entries = []
+        try:
+            with open(self.index_path(table), encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if user_id is None or entry['user_id'] == user_id:
+                        entries.append(entry)
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _append_chunk(self, table, user_id, rows):
+        """追加一个 gzip 成员并记入索引，先落盘数据再写索引"""
+        os.makedirs(self.table_dir(table), exist_ok=True)
+        payload = ''.join(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in rows)
+        data = gzip.compress(payload.encode('utf-8'))
+        name = self.archive_name(user_id)
+        path = os.path.join(self.table_dir(table), name)
+        with open(path, 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        entry = {
+            'user_id': user_id,
+            'file': name,
+            'offset': offset,
+            'length': len(data),
+            'count': len(rows),
+            'first_id': rows[0]['id'],
+            'last_id': rows[-1]['id'],
+            'start': min(row['timestamp'] for row in rows).isoformat(),
+            'end': max(row['timestamp'] for row in rows).isoformat(),
+            'archived_at': timezone.now().isoformat(),
+        }
+        with open(self.index_path(table), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return entry
+
+    def read_archive(self, table, user_id, start=None, end=None):
+        """读取用户归档的行；start/end 为时间范围，只解压与之有交集的成员"""
+        rows = []
+        for entry in self.read_index(table, user_id):
+            if start and parse_datetime(entry['end']) < start:
+                continue
+            if end and parse_datetime(entry['start']) > end:
+                continue
+            with open(os.path.join(self.table_dir(table), entry['file']), 'rb') as f:
+                f.seek(entry['offset'])
+                data = f.read(entry['length'])
+            for line in gzip.decompress(data).decode('utf-8').splitlines():
+                row = json.loads(line)
+                timestamp = parse_datetime(row['timestamp'])
+                if (start and timestamp < start) or (end and timestamp > end):
+                    continue
+                rows.append(row)
+        return rows
+
+    # -------------------- 清理 --------------------
+    def _delete_ids(self, model, ids, pause):
+        """按小批次删除，每条语句在自动提交下各自成为一个短事务"""
+        deleted = 0
+        for i in range(0, len(ids), self.DELETE_BATCH):
+            deleted += model.objects.filter(id__in=ids[i:i + self.DELETE_BATCH]).delete()[0]
+            if pause:
+                time.sleep(pause)
+        return deleted
+
+    def compact_user(self, table, user_id, cutoff, dry_run=False, pause=None):
+        """归档并删除一个用户早于 cutoff 的行，返回 (归档行数, 删除行数)"""
+        model = self.models()[table]
+        pause = self.BATCH_PAUSE if pause is None else pause
+        # 上次归档后未来得及删除的行不重复归档
+        archived_up_to = max((entry['last_id'] for entry in self.read_index(table, user_id)), default=0)
+        queryset = model.objects.filter(user_id=user_id, timestamp__lt=cutoff)
+        if dry_run:
+            return queryset.count(), 0
+        archived = deleted = 0
+        fields = [field.attname for field in model._meta.concrete_fields]
+        while True:
+            rows = list(queryset.order_by('id').values(*fields)[:self.CHUNK_SIZE])
+            if not rows:
+                break
+            fresh = [row for row in rows if row['id'] > archived_up_to]
+            if fresh:
+                self._append_chunk(table, user_id, fresh)
+                archived += len(fresh)
+            deleted += self._delete_ids(model, [row['id'] for row in rows], pause)
+        return archived, deleted
+
+    def compact(self, tables=None, dry_run=False, pause=None, now=None):
+        """按保留期处理各表，返回 {表: (归档行数, 删除行数)}"""
+        now = now or timezone.now()
+        results = {}
+        for table in tables or self.RETENTION_DAYS:
+            days = self.RETENTION_DAYS.get(table)
+            if not days:
+                continue
+            model = self.models()[table]
+            cutoff = now - timedelta(days=days)
+            archived = deleted = 0
+            # 一次查询取出有过期数据的用户，再逐个用户处理，每次查询都能走 (user, timestamp) 索引
+            user_ids = list(
+                model.objects.filter(timestamp__lt=cutoff).order_by('user_id')
+                .values_list('user_id', flat=True).distinct()
+            )
+            for user_id in user_ids:
+                try:
+                    user_archived, user_deleted = self.compact_user(table, user_id, cutoff, dry_run, pause)
+                    archived += user_archived
+                    deleted += user_deleted
+                except Exception as e:
+                    logger.error(f"归档历史数据失败 table={table} user_id={user_id}: {e}")
+            results[table] = (archived, deleted)
+            if not dry_run:
+                logger.info(f"历史数据归档 {table}: 归档 {archived} 行，删除 {deleted} 行（早于 {cutoff:%Y-%m-%d}）")
+        return results
+
+
+# 全局实例
+history_retention = HistoryRetention()
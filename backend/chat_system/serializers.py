@@ -5,7 +5,7 @@ from .models import ChatSession, Message
 class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = ['id', 'session', 'content', 'content_type', 'sender', 'timestamp']
+        fields = ['id', 'session', 'seq', 'content', 'content_type', 'sender', 'timestamp']
 
 
 class ChatSessionSerializer(serializers.ModelSerializer):
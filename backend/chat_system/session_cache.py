@@ -0,0 +1,118 @@
+"""
+会话解析缓存
+WebSocket 路由里的会话标识既可能是整数主键也可能是字符串 session_id，
+这里统一解析为 (主键, session_id, 所属用户ID, 是否有效)，两级缓存：进程内 LRU + Redis
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+SessionInfo = namedtuple('SessionInfo', ['pk', 'session_id', 'owner_id', 'is_active'])
+
+
+class SessionResolver:
+    """会话解析服务"""
+
+    LOCAL_SIZE = 4096  # 进程内 LRU 容量
+    LOCAL_TTL = 30  # 进程内条目有效期（秒），限制其他进程失效后的陈旧窗口
+    REMOTE_TTL = 600  # Redis 条目有效期（秒）
+
+    def __init__(self):
+        self._local = OrderedDict()  # 标识 -> (过期时间, SessionInfo)
+        self._lock = threading.Lock()
+        self.stats_counter = {'local_hits': 0, 'remote_hits': 0, 'misses': 0}
+
+    def _cache_key(self, identifier):
+        return f"session_resolve:{identifier}"
+
+    # -------------------- 进程内 LRU --------------------
+    def _local_get(self, identifier):
+        with self._lock:
+            entry = self._local.get(identifier)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._local[identifier]
+                return None
+            self._local.move_to_end(identifier)
+            return entry[1]
+
+    def _local_set(self, info):
+        expires_at = time.monotonic() + self.LOCAL_TTL
+        with self._lock:
+            for identifier in (str(info.pk), info.session_id):
+                self._local[identifier] = (expires_at, info)
+                self._local.move_to_end(identifier)
+            while len(self._local) > self.LOCAL_SIZE:
+                self._local.popitem(last=False)
+
+    # -------------------- 解析 --------------------
+    def resolve(self, identifier):
+        """按主键或 session_id 解析会话，不存在返回 None"""
+        if identifier is None or identifier == '':
+            return None
+        identifier = str(identifier)
+        info = self._local_get(identifier)
+        if info is not None:
+            self.stats_counter['local_hits'] += 1
+            return info
+        try:
+            info = cache.get(self._cache_key(identifier))
+        except Exception as e:
+            logger.error(f"读取会话缓存失败: {e}")
+            info = None
+        if info is not None:
+            self.stats_counter['remote_hits'] += 1
+            self._local_set(info)
+            return info
+
+        self.stats_counter['misses'] += 1
+        from .models import ChatSession
+        lookup = {'id': int(identifier)} if identifier.isdigit() else {'session_id': identifier}
+        row = ChatSession.objects.filter(**lookup).values('id', 'session_id', 'user_id', 'is_active').first()
+        if row is None:
+            return None
+        info = SessionInfo(row['id'], row['session_id'], row['user_id'], row['is_active'])
+        try:
+            # 两种标识都写入，之后任一形式都能命中
+            cache.set_many({
+                self._cache_key(info.pk): info,
+                self._cache_key(info.session_id): info,
+            }, timeout=self.REMOTE_TTL)
+        except Exception as e:
+            logger.error(f"写入会话缓存失败: {e}")
+        self._local_set(info)
+        return info
+
+    def resolve_pk(self, identifier):
+        info = self.resolve(identifier)
+        return info.pk if info else None
+
+    # -------------------- 失效 --------------------
+    def invalidate(self, pk, session_id):
+        """会话变更（如停用、删除）时清除两种标识的缓存"""
+        identifiers = [str(pk), str(session_id)]
+        with self._lock:
+            for identifier in identifiers:
+                self._local.pop(identifier, None)
+        try:
+            cache.delete_many([self._cache_key(identifier) for identifier in identifiers])
+        except Exception as e:
+            logger.error(f"清除会话缓存失败: {e}")
+
+    def stats(self):
+        """命中率统计"""
+        counter = dict(self.stats_counter)
+        total = sum(counter.values())
+        counter['local_size'] = len(self._local)
+        counter['hit_rate'] = round((counter['local_hits'] + counter['remote_hits']) / total, 4) if total else 0.0
+        return counter
+
+
+# 全局实例
+session_resolver = SessionResolver()
@@ -0,0 +1,116 @@
+"""
+会话事件日志
+每条消息按会话序号（seq）写入一个有界的 Redis Stream 并广播到会话组；
+客户端断线重连时携带 last_seq，只补发缺失的事件，流已被裁剪时退回数据库
+"""
+
+import json
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from .models import Message
+from .redis_client import get_redis_client, redis_key
+
+logger = logging.getLogger(__name__)
+
+
+class SessionEventLog:
+    """会话事件日志"""
+
+    STREAM_MAXLEN = 200  # 每个会话保留的最近事件数（近似裁剪）
+    STREAM_TTL = 24 * 3600  # 会话长时间无消息时整条流过期
+    REPLAY_LIMIT = 200  # 单次补发的最大事件数
+
+    def _stream_key(self, session_pk):
+        return redis_key(f"session_events:{session_pk}")
+
+    def event_payload(self, message, extra=None):
+        """chat.message 事件体（与 ChatConsumer.chat_message 的输出字段一致）"""
+        metadata = message.metadata or {}
+        payload = {
+            'id': message.id,
+            'seq': message.seq,
+            'content': message.content,
+            'sender': message.sender,
+            'content_type': message.content_type,
+            'timestamp': message.timestamp.isoformat(),
+            'is_proactive': message.is_proactive,
+        }
+        for field in ('client_msg_id', 'message_type', 'text'):
+            if metadata.get(field):
+                payload[field] = metadata[field]
+        if extra:
+            payload.update(extra)
+        return payload
+
+    # -------------------- 写入 --------------------
+    def append(self, session_pk, payload):
+        """把事件追加到会话流（一次管道往返）"""
+        client = get_redis_client()
+        if client is None:
+            return
+        try:
+            key = self._stream_key(session_pk)
+            pipe = client.pipeline(transaction=False)
+            pipe.xadd(key, {'seq': str(payload.get('seq') or 0), 'p': json.dumps(payload, ensure_ascii=False)},
+                      maxlen=self.STREAM_MAXLEN, approximate=True)
+            pipe.expire(key, self.STREAM_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"写入会话事件流失败 session={session_pk}: {e}")
+
+    def broadcast_message(self, message, extra=None, group=None, channel_layer=None):
+        """记录并广播一条消息；group 默认为会话主键对应的聊天组"""
+        payload = self.event_payload(message, extra)
+        self.append(message.session_id, payload)
+        channel_layer = channel_layer or get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            group or f"chat_{message.session_id}",
+            {'type': 'chat.message', 'message': payload}
+        )
+        return payload
+
+    def record(self, message):
+        """只记录不广播（用户自己发出的消息，发送端已本地展示）"""
+        payload = self.event_payload(message)
+        self.append(message.session_id, payload)
+        return payload
+
+    # -------------------- 补发 --------------------
+    def _replay_from_stream(self, session_pk, last_seq):
+        """从流中取 seq > last_seq 的事件；流中有缺口（已裁剪或已过期）时返回 None"""
+        client = get_redis_client()
+        if client is None:
+            return None
+        events = []
+        reached = False
+        # 从新到旧读取，遇到已收到的序号即停止
+        for _, fields in client.xrevrange(self._stream_key(session_pk), count=self.STREAM_MAXLEN * 2):
+            seq = int(fields.get(b'seq') or fields.get('seq') or 0)
+            if seq <= last_seq:
+                reached = True
+                break
+            events.append(json.loads(fields.get(b'p') or fields.get('p')))
+        if not events and not reached:
+            # 流为空：无法区分“没有新消息”与“流已过期”，交给数据库判断
+            return None
+        events.sort(key=lambda event: event.get('seq') or 0)
+        if [event.get('seq') for event in events] != list(range(last_seq + 1, last_seq + 1 + len(events))):
+            return None
+        return events
+
+    def replay(self, session_pk, last_seq, limit=None):
+        """返回 seq > last_seq 的事件列表（按序）"""
+        limit = limit or self.REPLAY_LIMIT
+        try:
+            events = self._replay_from_stream(session_pk, last_seq)
+            if events is not None:
+                return events[:limit]
+        except Exception as e:
+            logger.error(f"读取会话事件流失败 session={session_pk}: {e}")
+        rows = Message.objects.filter(session_id=session_pk, seq__gt=last_seq).order_by('seq')[:limit]
+        return [self.event_payload(row) for row in rows]
+
+
+# 全局实例
+session_events = SessionEventLog()
@@ -0,0 +1,271 @@
+"""
+主动触发引擎容量模拟
+注入虚拟在线用户与历史消息，用虚拟时钟驱动引擎周期任务，替换大模型与 Channel Layer，
+统计每轮耗时、数据库/缓存操作数、发送速率与配额命中，用于发布前评估引擎容量
+"""
+
+import logging
+import random
+import statistics
+import time
+from contextlib import contextmanager, ExitStack
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import caches, cache
+from django.core.cache.backends.redis import RedisCache
+from django.db import connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualClock:
+    """虚拟时钟：替换 timezone.now，由模拟器推进"""
+
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def advance(self, seconds):
+        self.current = self.current + timedelta(seconds=seconds)
+
+
+class StubChannelLayer:
+    """只计数不投递的 Channel Layer"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def group_send(self, group, message):
+        self.sent += 1
+
+    async def group_add(self, group, channel):
+        pass
+
+    async def group_discard(self, group, channel):
+        pass
+
+
+class OpCounter:
+    """统计数据库查询、缓存/Redis 往返与大模型调用次数"""
+
+    CACHE_METHODS = (
+        'get', 'set', 'add', 'delete', 'get_many', 'set_many', 'delete_many', 'incr', 'decr', 'touch', 'has_key',
+    )
+
+    def __init__(self):
+        self.db = 0
+        self.cache = 0
+        self.llm = 0
+
+    def snapshot(self):
+        return self.db, self.cache, self.llm
+
+    def _db_wrapper(self, execute, sql, params, many, context):
+        self.db += 1
+        return execute(sql, params, many, context)
+
+    def _count_cache(self, func):
+        def wrapper(*args, **kwargs):
+            self.cache += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    @contextmanager
+    def install(self, llm_stub):
+        with ExitStack() as stack:
+            stack.enter_context(connection.execute_wrapper(self._db_wrapper))
+            backend = caches['default']
+            if isinstance(backend, RedisCache):
+                # Redis 后端按实际往返计数：单条命令、管道、脚本各算一次
+                import redis
+                original_execute = redis.client.Redis.execute_command
+                original_pipeline = redis.client.Pipeline.execute
+                counter = self
+
+                def execute_command(client, *args, **kwargs):
+                    counter.cache += 1
+                    return original_execute(client, *args, **kwargs)
+
+                def pipeline_execute(pipe, *args, **kwargs):
+                    counter.cache += 1
+                    return original_pipeline(pipe, *args, **kwargs)
+
+                stack.enter_context(mock.patch.object(redis.client.Redis, 'execute_command', execute_command))
+                stack.enter_context(mock.patch.object(redis.client.Pipeline, 'execute', pipeline_execute))
+            else:
+                for name in self.CACHE_METHODS:
+                    stack.enter_context(mock.patch.object(backend, name, self._count_cache(getattr(backend, name))))
+
+            def chat(client, messages, *args, **kwargs):
+                self.llm += 1
+                return llm_stub(messages)
+
+            stack.enter_context(mock.patch('ai_engine.tencent_client.TencentDeepSeekClient.chat', chat))
+            yield self
+
+
+def stub_llm(messages):
+    """大模型替身：情绪分析返回结构化 JSON，其余返回固定文案"""
+    prompt = messages[-1].get('Content', '') if messages else ''
+    if '情绪状态' in prompt:
+        emotion_type = random.choice(['positive', 'neutral', 'negative'])
+        return {
+            'success': True,
+            'text': '{"emotion_type": "%s", "intensity": "%s", "specific_emotion": "平静", "confidence": 0.8}'
+                    % (emotion_type, random.choice(['low', 'medium', 'high'])),
+        }
+    return {'success': True, 'text': '【称呼】，刚路过楼下的咖啡店，突然想到你～'}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+class ProactiveSimulation:
+    """主动触发引擎模拟器"""
+
+    def __init__(self, users=1000, ticks=30, speak_ratio=0.05, history=5, start_hour=9, seed=None):
+        self.users = users
+        self.ticks = ticks
+        self.speak_ratio = speak_ratio
+        self.history = history
+        self.start_hour = start_hour
+        self.rng = random.Random(seed)
+        start = timezone.now().replace(hour=start_hour, minute=0, second=0, microsecond=0)
+        self.started_at = start
+        self.clock = VirtualClock(start)
+        self.channel_layer = StubChannelLayer()
+        self.counter = OpCounter()
+        self.decisions = {}
+        self.engine = None
+        self.sessions = {}  # user_id -> session pk
+
+    # -------------------- 数据准备 --------------------
+    def _setup_population(self):
+        from django.contrib.auth.models import User
+        from .models import ChatSession, Message
+        from .proactive import ProactiveEngine
+
+        prefix = f"sim_{int(time.time())}_"
+        User.objects.bulk_create([
+            User(username=f"{prefix}{i}", password='!') for i in range(self.users)
+        ], batch_size=500)
+        user_ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+        ChatSession.objects.bulk_create([
+            ChatSession(user_id=uid, session_id=f"{prefix}session_{uid}") for uid in user_ids
+        ], batch_size=500)
+        self.sessions = dict(ChatSession.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+        messages = []
+        for uid, sid in self.sessions.items():
+            for n in range(self.history):
+                messages.append(Message(
+                    session_id=sid,
+                    sender='user' if n % 2 == 0 else 'ai',
+                    content=f"历史消息{n}",
+                ))
+        Message.objects.bulk_create(messages, batch_size=1000)
+
+        self.engine = ProactiveEngine()
+        self.engine.channel_layer = self.channel_layer
+        for uid, sid in self.sessions.items():
+            self.engine.add_connected_user(uid, sid)
+        return user_ids
+
+    def _simulate_user_messages(self, user_ids):
+        """部分用户在本轮发言：入库、刷新发言时间、追加活动事件"""
+        from .models import Message
+        speakers = self.rng.sample(user_ids, int(len(user_ids) * self.speak_ratio))
+        if not speakers:
+            return 0
+        Message.objects.bulk_create([
+            Message(session_id=self.sessions[uid], sender='user', content='今天有点累')
+            for uid in speakers
+        ])
+        now_ts = int(timezone.now().timestamp())
+        cache.set_many({f"last_user_message_at:{uid}": now_ts for uid in speakers}, timeout=3600)
+        for uid in speakers:
+            self.engine.process_user_activity(uid, 'message', '今天有点累')
+        return len(speakers)
+
+    def _record_decision(self, check):
+        def wrapper(*args, **kwargs):
+            decision = check(*args, **kwargs)
+            self.decisions[decision.reason] = self.decisions.get(decision.reason, 0) + 1
+            return decision
+        return wrapper
+
+    # -------------------- 运行 --------------------
+    def run(self):
+        from .activity_stream import activity_stream
+        from .proactive_gate import proactive_gate
+
+        tick_stats = []
+        consumer_stats = []
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch('django.utils.timezone.now', self.clock.now))
+            stack.enter_context(mock.patch.object(proactive_gate, 'check_and_reserve', self._record_decision(proactive_gate.check_and_reserve)))
+            stack.enter_context(transaction.atomic())
+            user_ids = self._setup_population()
+            current_day = self.clock.now().date()
+            with self.counter.install(stub_llm):
+                for _ in range(self.ticks):
+                    self.clock.advance(self.engine.next_tick_interval())
+                    if self.clock.now().date() != current_day:
+                        current_day = self.clock.now().date()
+                        self.engine.run_daily_tasks()
+                    self._simulate_user_messages(user_ids)
+
+                    db0, cache0, llm0 = self.counter.snapshot()
+                    started = time.perf_counter()
+                    activity_stream.process_once(block_ms=1)
+                    consumer_stats.append({
+                        'ms': (time.perf_counter() - started) * 1000,
+                        'db': self.counter.db - db0,
+                        'cache': self.counter.cache - cache0,
+                        'llm': self.counter.llm - llm0,
+                    })
+
+                    db0, cache0, llm0 = self.counter.snapshot()
+                    sent0 = self.channel_layer.sent
+                    started = time.perf_counter()
+                    self.engine.run_periodic_tasks()
+                    self.engine.refill_message_pool()
+                    tick_stats.append({
+                        'ms': (time.perf_counter() - started) * 1000,
+                        'db': self.counter.db - db0,
+                        'cache': self.counter.cache - cache0,
+                        'llm': self.counter.llm - llm0,
+                        'sent': self.channel_layer.sent - sent0,
+                    })
+            elapsed_minutes = (self.clock.now() - self.started_at).total_seconds() / 60.0
+            # 模拟数据全部回滚
+            transaction.set_rollback(True)
+        return self._report(tick_stats, consumer_stats, elapsed_minutes)
+
+    def _report(self, tick_stats, consumer_stats, elapsed_minutes):
+        tick_ms = [t['ms'] for t in tick_stats]
+        sends = sum(t['sent'] for t in tick_stats)
+        return {
+            'users': self.users,
+            'ticks': len(tick_stats),
+            'virtual_minutes': round(elapsed_minutes, 1),
+            'tick_ms_avg': round(statistics.mean(tick_ms), 2) if tick_ms else 0.0,
+            'tick_ms_p95': round(percentile(tick_ms, 95), 2),
+            'tick_ms_max': round(max(tick_ms), 2) if tick_ms else 0.0,
+            'db_per_tick': round(statistics.mean([t['db'] for t in tick_stats]), 1) if tick_stats else 0.0,
+            'cache_per_tick': round(statistics.mean([t['cache'] for t in tick_stats]), 1) if tick_stats else 0.0,
+            'llm_calls': sum(t['llm'] for t in tick_stats) + sum(c['llm'] for c in consumer_stats),
+            'consumer_ms_avg': round(statistics.mean([c['ms'] for c in consumer_stats]), 2) if consumer_stats else 0.0,
+            'consumer_db_per_batch': round(statistics.mean([c['db'] for c in consumer_stats]), 1) if consumer_stats else 0.0,
+            'sends': sends,
+            'sends_per_minute': round(sends / elapsed_minutes, 2) if elapsed_minutes else 0.0,
+            'quota_hits': self.decisions.get('quota_exceeded', 0),
+            'gate_decisions': dict(self.decisions),
+        }
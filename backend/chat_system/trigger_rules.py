@@ -0,0 +1,144 @@
+"""
+主动触发规则存储
+以 ProactiveTrigger 表作为每个用户的触发规则来源：周期任务通过 next_fire_at 索引一次范围扫描取出到期规则，
+配置读取走缓存快照，触发后批量回写 last_triggered / next_fire_at
+"""
+
+import logging
+from datetime import timedelta
+from django.core.cache import cache
+from django.utils import timezone
+from .models import ProactiveTrigger
+
+logger = logging.getLogger(__name__)
+
+
+class TriggerRuleStore:
+    """主动触发规则存储"""
+
+    # 周期任务使用的默认规则（原先写死在 should_trigger_* 中的阈值）
+    DEFAULT_RULES = {
+        'greeting': {'frequency_hours': 12},
+        'share': {'frequency_hours': 6},
+        'care': {'frequency_hours': 6},
+    }
+    DEFAULT_DAILY_QUOTA = 6
+    SNAPSHOT_TTL = 600
+    FILTER_CHUNK = 500  # 每条查询 user_id IN 的用户数（SQLite 旧版本每条语句最多 999 个参数）
+
+    def __init__(self):
+        self._ensured_users = set()  # 本进程内已确认存在默认规则的用户
+
+    def _chunks(self, user_ids):
+        """按 FILTER_CHUNK 切分用户ID，在线用户再多每条查询的参数个数也有上限"""
+        user_ids = list(user_ids)
+        for i in range(0, len(user_ids), self.FILTER_CHUNK):
+            yield user_ids[i:i + self.FILTER_CHUNK]
+
+    # -------------------- 规则初始化 --------------------
+    def ensure_rules(self, user_ids, now=None):
+        """为尚未初始化的用户补齐默认规则（每个用户每进程只检查一次）"""
+        pending = [uid for uid in user_ids if uid not in self._ensured_users]
+        if not pending:
+            return 0
+        now = now or timezone.now()
+        existing = set()
+        for chunk in self._chunks(pending):
+            existing.update(ProactiveTrigger.objects.filter(user_id__in=chunk).values_list('user_id', 'trigger_type'))
+        to_create = [
+            ProactiveTrigger(
+                user_id=uid,
+                trigger_type=trigger_type,
+                frequency_hours=rule['frequency_hours'],
+                next_fire_at=now,
+            )
+            for uid in pending
+            for trigger_type, rule in self.DEFAULT_RULES.items()
+            if (uid, trigger_type) not in existing
+        ]
+        if to_create:
+            ProactiveTrigger.objects.bulk_create(to_create, batch_size=self.FILTER_CHUNK, ignore_conflicts=True)
+        self._ensured_users.update(pending)
+        return len(to_create)
+
+    # -------------------- 周期扫描 --------------------
+    def due_rules(self, user_ids, now=None, trigger_types=None):
+        """按 next_fire_at 范围扫描取出指定用户中已到期的启用规则（每 FILTER_CHUNK 个用户一条查询）"""
+        now = now or timezone.now()
+        rules = []
+        for chunk in self._chunks(user_ids):
+            queryset = ProactiveTrigger.objects.filter(
+                is_enabled=True,
+                next_fire_at__lte=now,
+                user_id__in=chunk,
+            )
+            if trigger_types:
+                queryset = queryset.filter(trigger_type__in=list(trigger_types))
+            rules.extend(queryset)
+        return rules
+
+    def mark_fired(self, rules, now=None):
+        """批量回写触发时间（bulk_update 不经过 save，不会触发快照失效）"""
+        if not rules:
+            return 0
+        now = now or timezone.now()
+        for rule in rules:
+            rule.last_triggered = now
+            rule.next_fire_at = now + timedelta(hours=rule.frequency_hours)
+        ProactiveTrigger.objects.bulk_update(rules, ['last_triggered', 'next_fire_at'], batch_size=self.FILTER_CHUNK)
+        return len(rules)
+
+    # -------------------- 规则快照 --------------------
+    def _build_snapshot(self, rows):
+        snapshot = {}
+        for row in rows:
+            snapshot[row['trigger_type']] = {
+                'is_enabled': row['is_enabled'],
+                'frequency_hours': row['frequency_hours'],
+                'conditions': row['conditions'] or {},
+            }
+        return snapshot
+
+    def get_snapshots(self, user_ids):
+        """批量获取用户规则快照：缓存一次 get_many，未命中的用户按 FILTER_CHUNK 分批查询补齐"""
+        user_ids = list(user_ids)
+        keys = {ProactiveTrigger.rules_cache_key(uid): uid for uid in user_ids}
+        cached = cache.get_many(list(keys.keys()))
+        snapshots = {keys[k]: v for k, v in cached.items()}
+        missing = [uid for uid in user_ids if uid not in snapshots]
+        if missing:
+            rows_by_user = {uid: [] for uid in missing}
+            for chunk in self._chunks(missing):
+                for row in ProactiveTrigger.objects.filter(user_id__in=chunk).values(
+                    'user_id', 'trigger_type', 'is_enabled', 'frequency_hours', 'conditions'
+                ):
+                    rows_by_user[row['user_id']].append(row)
+            fresh = {uid: self._build_snapshot(rows) for uid, rows in rows_by_user.items()}
+            cache.set_many(
+                {ProactiveTrigger.rules_cache_key(uid): snap for uid, snap in fresh.items()},
+                timeout=self.SNAPSHOT_TTL
+            )
+            snapshots.update(fresh)
+        return snapshots
+
+    def get_snapshot(self, user_id):
+        return self.get_snapshots([user_id]).get(user_id, {})
+
+    def frequency_hours(self, snapshot, trigger_type):
+        """规则频率，未配置时取默认值"""
+        rule = snapshot.get(trigger_type) or {}
+        default = self.DEFAULT_RULES.get(trigger_type, {}).get('frequency_hours', 6)
+        return rule.get('frequency_hours', default)
+
+    def daily_quota(self, snapshot):
+        """每日配额：取各规则 conditions.daily_quota 中最小的一个，未配置时用默认值"""
+        quotas = [
+            rule['conditions']['daily_quota']
+            for rule in snapshot.values()
+            if isinstance(rule.get('conditions'), dict) and rule['conditions'].get('daily_quota') is not None
+        ]
+        return min(quotas) if quotas else self.DEFAULT_DAILY_QUOTA
+
+
+# 全局实例
+trigger_rule_store = TriggerRuleStore()
@@ -15,12 +15,17 @@ from rest_framework.permissions import IsAuthenticated
 
 from .models import ChatSession, Message
 from .serializers import ChatSessionSerializer, MessageSerializer
+from .session_cache import session_resolver
+from .message_service import message_service
+from .session_events import session_events
 from ai_engine.prompt_library import get_system_prompt, get_style_notes
+from ai_engine.memory_manager import memory_manager
 from ai_engine.tencent_client import TencentDeepSeekClient
 from ai_engine.multimodal_handler import multimodal_handler
 from ai_engine.xhs_crawler import fetch_xhs_examples, load_exemplars, save_exemplars
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.db import close_old_connections
 import threading
@@ -67,6 +72,7 @@ class MessageViewSet(viewsets.ModelViewSet):
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    PROMPT_MEMORY_BUDGET = 300  # 回复提示词中记忆部分的字符预算
 
     def create(self, request, *args, **kwargs):
         user = request.user
@@ -74,65 +80,22 @@ class MessageViewSet(viewsets.ModelViewSet):
         content = request.data.get('content', '')
         content_type = request.data.get('content_type', 'text')
         client_msg_id = request.data.get('client_msg_id')
-        try:
-            session = ChatSession.objects.get(id=session_id, user=user, is_active=True)
-        except ChatSession.DoesNotExist:
+        session = session_resolver.resolve(session_id)
+        if session is None or session.owner_id != user.id or not session.is_active:
             return Response({'success': False, 'message': '会话不存在或无权限'}, status=status.HTTP_404_NOT_FOUND)
 
-        # 幂等去重：若存在相同 client_msg_id 的用户消息则直接返回，避免重复入库与重复AI回复
-        if client_msg_id:
-            existed = Message.objects.filter(
-                session=session,
-                sender='user',
-                metadata__client_msg_id=client_msg_id
-            ).order_by('-timestamp').first()
-            if existed:
-                return Response({
-                    'success': True,
-                    'message': MessageSerializer(existed).data,
-                    'ai_message': None,
-                    'ai_messages': []
-                }, status=status.HTTP_200_OK)
-
-        # 记录用户消息到日志
-        user_logger.info(f"用户消息 | 会话ID: {session_id} | 用户ID: {user.id} | 内容类型: {content_type} | 内容: {content}")
-        
-        user_msg = Message.objects.create(
-            session=session,
-            content=content,
-            content_type=content_type,
-            sender='user',
-            metadata={'client_msg_id': client_msg_id} if client_msg_id else {}
+        user_msg, created = message_service.ingest_user_message(
+            user.id, session.pk, content, content_type, client_msg_id
         )
-        session.save()
-
-        # 去抖动聚合：用户可能连续发送多句，等待片刻后统一生成回复
-        now_ts = timezone.now().timestamp()
-        cache.set(f"last_user_message_at:{user.id}", now_ts, timeout=3600)
-        cache.set(f"last_user_message_at_session:{session.id}", now_ts, timeout=3600)
-        # 用户发言，清除“等待用户回应”标志，允许AI继续本回合
-        cache.delete(f"await_user_reply:{session.id}")
-        pending_key = f"debounce_pending:{session.id}"
-        if cache.get(pending_key):
-            resp_body = {
-                'success': True,
-                'message': MessageSerializer(user_msg).data,
-                'ai_message': None,
-                'ai_messages': []
-            }
-            return Response(resp_body, status=status.HTTP_201_CREATED)
-        # 标记去抖动中并启动后台聚合生成
-        cache.set(pending_key, 1, timeout=6)
-        try:
-            self._schedule_debounced_reply(session.id, user.id)
-        except Exception:
-            pass
         resp_body = {
             'success': True,
             'message': MessageSerializer(user_msg).data,
             'ai_message': None,
             'ai_messages': []
         }
+        if not created:
+            return Response(resp_body, status=status.HTTP_200_OK)
+        message_service.schedule_reply(session.pk, user.id)
         return Response(resp_body, status=status.HTTP_201_CREATED)
 
     def _schedule_debounced_reply(self, session_id, user_id):
@@ -166,7 +129,7 @@ class MessageViewSet(viewsets.ModelViewSet):
 
         try:
             # 记录用户最近一次主动消息时间（用于主动触发暂停）
-            cache.set(f"last_user_message_at:{user.id}", timezone.now().timestamp(), timeout=3600)
+            cache.set(f"last_user_message_at:{user.id}", int(timezone.now().timestamp()), timeout=3600)
 
             # 让 LLM 生成单条回复，避免刷屏（加入低能量概率）
             chunks = self._ai_reply_chunks(content, content_type)
@@ -206,23 +169,10 @@ class MessageViewSet(viewsets.ModelViewSet):
                     # 入库图片消息并推送
                     ai_img = Message.objects.create(session=session, content=img['image_url'], content_type='image', sender='ai')
                     ai_messages.append(ai_img)
-                    async_to_sync(channel_layer.group_send)(
-                        f"chat_{session.id}",
-                        {
-                            'type': 'chat.message',
-                            'message': {
-                                'id': ai_img.id,
-                                'content': img['image_url'],
-                                'sender': 'ai',
-                                'content_type': 'image',
-                                'timestamp': ai_img.timestamp.isoformat(),
-                                'text': desc,
-                            }
-                        }
-                    )
+                    session_events.broadcast_message(ai_img, extra={'text': desc})
                     # 记录AI消息时间
                     now_ts = timezone.now().timestamp()
-                    cache.set(f"last_ai_message_at:{user.id}", now_ts, timeout=3600)
+                    cache.set(f"last_ai_message_at:{user.id}", int(now_ts), timeout=3600)
                     cache.set(f"last_ai_message_at_session:{session.id}", now_ts, timeout=3600)
 
             # 仅保留首条文本作为即时广播
@@ -239,21 +189,11 @@ class MessageViewSet(viewsets.ModelViewSet):
             for text_part in chunks:
                 ai_msg = Message.objects.create(session=session, content=text_part, content_type='text', sender='ai')
                 ai_msgs.append(ai_msg)
-                payload = {
-                    'type': 'chat.message',
-                    'message': {
-                        'id': ai_msg.id,
-                        'content': text_part,
-                        'sender': 'ai',
-                        'content_type': 'text',
-                        'timestamp': ai_msg.timestamp.isoformat()
-                    }
-                }
                 # 仅推送到会话组，避免重复（同一连接通常同时在用户组与会话组）
-                async_to_sync(channel_layer.group_send)(f"chat_{session.id}", payload)
+                session_events.broadcast_message(ai_msg)
                 # 记录AI消息时间
                 now_ts = timezone.now().timestamp()
-                cache.set(f"last_ai_message_at:{user.id}", now_ts, timeout=3600)
+                cache.set(f"last_ai_message_at:{user.id}", int(now_ts), timeout=3600)
                 cache.set(f"last_ai_message_at_session:{session.id}", now_ts, timeout=3600)
 
             # 关闭打字中状态
@@ -276,7 +216,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             # 确保释放锁
             cache.delete(lock_key)
 
-    def _ai_reply_chunks(self, text: str, content_type: str):
+    def _ai_reply_chunks(self, text: str, content_type: str, session_id=None):
         # 动态补充高情商示例作为few-shots（若已缓存则复用）
         exemplars = load_exemplars()
         if not exemplars:
@@ -334,7 +274,11 @@ class MessageViewSet(viewsets.ModelViewSet):
                 '5) 避免重复使用相同的回复模式。'
             )
             # 获取最近的对话历史，提供上下文
-            recent_context = self._get_recent_conversation_context(text)
+            recent_context = self._get_recent_conversation_context(text, session_id)
+            # 只注入与当前消息相关的用户记忆
+            memory_context = self._get_relevant_memory_context(text, session_id)
+            if memory_context:
+                recent_context = memory_context + "\n\n" + recent_context
             
             msgs = [
                 {"Role": "system", "Content": get_system_prompt()},
@@ -516,7 +460,7 @@ class MessageViewSet(viewsets.ModelViewSet):
 
                 # 生成候选句子
                 logger.info(f"开始调用AI生成回复，用户输入: {combined_text}")
-                chunks = self._ai_reply_chunks(combined_text, 'text') or ["嗯嗯我在"]
+                chunks = self._ai_reply_chunks(combined_text, 'text', session_id) or ["嗯嗯我在"]
                 logger.info(f"AI回复生成完成，chunks数量: {len(chunks)}")
                 # 微信聊天低能量概率：适度降低，确保AI正常调用
                 try:
@@ -559,22 +503,9 @@ class MessageViewSet(viewsets.ModelViewSet):
                         photo_url = self._random_mira_photo()
                         if photo_url:
                             ai_img = Message.objects.create(session_id=session_id, content=photo_url, content_type='image', sender='ai')
-                            async_to_sync(channel_layer.group_send)(
-                                f"chat_{session_id}",
-                                {
-                                    'type': 'chat.message',
-                                    'message': {
-                                        'id': ai_img.id,
-                                        'content': photo_url,
-                                        'sender': 'ai',
-                                        'content_type': 'image',
-                                        'timestamp': ai_img.timestamp.isoformat(),
-                                        'text': '今天的我来一张，好看吗？',
-                                    }
-                                }
-                            )
+                            session_events.broadcast_message(ai_img, extra={'text': '今天的我来一张，好看吗？'})
                             now_ts = timezone.now().timestamp()
-                            cache.set(f"last_ai_message_at:{user_id}", now_ts, timeout=3600)
+                            cache.set(f"last_ai_message_at:{user_id}", int(now_ts), timeout=3600)
                             cache.set(f"last_ai_message_at_session:{session_id}", now_ts, timeout=3600)
                 except Exception:
                     pass
@@ -597,20 +528,7 @@ class MessageViewSet(viewsets.ModelViewSet):
                             photo_url = self._random_life_scene_photo(desc)
                             if photo_url:
                                 ai_img = Message.objects.create(session_id=session_id, content=photo_url, content_type='image', sender='ai')
-                                async_to_sync(channel_layer.group_send)(
-                                    f"chat_{session_id}",
-                                    {
-                                        'type': 'chat.message',
-                                        'message': {
-                                            'id': ai_img.id,
-                                            'content': photo_url,
-                                            'sender': 'ai',
-                                            'content_type': 'image',
-                                            'timestamp': ai_img.timestamp.isoformat(),
-                                            'text': f'随手拍的{desc}',
-                                        }
-                                    }
-                                )
+                                session_events.broadcast_message(ai_img, extra={'text': f'随手拍的{desc}'})
                                 continue  # 跳过文字版本
 
                     ai_msg = Message.objects.create(session_id=session_id, content=text_part, content_type='text', sender='ai')
@@ -618,20 +536,10 @@ class MessageViewSet(viewsets.ModelViewSet):
                     # 记录AI发送的消息
                     ai_logger.info(f"AI消息已发送 | 会话ID: {session_id} | 用户ID: {user_id} | 消息ID: {ai_msg.id} | 内容: {text_part}")
                     
-                    payload = {
-                        'type': 'chat.message',
-                        'message': {
-                            'id': ai_msg.id,
-                            'content': text_part,
-                            'sender': 'ai',
-                            'content_type': 'text',
-                            'timestamp': ai_msg.timestamp.isoformat()
-                        }
-                    }
-                    async_to_sync(channel_layer.group_send)(f"chat_{session_id}", payload)
+                    session_events.broadcast_message(ai_msg)
 
                     now_ts2 = timezone.now().timestamp()
-                    cache.set(f"last_ai_message_at:{user_id}", now_ts2, timeout=3600)
+                    cache.set(f"last_ai_message_at:{user_id}", int(now_ts2), timeout=3600)
                     cache.set(f"last_ai_message_at_session:{session_id}", now_ts2, timeout=3600)
 
                 # 形象照：若命中触发词且未命中频控，则随机发送一张生活照
@@ -644,20 +552,7 @@ class MessageViewSet(viewsets.ModelViewSet):
                             # 记录AI发送的图片消息
                             ai_logger.info(f"AI图片消息已发送 | 会话ID: {session_id} | 用户ID: {user_id} | 消息ID: {ai_img.id} | 图片URL: {photo_url}")
                             
-                            async_to_sync(channel_layer.group_send)(
-                                f"chat_{session_id}",
-                                {
-                                    'type': 'chat.message',
-                                    'message': {
-                                        'id': ai_img.id,
-                                        'content': photo_url,
-                                        'sender': 'ai',
-                                        'content_type': 'image',
-                                        'timestamp': ai_img.timestamp.isoformat(),
-                                        'text': '给你看看我最近的一张生活照，好看吗宝宝？',
-                                    }
-                                }
-                            )
+                            session_events.broadcast_message(ai_img, extra={'text': '给你看看我最近的一张生活照，好看吗宝宝？'})
                 except Exception:
                     pass
 
@@ -728,11 +623,31 @@ class MessageViewSet(viewsets.ModelViewSet):
         # 默认返回街景
         return scene_photos.get('街景', '')
     
-    def _get_recent_conversation_context(self, current_text: str) -> str:
+    def _get_relevant_memory_context(self, current_text: str, session_id=None) -> str:
+        """按当前消息挑选相关的用户记忆，没有相关记忆时返回空字符串"""
+        try:
+            if session_id is None and getattr(self, 'request', None) is not None:
+                session_id = self.request.data.get('session_id')
+            info = session_resolver.resolve(session_id) if session_id else None
+            if info is None or not current_text:
+                return ""
+            # 记忆在提示词中只占固定的字符预算，上游耗时不随记忆长短波动
+            memories = memory_manager.select_memories_within_budget(
+                User(pk=info.owner_id), self.PROMPT_MEMORY_BUDGET, query=current_text
+            )
+            if not memories:
+                return ""
+            return "你记得关于对方的事：\n" + memory_manager.render_memory_lines(memories)
+        except Exception as e:
+            logger.error(f"获取相关记忆失败: {e}")
+            return ""
+
+    def _get_recent_conversation_context(self, current_text: str, session_id=None) -> str:
         """获取最近对话上下文，帮助AI理解话题连续性"""
         try:
-            # 从请求数据中获取session_id
-            session_id = self.request.data.get('session_id')
+            # 后台生成时由调用方传入会话主键；否则从请求数据中获取session_id
+            if session_id is None and getattr(self, 'request', None) is not None:
+                session_id = self.request.data.get('session_id')
             if not session_id:
                 return "对话上下文：新对话开始"
             
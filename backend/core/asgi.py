@@ -12,8 +12,12 @@ from channels.auth import AuthMiddlewareStack
 # 先构建 Django ASGI，再导入依赖 models 的 routing，避免应用尚未加载
 django_asgi_app = get_asgi_application()
 
+from django.apps import apps  # noqa: E402
 from chat_system.routing import websocket_urlpatterns  # noqa: E402
 
+# 服务进程启动后台服务（主动触发引擎、活动消费者、记忆提取）
+apps.get_app_config('chat_system').start_background_services()
+
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": URLRouter(websocket_urlpatterns),
@@ -73,6 +73,10 @@ CACHES = {
     }
 }
 
+# 后台服务（主动触发引擎、用户活动消费者、后台记忆提取）只由服务入口 core/asgi.py、core/wsgi.py 启动，
+# 管理命令不会启动；后台服务单独部署或只让部分实例运行时设置 MIRA_BACKGROUND_SERVICES=0 关闭
+BACKGROUND_SERVICES = os.environ.get('MIRA_BACKGROUND_SERVICES', '1') != '0'
+
 # 根URL配置
 ROOT_URLCONF = 'core.urls'
 
@@ -4,8 +4,12 @@ WSGI配置 for Mira-Eva 项目
 
 import os
 
+from django.apps import apps
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_wsgi_application()
+
+# 服务进程（含 runserver）启动后台服务（主动触发引擎、活动消费者、记忆提取）
+apps.get_app_config('chat_system').start_background_services()
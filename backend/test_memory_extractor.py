@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+后台记忆提取测试脚本
+测试大量待提取会话的查询、超长增量的水位推进与提取锁的释放
+（大模型调用以桩代替，测试数据在结束时删除）
+"""
+
+import os
+import sys
+import django
+import json
+import re
+from datetime import timedelta
+from unittest import mock
+
+# 设置Django环境
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+django.setup()
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+from chat_system.models import ChatSession, Message, MemoryExtractionWatermark
+from ai_engine.memory_extractor import MemoryExtractor
+
+USERNAME = 'memory_extractor_test'
+prompts = []
+
+
+def print_section(title):
+    """打印测试章节标题"""
+    print(f"\n{'='*60}")
+    print(f"🧪 {title}")
+    print(f"{'='*60}")
+
+
+def fake_chat(self, messages, **kwargs):
+    """大模型桩：记录提示词，每段返回空记忆"""
+    prompt = messages[0]['Content']
+    prompts.append(prompt)
+    labels = re.findall(r'【(S\d+)】', prompt)
+    return {'success': True, 'text': json.dumps({label: [] for label in labels})}
+
+
+def make_extractor():
+    """使用测试专用的集合与锁，不影响正在运行的提取线程"""
+    extractor = MemoryExtractor()
+    extractor.DIRTY_KEY = 'test_memory_dirty_sessions'
+    extractor.URGENT_KEY = 'test_memory_urgent_sessions'
+    extractor.LOCK_KEY = 'test_memory_extractor_lock'
+    return extractor
+
+
+def create_sessions(user, count, prefix):
+    ChatSession.objects.bulk_create([
+        ChatSession(user=user, session_id=f"{prefix}_{i}") for i in range(count)
+    ])
+    return list(ChatSession.objects.filter(session_id__startswith=f"{prefix}_").order_by('id'))
+
+
+def test_many_dirty_sessions(user):
+    """超过 1000 个待提取会话：水位条件分批查询，不触发 SQLite 表达式树深度上限"""
+    print_section("大量待提取会话")
+
+    extractor = make_extractor()
+    sessions = create_sessions(user, 1200, 'extractor_many')
+    idle_at = timezone.now() - timedelta(seconds=extractor.IDLE_SECONDS + 60)
+    Message.objects.bulk_create([
+        Message(session=session, sender='user', content=f"今天第{i}次聊天")
+        for i, session in enumerate(sessions)
+    ])
+    Message.objects.filter(session__in=sessions).update(timestamp=idle_at)
+    for session in sessions:
+        extractor.mark_dirty(session.pk)
+
+    with mock.patch('ai_engine.memory_extractor.TencentDeepSeekClient.chat', fake_chat):
+        processed = extractor.process_once()
+    watermarks = MemoryExtractionWatermark.objects.filter(session__in=sessions).count()
+    remaining = extractor._members(extractor.DIRTY_KEY, extractor._local_dirty)
+
+    print(f"📊 会话数: {len(sessions)}，本轮完成: {processed}，水位: {watermarks}，剩余待提取: {len(remaining)}")
+    assert processed == len(sessions)
+    assert watermarks == len(sessions)
+    assert not remaining & {session.pk for session in sessions}
+    print("✅ 通过")
+
+
+def test_long_delta(user):
+    """增量超过 MAX_CHARS_PER_CALL：水位只推进到放入文本的最后一条，剩余消息下一轮提取"""
+    print_section("超长增量")
+
+    extractor = make_extractor()
+    session = create_sessions(user, 1, 'extractor_long')[0]
+    contents = [f"第{i}条：" + '很长的消息' * 200 for i in range(10)]
+    Message.objects.bulk_create([Message(session=session, sender='user', content=c) for c in contents])
+    message_ids = list(Message.objects.filter(session=session).order_by('id').values_list('id', flat=True))
+
+    seen = []
+    with mock.patch('ai_engine.memory_extractor.TencentDeepSeekClient.chat', fake_chat):
+        for round_no in range(1, 6):
+            extractor.mark_dirty(session.pk, urgent=True)
+            if not extractor.process_once():
+                break
+            last_id = MemoryExtractionWatermark.objects.get(session=session).last_message_id
+            seen.extend(c for c in contents if c in prompts[-1])
+            print(f"  第{round_no}轮: 水位 -> 第{message_ids.index(last_id) + 1}条")
+
+    print(f"📊 提取到的消息: {len(seen)}/{len(contents)}")
+    assert seen == contents
+    assert all(len(prompt) < extractor.MAX_CHARS_PER_CALL + 2000 for prompt in prompts)
+    print("✅ 通过")
+
+
+def test_lock_token():
+    """锁过期并被其他进程取得后，原持有者释放时不会删掉对方的锁"""
+    print_section("提取锁")
+
+    first, second = make_extractor(), make_extractor()
+    cache.delete(first.LOCK_KEY)
+    token = first.acquire_lock()
+    assert token and second.acquire_lock() is None
+
+    cache.delete(first.LOCK_KEY)  # 模拟锁过期
+    other = second.acquire_lock()
+    first.release_lock(token)
+    held = second.acquire_lock() is None
+    print(f"🔒 过期后原持有者释放，新持有者仍持有锁: {held}")
+    assert held
+    second.release_lock(other)
+    assert first.acquire_lock() is not None
+    cache.delete(first.LOCK_KEY)
+    print("✅ 通过")
+
+
+def main():
+    User.objects.filter(username=USERNAME).delete()
+    user = User.objects.create(username=USERNAME)
+    try:
+        test_many_dirty_sessions(user)
+        test_long_delta(user)
+        test_lock_token()
+    finally:
+        user.delete()
+    print("\n🎉 后台记忆提取测试全部通过")
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except AssertionError:
+        print("❌ 测试失败")
+        raise
+    sys.exit(0)
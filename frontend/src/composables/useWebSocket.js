@@ -6,13 +6,16 @@ export function useWebSocket() {
   const messages = ref([])
   const typing = ref({ ai: false, user: false })
   const sessionId = ref(null)
+  const lastSeq = ref(0) // 已收到的最大会话序号，重连时据此只补发缺失的消息
   let isConnecting = false
   let heartbeatTimer = null
   let reconnectTimer = null
   let reconnectAttempts = 0
   const maxReconnectDelay = 30000 // 30s
+  const ackTimeout = 5000 // 上行消息等待 ack 的超时
+  const pendingAcks = new Map() // client_msg_id -> { resolve, timer }
   
-  const connect = (sessionIdParam) => {
+  const connect = (sessionIdParam, lastSeqParam) => {
     if (!sessionIdParam) {
       console.error('缺少session_id参数')
       return
@@ -27,9 +30,18 @@ export function useWebSocket() {
       disconnect()
     }
 
+    if (sessionId.value !== sessionIdParam) {
+      lastSeq.value = 0
+    }
+    if (lastSeqParam) {
+      lastSeq.value = Math.max(lastSeq.value, lastSeqParam)
+    }
     sessionId.value = sessionIdParam
-    // 使用相对路径，让Vite代理处理WebSocket连接
-    const wsUrl = `ws://localhost:3001/ws/chat/${sessionIdParam}/`
+    // 使用相对路径，让Vite代理处理WebSocket连接；JWT 在连接建立后以首帧 auth 发送，不放进 URL
+    const params = new URLSearchParams()
+    if (lastSeq.value) params.set('last_seq', String(lastSeq.value))
+    const qs = params.toString()
+    const wsUrl = `ws://localhost:3001/ws/chat/${sessionIdParam}/` + (qs ? `?${qs}` : '')
     
     try {
       isConnecting = true
@@ -40,6 +52,11 @@ export function useWebSocket() {
         isConnected.value = true
         isConnecting = false
         reconnectAttempts = 0
+        // 首帧认证，之后才能通过 WS 上行消息
+        const token = localStorage.getItem('auth_token')
+        if (token) {
+          ws.value.send(JSON.stringify({ type: 'auth', token }))
+        }
         // 启动心跳：每30秒发送一次ping
         clearInterval(heartbeatTimer)
         heartbeatTimer = setInterval(() => {
@@ -60,10 +77,26 @@ export function useWebSocket() {
           
           // 处理不同类型的消息
           if (data.type === 'chat_message') {
+            if (data.message && data.message.seq) {
+              lastSeq.value = Math.max(lastSeq.value, data.message.seq)
+            }
             messages.value.push(data.message)
+          } else if (data.type === 'resume_complete') {
+            // 重连补发完成
+            console.log('补发消息数:', data.count)
           } else if (data.type === 'typing_status') {
             const who = data.sender || 'ai'
             typing.value[who] = !!data.is_typing
+          } else if (data.type === 'chat_ack') {
+            // 上行消息确认
+            const pending = pendingAcks.get(data.client_msg_id)
+            if (pending) {
+              clearTimeout(pending.timer)
+              pendingAcks.delete(data.client_msg_id)
+              pending.resolve(data)
+            }
+          } else if (data.type === 'auth_result') {
+            if (!data.success) console.warn('WebSocket认证失败，上行消息将改走REST')
           } else if (data.type === 'pong') {
             // 心跳响应
             // console.debug('收到pong')
@@ -83,14 +116,16 @@ export function useWebSocket() {
         }
       }
       
-      ws.value.onclose = () => {
+      ws.value.onclose = (event) => {
         console.log('WebSocket连接已关闭')
         isConnected.value = false
         isConnecting = false
         clearInterval(heartbeatTimer)
         heartbeatTimer = null
-        // 自动重连（指数退避）
-        const delay = Math.min(1000 * Math.pow(2, reconnectAttempts), maxReconnectDelay)
+        // 自动重连（指数退避）；4008 为服务端因读取过慢主动断开，立即重连并按 lastSeq 补发
+        const delay = event && event.code === 4008
+          ? 500
+          : Math.min(1000 * Math.pow(2, reconnectAttempts), maxReconnectDelay)
         reconnectAttempts += 1
         clearTimeout(reconnectTimer)
         reconnectTimer = setTimeout(() => {
@@ -124,21 +159,30 @@ export function useWebSocket() {
     }
   }
   
+  // 通过 WS 上行消息，返回 Promise<ack>；未连接、发送失败或超时时 ack.success 为 false，调用方可退回 REST
   const sendMessage = (messageData) => {
-    if (ws.value && isConnected.value) {
+    return new Promise((resolve) => {
+      const clientMsgId = messageData.client_msg_id
+      if (!ws.value || !isConnected.value || !clientMsgId) {
+        resolve({ success: false, client_msg_id: clientMsgId })
+        return
+      }
       try {
         const message = {
           type: 'chat_message',
           ...messageData
         }
+        const timer = setTimeout(() => {
+          pendingAcks.delete(clientMsgId)
+          resolve({ success: false, client_msg_id: clientMsgId, message: 'ack超时' })
+        }, ackTimeout)
+        pendingAcks.set(clientMsgId, { resolve, timer })
         ws.value.send(JSON.stringify(message))
-        return true
       } catch (error) {
         console.error('发送WebSocket消息失败:', error)
-        return false
+        resolve({ success: false, client_msg_id: clientMsgId })
       }
-    }
-    return false
+    })
   }
   
   const sendTypingStatus = (isTyping) => {
@@ -197,6 +241,7 @@ export function useWebSocket() {
     isConnected,
     messages,
     typing,
-    sessionId
+    sessionId,
+    lastSeq
   }
 }